@@ -0,0 +1,16 @@
+from datetime import datetime
+from src.models.user import db
+from src.models.download import Download, LicenseKey
+
+def archive_table(model, name):
+    """Mirror a model's columns into an unconstrained archive table"""
+    columns = [
+        db.Column(column.name, column.type, primary_key=column.primary_key)
+        for column in model.__table__.columns
+    ]
+    columns.append(db.Column('archived_at', db.DateTime, default=datetime.utcnow, index=True))
+    return db.Table(name, db.metadata, *columns)
+
+# Expired/exhausted rows are moved here by the maintenance sweeper
+download_archive = archive_table(Download, 'download_archive')
+license_key_archive = archive_table(LicenseKey, 'license_key_archive')
@@ -0,0 +1,310 @@
+"""
+ASGI serving mode
+
+    uvicorn src.asgi:application
+
+The I/O-bound routes are served by native async handlers: file downloads are
+streamed chunk by chunk and Stripe calls are awaited, so one process can keep
+thousands of slow clients open. Downloads go through the same delivery
+scheduler (bandwidth caps, smallest-first) as the WSGI path. Their database work still runs through the
+same sync helpers as the Flask views, in a worker thread. Every other route
+falls through to the Flask app via WsgiToAsgi.
+"""
+import asyncio
+import os
+import re
+import sys
+from contextlib import aclosing
+from http.cookies import SimpleCookie
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import stripe
+from asgiref.wsgi import WsgiToAsgi
+from itsdangerous import BadSignature
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
+from werkzeug.wrappers import Response
+from src.main import app
+from src.profiler import get_profiler
+from src.routes.download import prepare_file_download
+from src.routes.payment import attach_payment_intent, complete_payment, is_final, prepare_payment_intent
+from src.idempotency import HEADER as IDEMPOTENCY_HEADER, IdempotencyError, abandon, begin, complete
+
+wsgi_application = WsgiToAsgi(app)
+
+CONDITIONAL_HEADERS = ('range', 'if-range', 'if-match', 'if-none-match', 'if-modified-since', 'if-unmodified-since')
+
+
+async def run_sync(func, *args):
+    """Run blocking app code (database work) in a worker thread inside an app context"""
+    def call():
+        with app.app_context():
+            return func(*args)
+    return await asyncio.to_thread(call)
+
+
+def render_error(func):
+    """Wrap a (result, error response) helper so errors come back as plain values
+
+    The Flask response is rendered inside the worker thread, so nothing bound
+    to the request's database session leaks out of it.
+    """
+    def call(*args):
+        result, error = func(*args)
+        if error is not None:
+            response = app.make_response(error)
+            error = (response.status_code, response.get_data(), response.headers.get('Content-Type'))
+        return result, error
+    return call
+
+
+async def call_stripe(resource, method, *args, **kwargs):
+    """Await a Stripe API call, using the SDK's native async variant when available"""
+    async_method = getattr(resource, f'{method}_async', None)
+    if async_method is not None:
+        return await async_method(*args, **kwargs)
+    return await asyncio.to_thread(getattr(resource, method), *args, **kwargs)
+
+
+def header(scope, name):
+    for key, value in scope['headers']:
+        if key == name:
+            return value.decode('latin-1')
+    return None
+
+
+def load_session(scope):
+    """Decode the Flask session cookie"""
+    cookie_header = header(scope, b'cookie')
+    if not cookie_header:
+        return {}
+    cookies = SimpleCookie()
+    cookies.load(cookie_header)
+    morsel = cookies.get(app.config['SESSION_COOKIE_NAME'])
+    if morsel is None:
+        return {}
+    serializer = app.session_interface.get_signing_serializer(app)
+    try:
+        return serializer.loads(morsel.value, max_age=int(app.permanent_session_lifetime.total_seconds()))
+    except BadSignature:
+        return {}
+
+
+async def read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            break
+    return body
+
+
+def parse_json(body):
+    if not body:
+        return None
+    try:
+        return app.json.loads(body)
+    except ValueError:
+        return None
+
+
+def base_headers(scope, content_type=None):
+    headers = [(b'content-type', content_type.encode('latin-1'))] if content_type else []
+    # Mirror CORS(app, supports_credentials=True) for the routes served here
+    origin = header(scope, b'origin')
+    if origin:
+        headers += [
+            (b'access-control-allow-origin', origin.encode('latin-1')),
+            (b'access-control-allow-credentials', b'true'),
+            (b'vary', b'Origin'),
+        ]
+    return headers
+
+
+async def send_body(scope, send, status, body, content_type='application/json', extra_headers=()):
+    headers = base_headers(scope, content_type) + list(extra_headers)
+    headers.append((b'content-length', str(len(body)).encode('latin-1')))
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def send_json(scope, send, data, status=200):
+    await send_body(scope, send, status, app.json.dumps_bytes(data))
+
+
+async def send_error(scope, send, error):
+    status, body, content_type = error
+    await send_body(scope, send, status, body, content_type or 'application/json')
+
+
+def conditional_response(scope, delivery):
+    """An empty Response with the status and headers werkzeug picks for the
+    request's Range and If-* headers, as make_conditional does for WSGI"""
+    environ = {'REQUEST_METHOD': scope['method']}
+    for name in CONDITIONAL_HEADERS:
+        value = header(scope, name.encode('latin-1'))
+        if value is not None:
+            environ['HTTP_' + name.upper().replace('-', '_')] = value
+    response = Response(headers=delivery.headers())
+    response.make_conditional(environ, accept_ranges=True, complete_length=delivery.size)
+    if response.status_code == 304:
+        del response.headers['Content-Length']
+    return response
+
+
+async def stream_file(scope, send, delivery):
+    """Stream a file without tying up a thread for the whole transfer"""
+    try:
+        if delivery.remote_url:
+            headers = base_headers(scope, 'text/plain')
+            headers.append((b'location', delivery.remote_url.encode('latin-1')))
+            await send({'type': 'http.response.start', 'status': 302, 'headers': headers})
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+
+        try:
+            response = conditional_response(scope, delivery)
+        except RequestedRangeNotSatisfiable:
+            return await send_body(scope, send, 416, app.json.dumps_bytes({'error': 'Requested range not satisfiable'}),
+                                   extra_headers=[(b'content-range', f'bytes */{delivery.size}'.encode('latin-1'))])
+        headers = base_headers(scope)
+        headers += [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                    for name, value in response.headers.to_wsgi_list()]
+        await send({'type': 'http.response.start', 'status': response.status_code, 'headers': headers})
+        if response.status_code == 304 or scope['method'] == 'HEAD':
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+        start, length = (response.content_range.start, response.content_length) \
+            if response.status_code == 206 else (0, None)
+        async with aclosing(delivery.aiter_chunks(start, length)) as chunks:
+            async for chunk in chunks:
+                # Awaiting send applies the client's backpressure
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    except OSError:
+        pass  # Client went away mid-transfer
+    finally:
+        delivery.close()
+
+
+async def download_file(scope, receive, send, download_token):
+    delivery, error = await run_sync(render_error(prepare_file_download), download_token)
+    if error:
+        return await send_error(scope, send, error)
+    await stream_file(scope, send, delivery)
+
+
+async def respond_idempotent(scope, send, user_id, name, body, handler):
+    """Send handler()'s (data, status, final), honouring an Idempotency-Key like the Flask views
+
+    Responses that aren't final release the key instead of being stored.
+    """
+    key = header(scope, IDEMPOTENCY_HEADER.lower().encode('latin-1'))
+    if key is None:
+        data, status, _ = await handler(None)
+        return await send_json(scope, send, data, status)
+
+    try:
+        claim, stored = await run_sync(begin, user_id, name, key, body)
+    except IdempotencyError as e:
+        return await send_json(scope, send, {'error': e.message}, e.status_code)
+    if stored is not None:
+        return await send_body(scope, send, stored.status_code, stored.body,
+                               extra_headers=[(b'idempotent-replayed', b'true')])
+
+    try:
+        data, status, final = await handler(f'{user_id}:{name}:{key}')
+    except BaseException:
+        await run_sync(abandon, claim)
+        raise
+    payload = app.json.dumps_bytes(data)
+    await run_sync(complete, claim, status, payload, final)
+    await send_body(scope, send, status, payload)
+
+
+async def create_payment_intent(scope, receive, send):
+    user_id = load_session(scope).get('user_id')
+    if user_id is None:
+        return await send_json(scope, send, {'error': 'Authentication required'}, 401)
+    body = await read_body(receive)
+
+    async def handler(stripe_key):
+        try:
+            params, error = await run_sync(prepare_payment_intent, user_id)
+            if error:
+                return (*error, True)
+
+            intent = await call_stripe(stripe.PaymentIntent, 'create', **params, idempotency_key=stripe_key)
+
+            return await run_sync(attach_payment_intent, params['metadata']['order_id'], intent), 200, True
+        except stripe.error.StripeError as e:
+            return {'error': str(e)}, 400, False
+        except Exception:
+            return {'error': 'Payment intent creation failed'}, 500, False
+
+    await respond_idempotent(scope, send, user_id, 'create-payment-intent', body, handler)
+
+
+async def confirm_payment(scope, receive, send):
+    user_id = load_session(scope).get('user_id')
+    if user_id is None:
+        return await send_json(scope, send, {'error': 'Authentication required'}, 401)
+    body = await read_body(receive)
+
+    async def handler(stripe_key):
+        data = parse_json(body)
+        if not data or 'payment_intent_id' not in data:
+            return {'error': 'Payment intent ID required'}, 400, True
+
+        try:
+            intent = await call_stripe(stripe.PaymentIntent, 'retrieve', data['payment_intent_id'])
+
+            return (*await run_sync(complete_payment, intent, user_id), is_final(intent))
+        except stripe.error.StripeError as e:
+            return {'error': f'Stripe error: {str(e)}'}, 400, False
+        except Exception:
+            return {'error': 'Payment confirmation failed'}, 500, False
+
+    await respond_idempotent(scope, send, user_id, 'confirm-payment', body, handler)
+
+
+ASYNC_ROUTES = [
+    ('GET', re.compile(r'^/api/downloads/(?P<download_token>[^/]+)$'), download_file),
+    ('POST', re.compile(r'^/api/payment/create-payment-intent$'), create_payment_intent),
+    ('POST', re.compile(r'^/api/payment/confirm-payment$'), confirm_payment),
+]
+
+# The Flask endpoints the routes above take over, their requests never reach
+# wsgi_app and so can't be sampled by the profiler
+get_profiler(app).exclude(
+    ['download.download_file', 'payment.create_payment_intent', 'payment.confirm_payment'],
+    'served by a native async handler in SERVER_MODE=asgi'
+)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            write_behind = app.extensions.get('write_behind')
+            if write_behind is not None:
+                await asyncio.to_thread(write_behind.close)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+
+    if scope['type'] == 'http':
+        for method, pattern, handler in ASYNC_ROUTES:
+            if scope['method'] != method:
+                continue
+            match = pattern.match(scope['path'])
+            if match:
+                return await handler(scope, receive, send, **match.groupdict())
+
+    await wsgi_application(scope, receive, send)
@@ -1,5 +1,7 @@
 from flask import Blueprint, jsonify, request, session
 from src.models.user import User, db
+from src.write_behind import get_write_behind
+from sqlalchemy.orm.attributes import set_committed_value
 from datetime import datetime
 import re
 
@@ -102,9 +104,10 @@ def login():
     if not user.is_active:
         return jsonify({'error': 'Account is deactivated'}), 401
     
-    # Update last login
-    user.last_login = datetime.utcnow()
-    db.session.commit()
+    # Update last login, batched with other logins instead of a commit per request
+    now = datetime.utcnow()
+    get_write_behind().set(User, user.id, last_login=now)
+    set_committed_value(user, 'last_login', now)  # Show it without dirtying the session
     
     # Create session
     session['user_id'] = user.id
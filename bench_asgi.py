@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Benchmark the ASGI serving mode against the WSGI path
+
+Both servers run a single process against a local Stripe mock that answers
+after a fixed delay, and are hit with concurrent create-payment-intent calls.
+Requires uvicorn and httpx.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+sys.path.insert(0, os.path.dirname(__file__))
+
+# Use a throwaway database, never the development one
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}")
+
+import httpx
+import stripe
+import uvicorn
+from werkzeug.serving import make_server
+from src.asgi import application
+from src.main import app
+from src.models.user import db, User
+from src.models.product import Product
+from src.models.order import Order, OrderItem
+
+STRIPE_LATENCY = 0.2  # seconds per mocked Stripe call
+USERS = 200
+CONCURRENCY = 200
+
+
+class StripeMock(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        time.sleep(STRIPE_LATENCY)
+        body = json.dumps({
+            'id': 'pi_mock', 'object': 'payment_intent', 'amount': 2999,
+            'client_secret': 'pi_mock_secret', 'status': 'requires_payment_method'
+        }).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_stripe_mock():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StripeMock)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    stripe.api_base = f'http://127.0.0.1:{server.server_port}'
+    return server
+
+
+def seed():
+    """One user with a pending cart per concurrent client, returns their session cookies"""
+    with app.app_context():
+        product = Product(name='Bench Product', price=29.99)
+        db.session.add(product)
+        db.session.flush()
+        for n in range(USERS):
+            user = User(username=f'bench{n}', email=f'bench{n}@example.com')
+            user.set_password('bench12345')
+            db.session.add(user)
+            db.session.flush()
+            order = Order(user_id=user.id, total_amount=29.99, status='pending')
+            db.session.add(order)
+            db.session.flush()
+            db.session.add(OrderItem(order_id=order.id, product_id=product.id, price=29.99))
+        db.session.commit()
+
+    cookies = []
+    for n in range(USERS):
+        client = app.test_client()
+        client.post('/api/auth/login', json={'username': f'bench{n}', 'password': 'bench12345'})
+        cookies.append(client.get_cookie(app.config['SESSION_COOKIE_NAME']).value)
+    return cookies
+
+
+async def hammer(base_url, cookies):
+    latencies = []
+
+    async def one(client, cookie):
+        started = time.perf_counter()
+        response = await client.post(
+            f'{base_url}/api/payment/create-payment-intent',
+            headers={'Cookie': f"{app.config['SESSION_COOKIE_NAME']}={cookie}"}
+        )
+        response.raise_for_status()
+        latencies.append(time.perf_counter() - started)
+
+    limits = httpx.Limits(max_connections=CONCURRENCY)
+    async with httpx.AsyncClient(timeout=600, limits=limits) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(one(client, cookie) for cookie in cookies[:CONCURRENCY]))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'elapsed_s': round(elapsed, 2),
+        'req_per_s': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(latencies[len(latencies) // 2] * 1000, 1),
+        'p99_ms': round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 1),
+    }
+
+
+def bench_wsgi(cookies):
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, app, threaded=False)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        return asyncio.run(hammer(f'http://127.0.0.1:{server.server_port}', cookies))
+    finally:
+        server.shutdown()
+
+
+def bench_asgi(cookies):
+    config = uvicorn.Config(application, host='127.0.0.1', port=8765, log_level='warning')
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    try:
+        return asyncio.run(hammer('http://127.0.0.1:8765', cookies))
+    finally:
+        server.should_exit = True
+        thread.join()
+
+
+if __name__ == '__main__':
+    start_stripe_mock()
+    cookies = seed()
+    print(f"Stripe latency {STRIPE_LATENCY * 1000:.0f} ms, {CONCURRENCY} concurrent clients")
+    print(f"WSGI (1 sync worker): {bench_wsgi(cookies)}")
+    print(f"ASGI (1 process):     {bench_asgi(cookies)}")
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Benchmark bulk catalog import/export against a scratch SQLite database
+
+    python bench_catalog.py [ROWS]
+
+Generates a ROWS-line product CSV (default 1,000,000) and reports import and
+export throughput plus peak RSS, which stays flat as ROWS grows.
+"""
+import os
+import sys
+import tempfile
+import time
+import resource
+sys.path.insert(0, os.path.dirname(__file__))
+
+CATEGORIES = ['E-books', 'Software', 'Templates', 'Courses', 'Music', 'Graphics']
+
+
+def generate_csv(path, rows):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('name,description,price,is_active,category,file_name,file_size,download_limit\n')
+        for i in range(rows):
+            f.write(f'Product {i},Generated product number {i},{(i % 9000) / 100 + 1:.2f},true,'
+                    f'{CATEGORIES[i % len(CATEGORIES)]},product_{i}.zip,{i * 1024},5\n')
+
+
+def peak_rss_mb():
+    # ru_maxrss is KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    workdir = tempfile.mkdtemp(prefix='bench-catalog-')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+
+    from src.main import app
+    from src.catalog_io import export_catalog, import_catalog
+
+    csv_path = os.path.join(workdir, 'products.csv')
+    generate_csv(csv_path, rows)
+    size_mb = os.path.getsize(csv_path) / (1024 * 1024)
+    print(f"{rows:,} rows, {size_mb:.1f} MB of CSV")
+
+    with app.app_context():
+        started = time.perf_counter()
+        with open(csv_path, 'rb') as f:
+            stats = import_catalog('products', f, 'csv')
+        elapsed = time.perf_counter() - started
+        print(f"import       {elapsed:6.2f}s  {stats['imported'] / elapsed:>10,.0f} rows/s  "
+              f"peak RSS {peak_rss_mb():.0f} MB")
+
+        for fmt in ('csv', 'jsonl'):
+            started = time.perf_counter()
+            written = sum(len(chunk) for chunk in export_catalog('products', fmt))
+            elapsed = time.perf_counter() - started
+            print(f"export {fmt:5} {elapsed:6.2f}s  {rows / elapsed:>10,.0f} rows/s  "
+                  f"{written / 2**20:.1f} MB  peak RSS {peak_rss_mb():.0f} MB")
+
+
+if __name__ == '__main__':
+    main()
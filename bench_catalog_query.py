@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Benchmark the faceted catalog query against a scratch SQLite database
+
+    python bench_catalog_query.py [ROWS] [--repeat N] [--plans]
+
+Seeds ROWS products (default 1,000,000) in 50 categories, a tenth of them
+inactive, then times GET /api/catalog/products for a set of filter and sort
+combinations, the median of N calls each:
+
+    counting     page and facets, counted on every call (CATALOG_FACET_TTL=0)
+    cached       page and facets, the counts from the per-process cache
+    page         the page alone (facets=0)
+    page N       the page DEEP_PAGE pages in, through the cursors
+
+--plans prints SQLite's query plan of every statement, each should name one
+of the ix_product_active_* indexes and none should sort.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+sys.path.insert(0, os.path.dirname(__file__))
+
+CATEGORIES = 50
+BATCH = 50000
+DEEP_PAGE = 20
+
+CASES = [
+    ('newest', ''),
+    ('price low to high', 'sort=price'),
+    ('price high to low', 'sort=-price'),
+    ('one category, newest', 'category=7'),
+    ('one category, by price', 'category=7&sort=price'),
+    ('three categories, by price', 'category=3,7,11&sort=price'),
+    ('price range', 'min_price=20&max_price=40'),
+    ('category and price range', 'category=7&min_price=20&max_price=40&sort=-price'),
+]
+
+
+def seed(rows):
+    from src.models.user import db
+    from src.models.product import Category, Product
+
+    random.seed(47)
+    db.session.connection().execute(Category.__table__.insert(), [
+        {'name': f'Category {i}', 'created_at': datetime.utcnow()} for i in range(CATEGORIES)
+    ])
+    db.session.commit()
+
+    start = datetime(2020, 1, 1)
+    table = Product.__table__
+    for offset in range(0, rows, BATCH):
+        db.session.connection().execute(table.insert(), [
+            {
+                'name': f'Product {i}',
+                'description': f'Generated product number {i}',
+                'price': round(random.lognormvariate(3, 0.8), 2),
+                'is_active': i % 10 != 0,
+                'category_id': random.randint(1, CATEGORIES),
+                'download_limit': 5,
+                'created_at': start + timedelta(seconds=random.randint(0, 5 * 365 * 86400)),
+                'updated_at': start,
+            }
+            for i in range(offset, min(offset + BATCH, rows))
+        ])
+        db.session.commit()
+    db.session.execute(db.text('ANALYZE'))
+    db.session.commit()
+
+
+def timed(client, url, repeat):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        response = client.get(url)
+        times.append(time.perf_counter() - started)
+        assert response.status_code == 200, response.data
+    return statistics.median(times) * 1000, response.json
+
+
+def deep_cursor(client, query, pages):
+    url = f'/api/catalog/products?{query}&facets=0&fields=id'
+    cursor = None
+    for _ in range(pages):
+        data = client.get(url + (f'&cursor={cursor}' if cursor else '')).json
+        cursor = data['next_cursor']
+        if cursor is None:
+            break
+    return cursor
+
+
+def print_plans(app, query):
+    from sqlalchemy import event
+    from src.models.user import db
+
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    app.config['CATALOG_FACET_TTL'] = 0
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        app.test_client().get(f'/api/catalog/products?{query}&include=')
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+        app.config.pop('CATALOG_FACET_TTL')
+
+    raw = db.engine.raw_connection()
+    try:
+        for statement, parameters in statements:
+            plan = raw.execute(f'EXPLAIN QUERY PLAN {statement}', parameters).fetchall()
+            print('    ' + ' / '.join(row[-1] for row in plan))
+    finally:
+        raw.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the faceted catalog query')
+    parser.add_argument('rows', nargs='?', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=9)
+    parser.add_argument('--plans', action='store_true', help='print the query plan of every statement')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench-catalog-query-')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+
+    from src.main import app
+
+    with app.app_context():
+        started = time.perf_counter()
+        seed(args.rows)
+        print(f'{args.rows:,} products in {CATEGORIES} categories, seeded in {time.perf_counter() - started:.1f}s')
+
+        client = app.test_client()
+        client.get('/api/catalog/products')  # Warm the page cache
+        print(f"{'':28} {'counting':>10} {'cached':>10} {'page':>10} {'page ' + str(DEEP_PAGE):>10}  total")
+        for name, query in CASES:
+            app.config['CATALOG_FACET_TTL'] = 0
+            counting_ms, data = timed(client, f'/api/catalog/products?{query}', args.repeat)
+            app.config.pop('CATALOG_FACET_TTL')
+            cached_ms, _ = timed(client, f'/api/catalog/products?{query}', args.repeat)
+            page_ms, _ = timed(client, f'/api/catalog/products?{query}&facets=0', args.repeat)
+            cursor = deep_cursor(client, query, DEEP_PAGE)
+            deep_ms, _ = timed(client, f'/api/catalog/products?{query}&facets=0&cursor={cursor}', args.repeat) \
+                if cursor else (float('nan'), None)
+            print(f'{name:28} {counting_ms:8.1f}ms {cached_ms:8.1f}ms {page_ms:8.1f}ms {deep_ms:8.1f}ms  '
+                  f'{data["total"]:,}')
+            if args.plans:
+                print_plans(app, query)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Benchmark response compression: bytes saved vs CPU cost per level
+"""
+import os
+import sys
+import json
+import time
+sys.path.insert(0, os.path.dirname(__file__))
+
+from src.compression import compress_bytes, brotli
+
+
+def build_order_history(orders=50, items_per_order=4):
+    """Build a payload shaped like /api/purchases (Order.to_dict() with nested items)"""
+    history = []
+    for order_id in range(1, orders + 1):
+        items = []
+        for n in range(items_per_order):
+            product_id = (order_id * items_per_order + n) % 40 + 1
+            items.append({
+                'id': order_id * 10 + n,
+                'order_id': order_id,
+                'product_id': product_id,
+                'product': {
+                    'id': product_id,
+                    'name': f'Digital Product {product_id}',
+                    'description': 'A comprehensive guide covering basics to advanced topics. ' * 3,
+                    'price': 29.99,
+                    'file_name': f'product_{product_id}.zip',
+                    'file_size': 15728640,
+                    'category_id': product_id % 6 + 1,
+                    'category': {
+                        'id': product_id % 6 + 1,
+                        'name': 'E-books',
+                        'description': 'Digital books and publications',
+                        'created_at': '2025-01-01T00:00:00'
+                    },
+                    'created_at': '2025-01-01T00:00:00'
+                },
+                'quantity': 1,
+                'price': 29.99,
+                'created_at': '2025-01-02T10:00:00'
+            })
+        history.append({
+            'id': order_id,
+            'order_number': f'ORD-20250102-{order_id:08X}',
+            'user_id': 1,
+            'total_amount': 119.96,
+            'status': 'completed',
+            'payment_intent_id': f'pi_demo_{order_id}',
+            'payment_status': 'succeeded',
+            'created_at': '2025-01-02T10:00:00',
+            'updated_at': '2025-01-02T10:05:00',
+            'order_items': items
+        })
+    return history
+
+
+def bench(body, encoding, level, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        compressed = compress_bytes(body, encoding, level)
+    elapsed = (time.perf_counter() - start) / rounds
+    return len(compressed), elapsed
+
+
+def run_benchmark(rounds=20):
+    payloads = {
+        'small (5 orders)': build_order_history(orders=5),
+        'medium (50 orders)': build_order_history(orders=50),
+        'large (500 orders)': build_order_history(orders=500),
+    }
+    configs = [('gzip', level) for level in (1, 3, 6, 9)]
+    if brotli is not None:
+        configs += [('br', level) for level in (1, 4, 6, 11)]
+    else:
+        print("brotli not installed, benchmarking gzip only")
+
+    for label, payload in payloads.items():
+        body = json.dumps(payload).encode('utf-8')
+        print(f"\n{label}: {len(body):,} bytes uncompressed")
+        print(f"  {'encoding':<8} {'level':>5} {'bytes':>10} {'saved':>7} {'ms':>8} {'MB/s':>8}")
+        for encoding, level in configs:
+            size, elapsed = bench(body, encoding, level, rounds if encoding != 'br' or level < 10 else 2)
+            saved = 100.0 * (1 - size / len(body))
+            throughput = len(body) / elapsed / (1024 * 1024)
+            print(f"  {encoding:<8} {level:>5} {size:>10,} {saved:>6.1f}% {elapsed * 1000:>8.2f} {throughput:>8.1f}")
+
+
+if __name__ == '__main__':
+    run_benchmark()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Benchmark JSON serialization of product pages and order histories
+"""
+import os
+import sys
+import json
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+sys.path.insert(0, os.path.dirname(__file__))
+
+from flask import Flask
+from src.json_provider import FastJSONProvider, orjson
+
+NOW = datetime(2025, 1, 2, 10, 0, 0, 123456)
+
+
+def category(category_id):
+    return {
+        'id': category_id,
+        'name': 'E-books',
+        'description': 'Digital books and publications',
+        'created_at': NOW
+    }
+
+
+def product(product_id):
+    return {
+        'id': product_id,
+        'name': f'Digital Product {product_id}',
+        'description': 'A comprehensive guide covering basics to advanced topics.',
+        'price': Decimal('29.99') + product_id,
+        'is_active': True,
+        'file_name': f'product_{product_id}.zip',
+        'file_size': 15728640,
+        'download_limit': 5,
+        'category_id': product_id % 6 + 1,
+        'category': category(product_id % 6 + 1),
+        'created_at': NOW,
+        'updated_at': NOW + timedelta(days=1)
+    }
+
+
+def order(order_id, items=4):
+    return {
+        'id': order_id,
+        'order_number': f'ORD-20250102-{order_id:08X}',
+        'user_id': 1,
+        'total_amount': Decimal('119.96'),
+        'status': 'completed',
+        'payment_intent_id': f'pi_demo_{order_id}',
+        'payment_status': 'succeeded',
+        'created_at': NOW,
+        'updated_at': NOW,
+        'order_items': [{
+            'id': order_id * 10 + n,
+            'order_id': order_id,
+            'product_id': n + 1,
+            'product': product(n + 1),
+            'quantity': 1,
+            'price': Decimal('29.99'),
+            'created_at': NOW
+        } for n in range(items)]
+    }
+
+
+def legacy_convert(value):
+    """What the models used to do by hand before handing dicts to stdlib json"""
+    if isinstance(value, dict):
+        return {k: legacy_convert(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [legacy_convert(v) for v in value]
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def timeit(fn, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return (time.perf_counter() - start) / rounds
+
+
+def run_benchmark(rounds=200):
+    app = Flask(__name__)
+    provider = FastJSONProvider(app)
+    payloads = {
+        'product page (20 products)': {'products': [product(i) for i in range(20)], 'total': 20},
+        'product page (100 products)': {'products': [product(i) for i in range(100)], 'total': 100},
+        'order history (50 orders)': [order(i) for i in range(50)],
+        'order history (500 orders)': [order(i) for i in range(500)],
+    }
+    print(f"orjson: {'available' if orjson is not None else 'not installed, using stdlib'}")
+    print(f"{'payload':<30} {'legacy ms':>10} {'provider ms':>12} {'speedup':>8}")
+    for label, payload in payloads.items():
+        legacy = timeit(lambda: json.dumps(legacy_convert(payload), sort_keys=True), rounds)
+        fast = timeit(lambda: provider.dumps_bytes(payload), rounds)
+        print(f"{label:<30} {legacy * 1000:>10.3f} {fast * 1000:>12.3f} {legacy / fast:>7.1f}x")
+
+
+if __name__ == '__main__':
+    run_benchmark()
@@ -0,0 +1,104 @@
+"""
+Streamed ZIP bundles built on the fly
+
+zipfile writes into a small sink that is drained after every write, so the
+archive goes out chunk by chunk with no temp file and memory bounded by the
+chunk size, however large the bundle. Entries that are already compressed
+(zip, video, images, ...) are stored, everything else is deflated.
+"""
+import os
+import time
+import zipfile
+
+CHUNK_SIZE = 1024 * 1024
+
+STORED_EXTENSIONS = {
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.7z', '.rar', '.jar', '.epub', '.docx', '.xlsx', '.pptx',
+    '.mp4', '.m4v', '.mov', '.mkv', '.webm', '.avi', '.mp3', '.m4a', '.aac', '.ogg', '.flac',
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.pdf',
+}
+STORED_MIME_PREFIXES = ('video/', 'audio/', 'image/')
+
+
+def is_compressed(filename, mime_type=None):
+    """Whether deflating this file would just burn CPU"""
+    if os.path.splitext(filename)[1].lower() in STORED_EXTENSIONS:
+        return True
+    return bool(mime_type) and mime_type.startswith(STORED_MIME_PREFIXES)
+
+
+class _Sink:
+    """Unseekable write target that hands its contents back on drain()"""
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+class BundleEntry:
+    __slots__ = ('arcname', 'path', 'size', 'mime_type')
+
+    def __init__(self, arcname, path, size, mime_type=None):
+        self.arcname = arcname
+        self.path = path
+        self.size = size
+        self.mime_type = mime_type
+
+
+def unique_arcnames(names):
+    """Make archive names unique: a.pdf, a.pdf -> a.pdf, a (2).pdf"""
+    used = set()
+    result = []
+    for name in names:
+        base, ext = os.path.splitext(name)
+        candidate, n = name, 1
+        while candidate in used:
+            n += 1
+            candidate = f'{base} ({n}){ext}'
+        used.add(candidate)
+        result.append(candidate)
+    return result
+
+
+def stream_zip(entries, chunk_size=CHUNK_SIZE):
+    """Yield a ZIP archive of `entries` as it is being built"""
+    sink = _Sink()
+    date_time = time.localtime()[:6]
+    with zipfile.ZipFile(sink, mode='w', allowZip64=True) as archive:
+        for entry in entries:
+            info = zipfile.ZipInfo(entry.arcname, date_time=date_time)
+            info.external_attr = 0o644 << 16
+            info.file_size = entry.size or 0
+            if is_compressed(entry.arcname, entry.mime_type):
+                info.compress_type = zipfile.ZIP_STORED
+            else:
+                info.compress_type = zipfile.ZIP_DEFLATED
+
+            force_zip64 = (entry.size or 0) >= zipfile.ZIP64_LIMIT
+            with open(entry.path, 'rb') as source, archive.open(info, mode='w', force_zip64=force_zip64) as target:
+                while True:
+                    chunk = source.read(chunk_size)
+                    if not chunk:
+                        break
+                    target.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            data = sink.drain()
+            if data:
+                yield data
+    # Central directory
+    data = sink.drain()
+    if data:
+        yield data
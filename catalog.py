@@ -0,0 +1,105 @@
+from flask import Blueprint, Response, jsonify, request, session, stream_with_context
+from src.catalog_io import (
+    FORMATS, MIMETYPES, RESOURCES, ImportValidationError, export_catalog, import_catalog
+)
+from src.catalog_query import CatalogQuery, CatalogQueryError
+from src.fieldsets import Fieldset
+from src.models.product import Product
+
+catalog_bp = Blueprint('catalog', __name__)
+
+def request_format(filename=None):
+    """Input format from ?format=, the Content-Type or the uploaded file's extension"""
+    fmt = request.args.get('format')
+    if fmt:
+        return fmt
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        return 'jsonl'
+    if filename and filename.endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    return 'csv'
+
+@catalog_bp.route('/catalog/products', methods=['GET'])
+def query_catalog():
+    """A page of active products with facet counts
+
+    ?category= (repeatable or comma separated ids), min_price, max_price,
+    sort (newest, oldest, price, -price), per_page, cursor (next_cursor of
+    the previous page), facets=0 to skip the counts when only paging.
+    """
+    try:
+        query = CatalogQuery.from_args(request.args)
+    except CatalogQueryError as e:
+        return jsonify({'error': str(e)}), 400
+
+    fieldset = Fieldset.from_request('product')
+    products, next_cursor = query.page(Product.load_options(fieldset))
+    data = {
+        'products': [product.to_dict_public(fieldset) for product in products],
+        'sort': query.sort,
+        'per_page': query.per_page,
+        'next_cursor': next_cursor
+    }
+    if request.args.get('facets', 'true').lower() not in ('0', 'false'):
+        data['total'], data['facets'] = query.facets(query.facet_grid())
+    return jsonify(data)
+
+@catalog_bp.route('/admin/catalog/<resource>/import', methods=['POST'])
+def import_resource(resource):
+    """Bulk import products or categories from CSV/JSONL (admin only)
+
+    Accepts a multipart upload in `file` or the raw request body.
+    """
+    if 'user_id' not in session:
+        return jsonify({'error': 'Authentication required'}), 401
+
+    if not session.get('is_admin', False):
+        return jsonify({'error': 'Admin privileges required'}), 403
+
+    if resource not in RESOURCES:
+        return jsonify({'error': f"Unknown resource, expected one of {', '.join(sorted(RESOURCES))}"}), 404
+
+    upload = request.files.get('file') if request.mimetype == 'multipart/form-data' else None
+    stream = upload.stream if upload else request.stream
+    fmt = request_format(upload.filename if upload else None)
+    if fmt not in FORMATS:
+        return jsonify({'error': f"format must be one of {', '.join(FORMATS)}"}), 400
+
+    try:
+        stats = import_catalog(
+            resource, stream, fmt,
+            skip_invalid=request.args.get('skip_invalid', '').lower() in ('1', 'true'),
+            create_categories=request.args.get('create_categories', 'true').lower() in ('1', 'true')
+        )
+    except ImportValidationError as e:
+        return jsonify({
+            'error': 'Import rolled back, some rows are invalid',
+            'invalid': e.error_count,
+            'errors': e.errors
+        }), 400
+
+    return jsonify({
+        'message': f"Imported {stats['imported']} {resource}",
+        'imported': stats['imported'],
+        'invalid': stats['invalid'],
+        'errors': stats['errors']
+    })
+
+@catalog_bp.route('/admin/catalog/<resource>/export', methods=['GET'])
+def export_resource(resource):
+    """Stream every product or category as CSV/JSONL (admin only)"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Authentication required'}), 401
+
+    if not session.get('is_admin', False):
+        return jsonify({'error': 'Admin privileges required'}), 403
+
+    if resource not in RESOURCES:
+        return jsonify({'error': f"Unknown resource, expected one of {', '.join(sorted(RESOURCES))}"}), 404
+
+    fmt = request.args.get('format', 'csv')
+    if fmt not in FORMATS:
+        return jsonify({'error': f"format must be one of {', '.join(FORMATS)}"}), 400
+
+    # The cursor is read while the response streams, keep the app context alive
+    return Response(stream_with_context(export_catalog(resource, fmt)), mimetype=MIMETYPES[fmt])
@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+"""
+Streaming bulk import/export of products and categories (CSV or JSONL)
+
+    python catalog_io.py import products catalog.csv [--skip-invalid]
+    python catalog_io.py export products --format jsonl > catalog.jsonl
+
+Import reads its input incrementally and validates it in chunks. Category
+names are resolved from one cached name -> id map, and each chunk is written
+with batched INSERT and upsert (src.upserts) statements. The whole import is
+one transaction. Rows that carry an id update that row, rows without one are
+inserted, so an export can be edited and imported again. By default a single
+invalid row rolls the whole import back; with skip_invalid the bad rows are
+reported and skipped. Memory stays bounded by the chunk size.
+
+Export streams rows straight from the cursor (yield_per), one encoded chunk
+at a time.
+"""
+import csv
+import io
+import json
+import os
+import sys
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import insert, select
+from src.models.user import db
+from src.models.product import Product, Category
+from src.upserts import upsert
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+CHUNK_SIZE = 5000
+MAX_ERRORS = 100
+FORMATS = ('csv', 'jsonl')
+MIMETYPES = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+PRODUCT_FIELDS = ('id', 'name', 'description', 'price', 'is_active', 'category', 'file_name',
+                  'file_size', 'download_limit', 'created_at', 'updated_at')
+CATEGORY_FIELDS = ('id', 'name', 'description', 'created_at')
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 't'}
+FALSE_VALUES = {'0', 'false', 'no', 'n', 'f', ''}
+
+
+class ImportValidationError(Exception):
+    def __init__(self, errors, error_count):
+        super().__init__(f'{error_count} invalid rows')
+        self.errors = errors
+        self.error_count = error_count
+
+
+def read_rows(stream, fmt):
+    """Yield (line number, dict) from a binary stream, one row at a time"""
+    if fmt == 'csv':
+        text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+        reader = csv.DictReader(text)
+        for row in reader:
+            yield reader.line_num, row
+        text.detach()
+    elif fmt == 'jsonl':
+        loads = orjson.loads if orjson is not None else json.loads
+        for line_num, line in enumerate(stream, 1):
+            if line.strip():
+                try:
+                    row = loads(line)
+                except ValueError:
+                    yield line_num, None
+                    continue
+                yield line_num, row if isinstance(row, dict) else None
+    else:
+        raise ValueError(f"Unknown format {fmt!r}, expected one of {', '.join(FORMATS)}")
+
+
+def blank(value):
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def parse_int(value, field, minimum=None):
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{field} must be an integer')
+    if minimum is not None and number < minimum:
+        raise ValueError(f'{field} must be at least {minimum}')
+    return number
+
+
+def parse_bool(value, field):
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in TRUE_VALUES:
+        return True
+    if text in FALSE_VALUES:
+        return False
+    raise ValueError(f'{field} must be true or false')
+
+
+class CategoryMap:
+    """Category name -> id, loaded once and extended as the import creates categories"""
+
+    def __init__(self, create_missing=True):
+        self.create_missing = create_missing
+        self.by_name = dict(db.session.execute(select(Category.name, Category.id)).all())
+        self.ids = set(self.by_name.values())
+
+    def resolve(self, raw):
+        name = raw.get('category')
+        category_id = self.by_name.get(name)  # Fast path, an exact known name
+        if category_id is not None:
+            return category_id
+        if not blank(raw.get('category_id')):
+            category_id = parse_int(raw['category_id'], 'category_id')
+            if category_id not in self.ids:
+                raise ValueError(f'category_id {category_id} does not exist')
+            return category_id
+        if blank(name):
+            return None
+        name = name.strip()
+        category_id = self.by_name.get(name)
+        if category_id is None:
+            if not self.create_missing:
+                raise ValueError(f'Unknown category {name!r}')
+            # inserted_primary_key rather than RETURNING, which MySQL lacks
+            category_id = db.session.execute(
+                insert(Category).values(name=name)
+            ).inserted_primary_key[0]
+            self.by_name[name] = category_id
+            self.ids.add(category_id)
+        return category_id
+
+
+CENT = Decimal('0.01')
+MAX_PRICE = Decimal('100000000')
+
+
+def clean_product(raw, categories):
+    """Validate one product row into column values, raises ValueError"""
+    get = raw.get
+    name = (get('name') or '').strip()
+    if not name:
+        raise ValueError('name is required')
+    if len(name) > 200:
+        raise ValueError('name is longer than 200 characters')
+    try:
+        price = Decimal(str(get('price'))).quantize(CENT)
+    except (InvalidOperation, ValueError):
+        raise ValueError('price must be a number')
+    if price < 0 or price >= MAX_PRICE:
+        raise ValueError('price is out of range')
+
+    is_active, file_size, download_limit = get('is_active'), get('file_size'), get('download_limit')
+    values = {
+        'name': name,
+        'description': get('description') or None,
+        'price': price,
+        'is_active': True if blank(is_active) else parse_bool(is_active, 'is_active'),
+        'category_id': categories.resolve(raw),
+        'file_name': (get('file_name') or '').strip() or None,
+        'file_size': None if blank(file_size) else parse_int(file_size, 'file_size', 0),
+        'download_limit': 5 if blank(download_limit) else parse_int(download_limit, 'download_limit', 1),
+    }
+    row_id = get('id')
+    if not blank(row_id):
+        values['id'] = parse_int(row_id, 'id', 1)
+    return values
+
+
+def clean_category(raw, categories):
+    name = (raw.get('name') or '').strip()
+    if not name:
+        raise ValueError('name is required')
+    if len(name) > 100:
+        raise ValueError('name is longer than 100 characters')
+    return {'name': name, 'description': raw.get('description') or None}
+
+
+def write_products(rows):
+    now = datetime.utcnow()
+    updates = [dict(row, updated_at=now) for row in rows if 'id' in row]
+    inserts = [dict(row, created_at=now, updated_at=now) for row in rows if 'id' not in row]
+    if inserts:
+        # Core insert on the table skips the ORM bulk layer, much faster for big chunks
+        db.session.connection().execute(Product.__table__.insert(), inserts)
+    if updates:
+        upsert(Product, ['id'], [dict(row, created_at=now) for row in updates],
+               replace=[name for name in updates[0] if name != 'id'])
+
+
+def write_categories(rows):
+    # Last row wins within a chunk, ON CONFLICT can't touch a row twice per statement
+    rows = list({row['name']: row for row in rows}.values())
+    upsert(Category, ['name'], [dict(row, created_at=datetime.utcnow()) for row in rows], replace=['description'])
+
+
+RESOURCES = {
+    'products': (clean_product, write_products),
+    'categories': (clean_category, write_categories),
+}
+
+
+def import_catalog(resource, stream, fmt, skip_invalid=False, create_categories=True,
+                   chunk_size=CHUNK_SIZE):
+    """Import rows from a binary stream in one transaction, returns a stats dict
+
+    Raises ImportValidationError (after rolling back) when rows are invalid
+    and skip_invalid is False.
+    """
+    clean, write = RESOURCES[resource]
+    categories = CategoryMap(create_categories)
+    stats = {'imported': 0, 'invalid': 0, 'errors': []}
+    chunk = []
+    try:
+        for line_num, raw in read_rows(stream, fmt):
+            try:
+                if raw is None:
+                    raise ValueError('not a JSON object')
+                chunk.append(clean(raw, categories))
+            except ValueError as e:
+                stats['invalid'] += 1
+                if len(stats['errors']) < MAX_ERRORS:
+                    stats['errors'].append({'line': line_num, 'error': str(e)})
+                continue
+            if len(chunk) >= chunk_size:
+                if not stats['invalid'] or skip_invalid:
+                    write(chunk)
+                stats['imported'] += len(chunk)
+                chunk = []
+        if chunk and (not stats['invalid'] or skip_invalid):
+            write(chunk)
+        stats['imported'] += len(chunk)
+
+        if stats['invalid'] and not skip_invalid:
+            raise ImportValidationError(stats['errors'], stats['invalid'])
+        db.session.commit()
+    except BaseException:
+        db.session.rollback()
+        raise
+    return stats
+
+
+def export_rows(resource):
+    """Yield (field names, chunk of row tuples) straight from the cursor"""
+    if resource == 'products':
+        stmt = select(
+            Product.id, Product.name, Product.description, Product.price, Product.is_active,
+            Category.name.label('category'), Product.file_name, Product.file_size,
+            Product.download_limit, Product.created_at, Product.updated_at
+        ).join(Category, Category.id == Product.category_id, isouter=True).order_by(Product.id)
+        fields = PRODUCT_FIELDS
+    elif resource == 'categories':
+        stmt = select(Category.id, Category.name, Category.description, Category.created_at).order_by(Category.id)
+        fields = CATEGORY_FIELDS
+    else:
+        raise ValueError(f'Unknown resource {resource!r}')
+
+    result = db.session.execute(stmt.execution_options(yield_per=CHUNK_SIZE))
+    for partition in result.partitions():
+        yield fields, partition
+
+
+def json_default(value):
+    if isinstance(value, Decimal):
+        return str(value)  # Exact, no float rounding
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def export_catalog(resource, fmt):
+    """Yield the encoded export, one chunk of rows at a time"""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt!r}, expected one of {', '.join(FORMATS)}")
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        writer.writerow(PRODUCT_FIELDS if resource == 'products' else CATEGORY_FIELDS)
+        for fields, rows in export_rows(resource):
+            writer.writerows(rows)  # Decimal and datetime go through str()
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue().encode('utf-8')
+        return
+
+    for fields, rows in export_rows(resource):
+        if orjson is not None:
+            yield b''.join(
+                orjson.dumps(dict(zip(fields, row)), default=json_default) + b'\n' for row in rows
+            )
+        else:
+            yield ''.join(
+                json.dumps(dict(zip(fields, row)), default=json_default, separators=(',', ':')) + '\n'
+                for row in rows
+            ).encode('utf-8')
+
+
+def main():
+    import argparse
+    import time
+    parser = argparse.ArgumentParser(description='Bulk import/export of the catalog')
+    sub = parser.add_subparsers(dest='command', required=True)
+    importer = sub.add_parser('import')
+    importer.add_argument('resource', choices=sorted(RESOURCES))
+    importer.add_argument('path')
+    importer.add_argument('--format', choices=FORMATS, help='default: from the file extension')
+    importer.add_argument('--skip-invalid', action='store_true')
+    importer.add_argument('--no-create-categories', action='store_true')
+    exporter = sub.add_parser('export')
+    exporter.add_argument('resource', choices=sorted(RESOURCES))
+    exporter.add_argument('--format', choices=FORMATS, default='csv')
+    args = parser.parse_args()
+
+    from src.main import app
+    with app.app_context():
+        if args.command == 'import':
+            fmt = args.format or ('jsonl' if args.path.endswith(('.jsonl', '.ndjson')) else 'csv')
+            started = time.perf_counter()
+            try:
+                with open(args.path, 'rb') as f:
+                    stats = import_catalog(args.resource, f, fmt, args.skip_invalid,
+                                           not args.no_create_categories)
+            except ImportValidationError as e:
+                print(f"Import rolled back: {e.error_count} invalid rows", file=sys.stderr)
+                for error in e.errors:
+                    print(f"  line {error['line']}: {error['error']}", file=sys.stderr)
+                sys.exit(1)
+            elapsed = time.perf_counter() - started
+            print(f"Imported {stats['imported']} {args.resource} in {elapsed:.2f}s "
+                  f"({stats['imported'] / elapsed if elapsed else 0:,.0f} rows/s), {stats['invalid']} invalid skipped")
+        else:
+            out = sys.stdout.buffer
+            for chunk in export_catalog(args.resource, args.format):
+                out.write(chunk)
+
+
+if __name__ == '__main__':
+    main()
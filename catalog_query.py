@@ -0,0 +1,233 @@
+"""
+Faceted catalog queries: filters, sorts, keyset pages and facet counts
+
+A query runs two statements, each served by an index on product:
+
+- The facet grid: one GROUP BY category over the active products, an
+  index-only scan of ix_product_active_category_price, counting each
+  category's products in the price range and in every price bucket. The
+  category counts, price bucket counts and the total are all sums over
+  this grid. Each facet ignores its own filter (picking a second
+  category doesn't zero the others) but honours the other one.
+- The page: a keyset seek on the index matching the sort, reading only
+  per_page rows however deep the client pages. The indexes carry the
+  filtered columns, so rows that don't match are skipped in the index.
+
+Counting is a scan of every active product, so the grid is cached per
+price range for a short TTL. Cursors are opaque, they hold the sort key
+and id of the last row.
+"""
+import base64
+import json
+import time
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from flask import current_app
+from sqlalchemy import and_, case, func, select, tuple_
+from src.models.user import db
+from src.models.product import Category, Product
+
+# name -> (column, descending)
+SORTS = {
+    'newest': (Product.created_at, True),
+    'oldest': (Product.created_at, False),
+    'price': (Product.price, False),
+    '-price': (Product.price, True),
+}
+DEFAULT_SORT = 'newest'
+DEFAULT_PER_PAGE = 24
+MAX_PER_PAGE = 100
+MAX_CATEGORIES = 50
+DEFAULT_PRICE_BUCKETS = (10, 25, 50, 100)  # Upper bounds, the last bucket is open
+DEFAULT_FACET_TTL = 60
+MAX_CACHED_GRIDS = 256
+
+_grids = {}  # (buckets, min_price, max_price) -> (expires, rows), per process
+
+
+class CatalogQueryError(ValueError):
+    pass
+
+
+def price_buckets():
+    return current_app.config.get('CATALOG_PRICE_BUCKETS', DEFAULT_PRICE_BUCKETS)
+
+
+def _decimal(value, name):
+    if value in (None, ''):
+        return None
+    try:
+        number = Decimal(value)
+    except (InvalidOperation, TypeError):
+        raise CatalogQueryError(f'{name} must be a number')
+    if not number.is_finite() or number < 0:
+        raise CatalogQueryError(f'{name} must be a positive number')
+    return number
+
+
+class CatalogQuery:
+    """A parsed catalog request"""
+
+    def __init__(self, categories=(), min_price=None, max_price=None, sort=DEFAULT_SORT,
+                 per_page=DEFAULT_PER_PAGE, cursor=None):
+        if sort not in SORTS:
+            raise CatalogQueryError(f"sort must be one of {', '.join(SORTS)}")
+        if len(categories) > MAX_CATEGORIES:
+            raise CatalogQueryError(f'At most {MAX_CATEGORIES} categories')
+        if min_price is not None and max_price is not None and min_price > max_price:
+            raise CatalogQueryError('min_price is above max_price')
+        self.categories = sorted(set(categories))
+        self.min_price = min_price
+        self.max_price = max_price
+        self.sort = sort
+        self.per_page = min(max(per_page, 1), MAX_PER_PAGE)
+        self.cursor = decode_cursor(cursor, sort) if cursor else None
+
+    @classmethod
+    def from_args(cls, args):
+        try:
+            categories = [int(value) for values in args.getlist('category') for value in values.split(',') if value]
+        except ValueError:
+            raise CatalogQueryError('category must be an id')
+        return cls(
+            categories=categories,
+            min_price=_decimal(args.get('min_price'), 'min_price'),
+            max_price=_decimal(args.get('max_price'), 'max_price'),
+            sort=args.get('sort', DEFAULT_SORT),
+            per_page=args.get('per_page', DEFAULT_PER_PAGE, type=int),
+            cursor=args.get('cursor')
+        )
+
+    def category_condition(self):
+        return Product.category_id.in_(self.categories) if self.categories else None
+
+    def price_condition(self, seek=True):
+        """The price range, as an expression no index can seek on unless seek"""
+        price = Product.price if seek else Product.price + 0
+        conditions = []
+        if self.min_price is not None:
+            conditions.append(price >= self.min_price)
+        if self.max_price is not None:
+            conditions.append(price <= self.max_price)
+        return and_(*conditions) if conditions else None
+
+    # Facets
+
+    def facet_grid(self):
+        """(category id, name, products in price range, products per price bucket...) rows
+
+        The grid only depends on the price range, so it is kept for
+        CATALOG_FACET_TTL seconds (0 to always count) and shared by every
+        sort, page and category selection.
+        """
+        ttl = current_app.config.get('CATALOG_FACET_TTL', DEFAULT_FACET_TTL)
+        if not ttl:
+            return self.count_grid()
+        key = (tuple(price_buckets()), self.min_price, self.max_price)
+        now = time.monotonic()
+        cached = _grids.get(key)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+
+        rows = self.count_grid()
+        if len(_grids) >= MAX_CACHED_GRIDS:
+            _grids.clear()
+        _grids[key] = (now + ttl, rows)
+        return rows
+
+    def count_grid(self):
+        """The facet grid in one pass
+
+        Grouped by category alone, so the aggregate streams in index order;
+        the buckets are conditional sums over the same rows.
+        """
+        bounds = price_buckets()
+        buckets = [Product.price < bounds[0]]
+        buckets += [and_(Product.price >= low, Product.price < high) for low, high in zip(bounds, bounds[1:])]
+        buckets.append(Product.price >= bounds[-1])
+        price_condition = self.price_condition()
+        in_range = func.sum(case((price_condition, 1), else_=0)) if price_condition is not None else func.count()
+
+        grid = select(
+            Product.category_id, in_range.label('in_range'),
+            *[func.sum(case((bucket, 1), else_=0)).label(f'bucket_{index}') for index, bucket in enumerate(buckets)]
+        ).where(Product.is_active == True).group_by(Product.category_id).subquery()
+        return db.session.execute(
+            select(grid.c.category_id, Category.name, *list(grid.c)[1:])
+            .outerjoin(Category, Category.id == grid.c.category_id)
+        ).all()
+
+    def facets(self, grid):
+        """Category and price bucket counts plus the total, summed from the grid"""
+        selected = set(self.categories)
+        categories = []
+        buckets = [0] * (len(price_buckets()) + 1)
+        total = 0
+        for category_id, name, in_range, *bucket_counts in grid:
+            if in_range:
+                categories.append({'id': category_id, 'name': name, 'count': in_range})
+            if not selected or category_id in selected:
+                total += in_range
+                for index, count in enumerate(bucket_counts):
+                    buckets[index] += count
+
+        bounds = (0,) + tuple(price_buckets())
+        return total, {
+            'categories': sorted(categories, key=lambda facet: (-facet['count'], facet['name'] or '')),
+            'price': [
+                {
+                    'min': bounds[index],
+                    'max': bounds[index + 1] if index + 1 < len(bounds) else None,
+                    'count': count
+                }
+                for index, count in enumerate(buckets)
+            ]
+        }
+
+    # Page
+
+    def page(self, options=()):
+        """per_page products after the cursor, and the cursor for the next page"""
+        column, descending = SORTS[self.sort]
+        query = Product.query.options(*options).filter(Product.is_active == True)
+        # Sorted by date, a price range would lead the planner to the price
+        # index and a sort of every match; walk the date index instead and
+        # stop after a page, the price is checked in the index entry
+        price_condition = self.price_condition(seek=column is Product.price)
+        for condition in (self.category_condition(), price_condition):
+            if condition is not None:
+                query = query.filter(condition)
+        if self.cursor is not None:
+            # Row value comparison, a seek into the sort index
+            key = tuple_(column, Product.id)
+            query = query.filter(key < tuple_(*self.cursor) if descending else key > tuple_(*self.cursor))
+        order = (column.desc(), Product.id.desc()) if descending else (column, Product.id)
+
+        products = query.order_by(*order).limit(self.per_page + 1).all()
+        next_cursor = None
+        if len(products) > self.per_page:
+            products = products[:self.per_page]
+            last = products[-1]
+            next_cursor = encode_cursor(getattr(last, column.key), last.id)
+        return products, next_cursor
+
+
+def encode_cursor(value, product_id):
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    elif isinstance(value, Decimal):
+        value = str(value)
+    data = json.dumps([value, product_id], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def decode_cursor(cursor, sort):
+    try:
+        value, product_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if SORTS[sort][0] is Product.created_at:
+            value = datetime.fromisoformat(value)
+        else:
+            value = Decimal(value)
+        return value, int(product_id)
+    except (ValueError, TypeError, InvalidOperation):
+        raise CatalogQueryError('Invalid cursor')
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Check the number of SQL statements every API endpoint issues
+
+    python check_query_budgets.py [--sizes 1,4,16] [--verbose]
+
+Every route under /api on the registered blueprints is called against a
+scratch SQLite database seeded at each size (orders, products and categories
+all scale with it). A call fails when it issues more statements than its
+budget, or more on a bigger fixture than on the smallest one: the count has
+to stay flat as the data grows, or the endpoint has an N+1. Failures print
+the statements that were repeated. Exits non-zero on any failure.
+
+Routes are filled in from the fixture by URL parameter name, so new
+endpoints are picked up automatically with DEFAULT_BUDGET. Give them a
+case in CASES when they need a body, another user or a different budget.
+"""
+import argparse
+import os
+import re
+import sys
+import tempfile
+from collections import Counter
+from types import SimpleNamespace
+from unittest import mock
+sys.path.insert(0, os.path.dirname(__file__))
+
+PASSWORD = 'budget-pass-123'
+DEFAULT_BUDGET = 6
+SKIP_RULES = ('/api/health',)
+
+# endpoint -> overrides. user is 'customer' (default), 'admin' or None,
+# params replaces fixture values in the URL, budget is the statement limit.
+CASES = {
+    'auth.login': {'user': None, 'json': {'username': 'customer', 'password': PASSWORD}, 'budget': 2},
+    'auth.register': {'user': None, 'budget': 4, 'json': {
+        'username': 'newcomer', 'email': 'newcomer@example.com', 'password': PASSWORD,
+        'first_name': 'New', 'last_name': 'Comer'
+    }},
+    'auth.change_password': {'budget': 2, 'json': {'current_password': PASSWORD, 'new_password': PASSWORD + 'x'}},
+    'auth.update_profile': {'budget': 3, 'json': {'first_name': 'Renamed'}},
+    'auth.get_current_user': {'budget': 1},
+    'user.get_users': {'user': 'admin', 'budget': 1},
+    'user.create_user': {'user': 'admin', 'budget': 2, 'json': {'username': 'created', 'email': 'created@example.com'}},
+    'user.update_user': {'user': 'admin', 'budget': 3, 'json': {'username': 'renamed'}},
+    'user.delete_user': {'user': 'admin', 'params': {'user_id': 'spare_user_id'}},
+    'download.get_user_downloads': {'budget': 3},
+    'download.get_user_license_keys': {'budget': 4},
+    'download.get_user_purchases': {'budget': 11},
+    'download.get_download_info': {'budget': 3},
+    'download.download_file': {'budget': 9},
+    'download.download_order_bundle': {'budget': 11},
+    'download.validate_license_key': {'budget': 1},
+    'download.activate_license_key': {'budget': 3},
+    'download.admin_get_downloads': {'user': 'admin', 'budget': 4},
+    'download.admin_get_license_keys': {'user': 'admin', 'budget': 4},
+    'download.admin_reset_download': {'user': 'admin', 'budget': 5},
+    'download.admin_deactivate_license_key': {'user': 'admin', 'budget': 7},
+    'download.admin_bulk_reset_downloads': {'user': 'admin', 'budget': 1, 'json': {'order_id': 'order_id'}},
+    'download.admin_bulk_deactivate_license_keys': {'user': 'admin', 'budget': 3, 'json': {'order_id': 'order_id'}},
+    'download.get_license_public_keys': {'user': None, 'budget': 0},
+    'download.get_license_revocations': {'user': None, 'budget': 1},
+    'download.refresh_license_certificate': {'user': None, 'budget': 3},
+    'download.admin_upload_product_file': {'user': 'admin', 'budget': 4, 'files': {'file': b'%PDF-1.4 budget'}},
+    'payment.create_payment_intent': {'budget': 7},
+    'payment.confirm_payment': {'budget': 15, 'json': {'payment_intent_id': 'pi_budget'}},
+    'payment.simulate_payment_success': {'budget': 16},
+    'payment.stripe_webhook': {'user': None, 'budget': 12},
+    'payment.create_test_payment': {'json': {'amount': 10}},
+    'reports.sales_report': {'user': 'admin', 'budget': 3, 'query': {'group': 'product'}},
+    'reports.product_report': {'user': 'admin', 'budget': 1},
+    'related.get_related_products': {'user': None, 'budget': 2},
+    'related.rebuild_recommendations': {'user': 'admin', 'budget': 5},
+    'related.get_recommendation_builds': {'user': 'admin', 'budget': 1},
+    'profiling.start_profiling': {'user': 'admin', 'budget': 0, 'json': {'endpoint': 'health_check', 'duration': 1}},
+    'profiling.get_profiling_status': {'user': 'admin', 'budget': 0},
+    'profiling.stop_profiling': {'user': 'admin', 'budget': 0},
+    'profiling.get_profile_stacks': {'user': 'admin', 'budget': 0},
+    'catalog.query_catalog': {'user': None, 'budget': 3, 'query': {'category': '1,2', 'min_price': '5', 'sort': 'price'}},
+    'catalog.export_resource': {'user': 'admin', 'budget': 1},
+    'catalog.import_resource': {'user': 'admin', 'budget': 2, 'query': {'format': 'csv'},
+                                'data': b'name,price,category\nImported,9.99,Category 0\n'},
+}
+
+
+def seed(size, workdir):
+    """Fill a fresh database, returns the values routes are called with"""
+    from src.models.user import db, User
+    from src.models.product import Category, Product
+    from src.models.order import Order, OrderItem
+    from src.models.download import Download, LicenseKey
+    from src.models.license_certificate import LicenseCertificate
+    from src.download_tokens import token_for
+    from src.license_certificates import issue_certificates
+    from src.rollups import rebuild
+
+    db.drop_all()
+    db.create_all()
+    if os.path.exists(os.path.join(workdir, 'copurchases.npz')):
+        os.remove(os.path.join(workdir, 'copurchases.npz'))  # Saved for the previous database
+
+    asset = os.path.join(workdir, 'asset.pdf')
+    with open(asset, 'wb') as f:
+        f.write(b'%PDF-1.4 ' + b'x' * 4096)
+
+    users = {}
+    for name, is_admin in (('admin', True), ('customer', False), ('spare', False)):
+        user = User(username=name, email=f'{name}@example.com', first_name=name, last_name='Budget', is_admin=is_admin)
+        user.set_password(PASSWORD)
+        db.session.add(user)
+        users[name] = user
+    categories = [Category(name=f'Category {i}') for i in range(size)]
+    db.session.add_all(categories)
+    db.session.flush()
+
+    products = [
+        Product(name=f'Product {i}', description='Budget fixture', price=10 + i, category_id=categories[i % size].id,
+                file_path=asset, file_name='asset.pdf', file_size=4105, download_limit=5)
+        for i in range(3 * size)
+    ]
+    db.session.add_all(products)
+    db.session.flush()
+
+    customer = users['customer']
+    orders = []
+    for i in range(size):
+        items = products[3 * i:3 * i + 3]
+        order = Order(user_id=customer.id, total_amount=sum(p.price for p in items),
+                      status='completed', payment_status='succeeded')
+        db.session.add(order)
+        db.session.flush()
+        orders.append(order)
+        for product in items:
+            db.session.add(OrderItem(order_id=order.id, product_id=product.id, price=product.price))
+            db.session.add(Download(user_id=customer.id, product_id=product.id, order_id=order.id, max_downloads=5))
+            db.session.add(LicenseKey(user_id=customer.id, product_id=product.id, order_id=order.id))
+
+    # The cart, paid by the payment endpoints
+    cart = Order(user_id=customer.id, total_amount=0, status='pending', payment_intent_id='pi_budget')
+    db.session.add(cart)
+    db.session.flush()
+    for product in products[-size:]:
+        db.session.add(OrderItem(order_id=cart.id, product_id=product.id, price=product.price))
+        cart.total_amount += product.price
+    db.session.commit()
+    db.session.bulk_insert_mappings(LicenseCertificate, issue_certificates(LicenseKey.query.all()))
+    db.session.commit()
+    rebuild()
+
+    download = Download.query.filter_by(order_id=orders[0].id).first()
+    key = LicenseKey.query.filter_by(order_id=orders[0].id).first()
+    return {
+        'user_id': customer.id,
+        'spare_user_id': users['spare'].id,
+        'admin_id': users['admin'].id,
+        'customer_id': customer.id,
+        'product_id': products[0].id,
+        'order_id': orders[0].id,
+        'download_id': download.id,
+        'download_token': token_for(download),
+        'key_id': key.id,
+        'license_key': key.license_key,
+        'resource': 'products',
+        'session_id': 'feedfacecafebeef',
+    }
+
+
+def fake_stripe():
+    """Patch the Stripe calls with local fakes, nothing leaves the process"""
+    import stripe
+
+    def create(**params):
+        return SimpleNamespace(id='pi_budget', client_secret='pi_budget_secret', amount=params.get('amount'),
+                               status='requires_payment_method')
+
+    def retrieve(intent_id, **params):
+        return SimpleNamespace(id=intent_id, status='succeeded')
+
+    def construct_event(payload, sig_header, secret):
+        return {'type': 'payment_intent.succeeded', 'data': {'object': {'id': 'pi_budget'}}}
+
+    return [
+        mock.patch.object(stripe.PaymentIntent, 'create', create),
+        mock.patch.object(stripe.PaymentIntent, 'retrieve', retrieve),
+        mock.patch.object(stripe.Webhook, 'construct_event', construct_event),
+    ]
+
+
+def routes(app):
+    """(endpoint, method, rule) for every API route"""
+    for rule in sorted(app.url_map.iter_rules(), key=lambda rule: rule.rule):
+        if not rule.rule.startswith('/api/') or rule.rule in SKIP_RULES:
+            continue
+        for method in sorted(rule.methods - {'HEAD', 'OPTIONS'}):
+            yield rule.endpoint, method, rule
+
+
+def resolve(value, fixture):
+    """Fixture names in a case body stand for their value"""
+    if isinstance(value, str) and value in fixture:
+        return fixture[value]
+    if isinstance(value, dict):
+        return {key: resolve(item, fixture) for key, item in value.items()}
+    return value
+
+
+def call(app, endpoint, method, rule, fixture):
+    """Run one request, returns (status, statements)"""
+    import io
+    from sqlalchemy import event
+    from src.models.user import db
+
+    case = CASES.get(endpoint, {})
+    values = {name: fixture[case.get('params', {}).get(name, name)] for name in rule.arguments}
+    path = rule.build(values, append_unknown=False)[1]
+
+    client = app.test_client()
+    user = case.get('user', 'customer')
+    if user is not None:
+        with client.session_transaction() as session:
+            session['user_id'] = fixture[f'{user}_id']
+            session['username'] = user
+            session['is_admin'] = user == 'admin'
+
+    kwargs = {'query_string': case.get('query')}
+    if 'json' in case:
+        kwargs['json'] = resolve(case['json'], fixture)
+    elif 'files' in case:
+        kwargs['data'] = {name: (io.BytesIO(body), 'asset.pdf') for name, body in case['files'].items()}
+        kwargs['content_type'] = 'multipart/form-data'
+    elif 'data' in case:
+        kwargs['data'] = case['data']
+
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    db.session.remove()  # Start from an empty identity map, like a fresh request
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        response = client.open(path, method=method, **kwargs)
+        response.get_data()  # Streamed bodies run their queries while iterated
+        response.close()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+    return response.status_code, statements
+
+
+def normalize(statement):
+    statement = ' '.join(statement.split())
+    return re.sub(r'\((?:\?, )+\?\)', '(?, ...)', statement)
+
+
+def repeated(statements):
+    return [(count, sql) for sql, count in Counter(map(normalize, statements)).most_common() if count > 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check SQL statement budgets of every API endpoint')
+    parser.add_argument('--sizes', default='1,4,16', help='comma separated fixture sizes')
+    parser.add_argument('--verbose', '-v', action='store_true', help='print every count, not only failures')
+    args = parser.parse_args()
+    sizes = sorted(int(size) for size in args.sizes.split(','))
+
+    workdir = tempfile.mkdtemp(prefix='query-budgets-')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'budget.db')}"
+
+    from src.main import app
+    app.config.update(
+        TESTING=True,
+        WRITE_BEHIND_INTERVAL=0,  # Write through, so buffered writes are counted in their request
+        STORAGE_ROOT=os.path.join(workdir, 'storage'),
+        RECOMMENDATIONS_PATH=os.path.join(workdir, 'copurchases.npz'),
+        PROFILER_DIR=os.path.join(workdir, 'profiles'),
+        LICENSE_SIGNING_KEY=os.urandom(32).hex(),
+        CATALOG_FACET_TTL=0  # Count facets on every call, the databases differ
+    )
+
+    patches = fake_stripe()
+    for patch in patches:
+        patch.start()
+
+    failures = 0
+    try:
+        with app.app_context():
+            for endpoint, method, rule in routes(app):
+                budget = CASES.get(endpoint, {}).get('budget', DEFAULT_BUDGET)
+                counts = []
+                for size in sizes:
+                    fixture = seed(size, workdir)
+                    status, statements = call(app, endpoint, method, rule, fixture)
+                    counts.append((size, status, statements))
+
+                problems = []
+                for size, status, statements in counts:
+                    if status >= 500:
+                        problems.append(f'status {status} at size {size}')
+                    if len(statements) > budget:
+                        problems.append(f'{len(statements)} statements at size {size}, budget {budget}')
+                smallest = len(counts[0][2])
+                for size, status, statements in counts[1:]:
+                    if len(statements) > smallest:
+                        problems.append(f'grows from {smallest} to {len(statements)} statements at size {size}')
+
+                summary = ' '.join(f'{len(statements)}' for _, _, statements in counts)
+                label = f'{method:6} {rule.rule}'
+                if problems:
+                    failures += 1
+                    print(f'FAIL {label}  [{summary}]  ' + '; '.join(problems))
+                    for count, sql in repeated(counts[-1][2]):
+                        print(f'       {count:4}x {sql}')
+                elif args.verbose:
+                    print(f'ok   {label}  [{summary}]  budget {budget}')
+    finally:
+        for patch in patches:
+            patch.stop()
+
+    print(f"{failures} endpoint(s) over budget" if failures else 'All endpoints within budget')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
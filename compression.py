@@ -0,0 +1,163 @@
+import gzip
+import zlib
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+DEFAULT_MIMETYPES = (
+    'application/json',
+    'text/html',
+    'text/css',
+    'text/plain',
+    'text/javascript',
+    'application/javascript',
+    'text/csv',
+    'application/x-ndjson',
+)
+
+
+def parse_accept_encoding(header):
+    """Parse an Accept-Encoding header into a {coding: quality} dict"""
+    encodings = {}
+    for part in (header or '').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        coding, _, params = part.partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        encodings[coding.strip().lower()] = quality
+    return encodings
+
+
+def choose_encoding(header, allow_br=True):
+    """Pick the best supported content coding for an Accept-Encoding header"""
+    encodings = parse_accept_encoding(header)
+    wildcard = encodings.get('*', 0.0)
+    candidates = []
+    if allow_br and brotli is not None:
+        candidates.append('br')
+    candidates.append('gzip')
+
+    best, best_quality = None, 0.0
+    for coding in candidates:
+        quality = encodings.get(coding, wildcard)
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+
+def compress_bytes(data, encoding, level):
+    """Compress a complete body in one shot"""
+    if encoding == 'br':
+        return brotli.compress(data, quality=level)
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def compress_stream(chunks, encoding, level):
+    """Compress an iterable of chunks incrementally, flushing after each one"""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=level)
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            data = compressor.process(chunk) + compressor.flush()
+            if data:
+                yield data
+        yield compressor.finish()
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield compressor.flush()
+
+
+class Compress:
+    """Negotiated gzip/brotli compression for API responses
+
+    Configuration (all optional):
+        COMPRESS_MIN_SIZE   - bodies smaller than this are sent as-is (default 1024)
+        COMPRESS_LEVEL      - gzip level (default 6)
+        COMPRESS_BR_LEVEL   - brotli quality (default 4)
+        COMPRESS_MIMETYPES  - content types eligible for compression
+        COMPRESS_BR         - set False to disable brotli negotiation
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('COMPRESS_MIN_SIZE', 1024)
+        app.config.setdefault('COMPRESS_LEVEL', 6)
+        app.config.setdefault('COMPRESS_BR_LEVEL', 4)
+        app.config.setdefault('COMPRESS_MIMETYPES', DEFAULT_MIMETYPES)
+        app.config.setdefault('COMPRESS_BR', True)
+        self.app = app
+        app.after_request(self.after_request)
+
+    def should_compress(self, response):
+        """Check whether a response is eligible for compression"""
+        config = self.app.config
+        if response.status_code < 200 or response.status_code in (204, 206, 304):
+            return False
+        if 'Content-Encoding' in response.headers:
+            return False
+        # File deliveries (send_file / download_file) are passed through untouched
+        if response.direct_passthrough or getattr(response, 'skip_compression', False):
+            return False
+        if 'attachment' in response.headers.get('Content-Disposition', ''):
+            return False
+        if response.mimetype not in config['COMPRESS_MIMETYPES']:
+            return False
+        if not response.is_streamed:
+            length = response.content_length
+            if length is None or length < config['COMPRESS_MIN_SIZE']:
+                return False
+        return True
+
+    def after_request(self, response):
+        config = self.app.config
+        response.vary.add('Accept-Encoding')
+
+        if not self.should_compress(response):
+            return response
+
+        encoding = choose_encoding(
+            request.headers.get('Accept-Encoding'),
+            allow_br=config['COMPRESS_BR']
+        )
+        if encoding is None:
+            return response
+
+        level = config['COMPRESS_BR_LEVEL'] if encoding == 'br' else config['COMPRESS_LEVEL']
+
+        if response.is_streamed:
+            response.response = compress_stream(response.response, encoding, level)
+            response.headers.pop('Content-Length', None)
+        else:
+            response.set_data(compress_bytes(response.get_data(), encoding, level))
+
+        response.headers['Content-Encoding'] = encoding
+        etag, _ = response.get_etag()
+        if etag:
+            response.set_etag(f'{etag}-{encoding}', weak=True)
+        return response
+
+
+def skip_compression(response):
+    """Mark a response so the compression layer leaves it alone"""
+    response.skip_compression = True
+    return response
@@ -52,7 +52,7 @@ def create_sample_products():
                 'description': 'Complete video course on digital marketing strategies, SEO, social media marketing, and analytics.',
                 'price': 99.99,
                 'category_id': course_cat.id if course_cat else 4,
-                'file_name': 'marketing_course.zip',
+                'file_name': 'marketing_course.mp4',
                 'file_size': 1073741824,  # 1GB
                 'download_limit': 3
             },
@@ -61,7 +61,7 @@ def create_sample_products():
                 'description': 'Learn JavaScript from scratch with practical examples and exercises. Includes ES6+ features.',
                 'price': 19.99,
                 'category_id': ebook_cat.id if ebook_cat else 1,
-                'file_name': 'javascript_fundamentals.pdf',
+                'file_name': 'javascript_ebook.pdf',
                 'file_size': 3145728,  # 3MB
                 'download_limit': 5
             },
@@ -90,6 +90,7 @@ def create_sample_products():
         db.session.commit()
         print(f"\nSample data creation completed!")
         print(f"Total products in database: {Product.query.count()}")
+        print("Run `python ingest_files.py <asset dir>` to record the real file sizes and types")
 
 if __name__ == '__main__':
     create_sample_products()
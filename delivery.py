@@ -0,0 +1,259 @@
+"""
+Bandwidth shaping and fair scheduling for file deliveries
+
+Every transfer gets its own token bucket (per-connection cap) and draws from a
+shared global bucket (global cap). When the global bucket runs dry, waiting
+transfers are served smallest-remaining-first, so e-books are not starved by a
+handful of 1 GB course downloads. Each user may only hold a limited number of
+concurrent transfers.
+
+Waiting is always a sleep (time.sleep in WSGI worker threads, asyncio in the
+ASGI mode), so throttled connections cost no CPU. Caps apply per process.
+"""
+import asyncio
+import heapq
+import io
+import itertools
+import threading
+import time
+from urllib.parse import quote
+from flask import current_app
+from src.storage import digest_header
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+
+class TokenBucket:
+    """Token bucket arithmetic; callers do the waiting"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount):
+        """Seconds until `amount` tokens are available"""
+        self.refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount):
+        self.tokens -= min(amount, self.capacity)
+
+
+class DeliveryScheduler:
+    def __init__(self, global_rate=None, connection_rate=None, per_user=None,
+                 chunk_size=DEFAULT_CHUNK_SIZE):
+        self.connection_rate = connection_rate
+        self.per_user = per_user
+        self.chunk_size = chunk_size
+        self.global_bucket = TokenBucket(global_rate, global_rate) if global_rate else None
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._active = {}  # user_id -> open transfers
+        self._waiters = []  # heap of (remaining bytes, seq)
+        self._seq = itertools.count()
+
+    @property
+    def shaping(self):
+        return self.global_bucket is not None or self.connection_rate is not None
+
+    def start(self, user_id, file_path, download_name, size, sha256=None,
+              mime_type='application/octet-stream', remote_url=None):
+        """Open a transfer, or return None when the user is at their limit"""
+        with self._lock:
+            if self.per_user is not None and self._active.get(user_id, 0) >= self.per_user:
+                return None
+            self._active[user_id] = self._active.get(user_id, 0) + 1
+        return Delivery(self, user_id, file_path, download_name, size, sha256, mime_type, remote_url)
+
+    def finish(self, user_id):
+        with self._lock:
+            remaining = self._active.get(user_id, 0) - 1
+            if remaining > 0:
+                self._active[user_id] = remaining
+            else:
+                self._active.pop(user_id, None)
+
+    def global_delay(self, amount, entry):
+        """Delay before `entry` may take `amount` global tokens (lock held)
+
+        Only the transfer with the fewest remaining bytes may draw when tokens
+        are short; returns None while someone smaller is ahead in line.
+        """
+        if self._waiters[0] is not entry:
+            return None
+        return self.global_bucket.delay(amount)
+
+    def acquire_global(self, amount, remaining):
+        """Blocking global acquire for WSGI worker threads"""
+        if self.global_bucket is None:
+            return
+        with self._cond:
+            entry = (remaining, next(self._seq))
+            heapq.heappush(self._waiters, entry)
+            try:
+                while True:
+                    delay = self.global_delay(amount, entry)
+                    if delay == 0:
+                        break
+                    self._cond.wait(timeout=delay)
+                self.global_bucket.take(amount)
+            finally:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+
+    async def acquire_global_async(self, amount, remaining):
+        """Global acquire for the ASGI event loop, polling without holding the lock"""
+        if self.global_bucket is None:
+            return
+        with self._lock:
+            entry = (remaining, next(self._seq))
+            heapq.heappush(self._waiters, entry)
+        try:
+            while True:
+                with self._lock:
+                    delay = self.global_delay(amount, entry)
+                    if delay == 0:
+                        self.global_bucket.take(amount)
+                        return
+                # Someone smaller is ahead: check back after roughly one of their chunks
+                await asyncio.sleep(delay if delay is not None else amount / self.global_bucket.rate)
+        finally:
+            with self._cond:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+
+
+class Delivery:
+    """One shaped file transfer, holding its user's slot until closed"""
+
+    def __init__(self, scheduler, user_id, file_path, download_name, size, sha256=None,
+                 mime_type='application/octet-stream', remote_url=None):
+        self.scheduler = scheduler
+        self.user_id = user_id
+        self.file_path = file_path
+        self.download_name = download_name
+        self.size = size
+        self.sha256 = sha256
+        self.mime_type = mime_type
+        self.remote_url = remote_url  # Set when a remote store serves the bytes
+        self.bucket = TokenBucket(scheduler.connection_rate) if scheduler.connection_rate else None
+        self.file = None  # The DeliveryFile, once opened
+        self._closed = False
+
+    def headers(self):
+        """Response headers, all from metadata recorded at ingest time"""
+        ascii_name = self.download_name.encode('ascii', 'replace').decode('ascii').replace('"', '')
+        headers = [
+            ('Content-Type', self.mime_type),
+            ('Content-Length', str(self.size)),
+            ('Content-Disposition',
+             f"attachment; filename=\"{ascii_name}\"; filename*=UTF-8''{quote(self.download_name)}"),
+        ]
+        if self.sha256:
+            digest, repr_digest = digest_header(self.sha256)
+            headers += [
+                ('ETag', f'"{self.sha256}"'),
+                ('Digest', digest),
+                ('Repr-Digest', repr_digest),
+            ]
+        return headers
+
+    def close(self):
+        if self.file is not None:
+            file, self.file = self.file, None
+            file.close()
+        if not self._closed:
+            self._closed = True
+            self.scheduler.finish(self.user_id)
+
+    def pace(self, size, remaining):
+        """Block until `size` more bytes may be sent"""
+        if self.bucket is not None:
+            time.sleep(self.bucket.delay(size))
+            self.bucket.take(size)
+        self.scheduler.acquire_global(size, remaining)
+
+    def shape(self, chunks):
+        """Throttle any iterable of chunks for a WSGI response, closing when done"""
+        sent = 0
+        try:
+            for chunk in chunks:
+                self.pace(len(chunk), max(self.size - sent, 0))
+                sent += len(chunk)
+                yield chunk
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+            self.close()
+
+    def open(self):
+        """The file for wrap_file (sendfile), opened once; closing it releases the slot"""
+        if self.file is None:
+            self.file = DeliveryFile(self.file_path, self)
+        return self.file
+
+    async def aiter_chunks(self, start=0, length=None):
+        """Throttled chunks for the ASGI mode, length bytes from start (a Range request)"""
+        remaining = self.size - start if length is None else length
+        f = self.file or await asyncio.to_thread(self.open)
+        try:
+            if start:
+                await asyncio.to_thread(f.seek, start)
+            while remaining > 0:
+                chunk = await asyncio.to_thread(f.read, min(self.scheduler.chunk_size, remaining))
+                if not chunk:
+                    break
+                if self.bucket is not None:
+                    await asyncio.sleep(self.bucket.delay(len(chunk)))
+                    self.bucket.take(len(chunk))
+                await self.scheduler.acquire_global_async(len(chunk), remaining)
+                remaining -= len(chunk)
+                yield chunk
+        finally:
+            f.close()
+            self.close()
+
+
+class DeliveryFile(io.FileIO):
+    """Real file (fileno() still works for sendfile) that ends its delivery on close"""
+
+    def __init__(self, file_path, delivery):
+        super().__init__(file_path, 'rb')
+        self.delivery = delivery
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self.delivery.close()
+
+
+def get_scheduler(app=None):
+    """The app's delivery scheduler, created from config on first use
+
+    DOWNLOAD_GLOBAL_RATE      bytes/s across all transfers (None = unlimited)
+    DOWNLOAD_CONNECTION_RATE  bytes/s per transfer (None = unlimited)
+    DOWNLOAD_USER_CONCURRENCY concurrent transfers per user (None = unlimited)
+    """
+    app = app or current_app._get_current_object()
+    scheduler = app.extensions.get('delivery')
+    if scheduler is None:
+        scheduler = app.extensions['delivery'] = DeliveryScheduler(
+            global_rate=app.config.get('DOWNLOAD_GLOBAL_RATE'),
+            connection_rate=app.config.get('DOWNLOAD_CONNECTION_RATE'),
+            per_user=app.config.get('DOWNLOAD_USER_CONCURRENCY', 3),
+            chunk_size=app.config.get('DOWNLOAD_CHUNK_SIZE', DEFAULT_CHUNK_SIZE)
+        )
+    return scheduler
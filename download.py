@@ -1,8 +1,25 @@
-from flask import Blueprint, jsonify, request, session, send_file, abort
+from flask import Blueprint, Response, current_app, jsonify, redirect, request, session, abort
 from src.models.user import db
 from src.models.download import Download, LicenseKey
 from src.models.product import Product
 from src.models.order import Order
+from src.compression import skip_compression
+from src.fieldsets import Fieldset
+from src.signals import rows_changed
+from src.delivery import get_scheduler
+from src.storage import get_storage
+from src.bundle import BundleEntry, stream_zip, unique_arcnames
+from src.write_behind import get_write_behind
+from src.rollups import record_downloads
+from src import license_certificates
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
+from werkzeug.wsgi import ClosingIterator, wrap_file
+from src.download_tokens import (
+    ExpiredToken, InvalidToken, is_signed_token, token_for, verify_download_token
+)
+from sqlalchemy import or_, update
+from sqlalchemy.orm import joinedload, selectinload
+from datetime import datetime
 import os
 
 download_bp = Blueprint('download', __name__)
@@ -13,6 +30,119 @@ def require_auth():
         return False
     return True
 
+def find_download(download_token):
+    """Resolve a download token to its Download
+
+    Signed tokens are verified first, so forged or expired ones are rejected
+    without a query and valid ones resolve by primary key. Legacy random
+    tokens still go through the download_token lookup.
+    """
+    if is_signed_token(download_token):
+        try:
+            download_id = verify_download_token(download_token)
+        except ExpiredToken:
+            return None, (jsonify({'error': 'Download link has expired or exceeded limit'}), 403)
+        except InvalidToken:
+            return None, (jsonify({'error': 'Invalid download token'}), 404)
+        download = Download.query.get(download_id)
+    else:
+        download = Download.query.filter_by(download_token=download_token).first()
+    
+    if not download:
+        return None, (jsonify({'error': 'Invalid download token'}), 404)
+    return download, None
+
+def with_products(query, model):
+    """Load each row's product and category up front, to_dict() embeds both"""
+    return query.options(selectinload(model.product).selectinload(Product.category))
+
+def download_to_dict(download):
+    """Serialize a download together with its signed token"""
+    data = download.to_dict()
+    data['signed_token'] = token_for(download)
+    return data
+
+def license_key_to_dict(key, certificates):
+    """Serialize a license key together with its signed certificate, if it has one"""
+    data = key.to_dict()
+    record = certificates.get(key.license_key)
+    data['certificate'] = record.certificate if record else None
+    return data
+
+BULK_FILTER_FIELDS = ('order_id', 'product_id', 'user_id')
+MAX_BULK_IDS = 10000
+
+def bulk_filter(model, data):
+    """Build WHERE conditions for a bulk admin operation
+
+    Accepts any combination of order_id, product_id, user_id and ids. At least
+    one filter is required so a bad request can never touch the whole table.
+    """
+    if not data:
+        return None, 'No data provided'
+    
+    conditions = []
+    for field in BULK_FILTER_FIELDS:
+        if data.get(field) is not None:
+            if not isinstance(data[field], int):
+                return None, f'{field} must be an integer'
+            conditions.append(getattr(model, field) == data[field])
+    
+    if data.get('ids') is not None:
+        ids = data['ids']
+        if not isinstance(ids, list) or not all(isinstance(i, int) for i in ids):
+            return None, 'ids must be a list of integers'
+        if len(ids) > MAX_BULK_IDS:
+            return None, f'At most {MAX_BULK_IDS} ids per request'
+        conditions.append(model.id.in_(ids))
+    
+    if not conditions:
+        return None, 'At least one of order_id, product_id, user_id or ids is required'
+    return conditions, None
+
+def bulk_update(model, conditions, values):
+    """Run a single UPDATE ... RETURNING id and notify caches of the changed rows"""
+    result = db.session.execute(
+        update(model).where(*conditions).values(**values).returning(model.id),
+        execution_options={'synchronize_session': False}
+    )
+    ids = [row[0] for row in result]
+    db.session.commit()
+    
+    # The UPDATE bypassed the identity map, drop any stale copies
+    db.session.expire_all()
+    if ids:
+        rows_changed.send(model, ids=ids)
+    return ids
+
+def redeem_downloads(download_ids):
+    """Count one download for each id still within its limit and expiry
+
+    The check and the increment are one UPDATE, committed right away, so
+    concurrent requests can never exceed max_downloads. Only the analytics
+    timestamp goes through the write-behind buffer. Returns the redeemed ids.
+    """
+    now = datetime.utcnow()
+    result = db.session.execute(
+        update(Download).where(
+            Download.id.in_(download_ids),
+            Download.download_count < Download.max_downloads,
+            or_(Download.expires_at.is_(None), Download.expires_at > now)
+        ).values(
+            download_count=Download.download_count + 1
+        ).returning(Download.id, Download.product_id),
+        execution_options={'synchronize_session': False}
+    )
+    rows = result.all()
+    redeemed = {download_id for download_id, _ in rows}
+    record_downloads([product_id for _, product_id in rows], now.date())
+    db.session.commit()
+    
+    write_behind = get_write_behind()
+    for download_id in redeemed:
+        write_behind.set(Download, download_id, last_downloaded_at=now)
+    return redeemed
+
 @download_bp.route('/downloads', methods=['GET'])
 def get_user_downloads():
     """Get user's available downloads"""
@@ -20,51 +150,185 @@ def get_user_downloads():
         return jsonify({'error': 'Authentication required'}), 401
     
     user_id = session['user_id']
-    downloads = Download.query.filter_by(user_id=user_id).order_by(
+    fieldset = Fieldset.from_request('download')
+    downloads = with_products(Download.query, Download).filter_by(user_id=user_id).order_by(
         Download.created_at.desc()
     ).all()
     
-    return jsonify([download.to_dict() for download in downloads])
+    return jsonify([fieldset.filter('download', download_to_dict(download)) for download in downloads])
 
-@download_bp.route('/downloads/<download_token>', methods=['GET'])
-def download_file(download_token):
-    """Download a file using download token"""
-    download = Download.query.filter_by(download_token=download_token).first()
-    
-    if not download:
-        return jsonify({'error': 'Invalid download token'}), 404
+def resolve_product_file(product, storage):
+    """(local path, size, MIME type, sha256) of a product's file, None when it is missing
+
+    Files in the store come from the row alone, no stat needed; the path is
+    None for a remote store. Files recorded in place are stat()ed and their
+    hash only trusted while size and mtime still match the last ingest.
+    """
+    sha256 = product.file_sha256
+    if sha256 and storage.is_stored(sha256, product.file_path):
+        return storage.local_path(sha256), product.file_size, product.file_mime_type or 'application/octet-stream', sha256
+    if not product.file_path:
+        return None
+    try:
+        st = os.stat(product.file_path)
+    except OSError:
+        return None
+    if sha256 and (st.st_size, st.st_mtime) == (product.file_size, product.file_mtime):
+        return product.file_path, st.st_size, product.file_mime_type or 'application/octet-stream', sha256
+    # Legacy path, or changed since it was hashed
+    return product.file_path, st.st_size, 'application/octet-stream', None
+
+def prepare_file_download(download_token):
+    """Check a download token, open a delivery slot and count the download
+
+    Returns (delivery, None) or (None, error response). The caller must
+    close() the delivery once the transfer ends.
+    """
+    download, error = find_download(download_token)
+    if error:
+        return None, error
     
     if not download.is_valid():
-        return jsonify({'error': 'Download link has expired or exceeded limit'}), 403
+        return None, (jsonify({'error': 'Download link has expired or exceeded limit'}), 403)
     
     product = download.product
-    if not product or not product.file_path:
-        return jsonify({'error': 'File not found'}), 404
-    
-    # Check if file exists on disk
-    if not os.path.exists(product.file_path):
-        return jsonify({'error': 'File not available'}), 404
-    
-    # Increment download count
-    download.increment_download()
+    if not product or not (product.file_sha256 or product.file_path):
+        return None, (jsonify({'error': 'File not found'}), 404)
+    
+    download_name = product.file_name or f"product_{product.id}"
+    storage = get_storage()
+    resolved = resolve_product_file(product, storage)
+    if resolved is None:
+        return None, (jsonify({'error': 'File not available'}), 404)
+    file_path, size, mime_type, sha256 = resolved
+    remote_url = storage.url(sha256, download_name) if file_path is None else None
+    
+    # Per-user concurrency limit, checked before the download is counted
+    delivery = get_scheduler().start(
+        download.user_id, file_path, download_name, size,
+        sha256=sha256, mime_type=mime_type, remote_url=remote_url
+    )
+    if delivery is None:
+        return None, (jsonify({'error': 'Too many concurrent downloads'}), 429)
+    
+    # Open the file before counting, a missing or unreadable one costs no download
+    if file_path is not None:
+        try:
+            delivery.open()
+        except OSError:
+            delivery.close()
+            return None, (jsonify({'error': 'File not available'}), 404)
+    
+    # Count the download, losing a race for the last one is a 403
+    try:
+        redeemed = redeem_downloads([download.id])
+    except Exception:
+        delivery.close()
+        raise
+    if not redeemed:
+        delivery.close()
+        return None, (jsonify({'error': 'Download link has expired or exceeded limit'}), 403)
+    
+    return delivery, None
+
+@download_bp.route('/downloads/<download_token>', methods=['GET'])
+def download_file(download_token):
+    """Download a file using download token"""
+    delivery, error = prepare_file_download(download_token)
+    if error:
+        return error
     
     try:
-        return send_file(
-            product.file_path,
-            as_attachment=True,
-            download_name=product.file_name or f"product_{product.id}",
-            mimetype='application/octet-stream'
-        )
+        if delivery.remote_url:
+            # Remote object store serves the bytes itself
+            delivery.close()
+            return redirect(delivery.remote_url)
+        
+        # direct_passthrough skips call_on_close, closing the file releases the slot
+        file = delivery.open()
+        response = Response(wrap_file(request.environ, file), headers=delivery.headers(), direct_passthrough=True)
+        # Resumed downloads (Range, If-Range) and revalidation against the content hash ETag
+        try:
+            response.make_conditional(request, accept_ranges=True, complete_length=delivery.size)
+        except RequestedRangeNotSatisfiable:
+            file.close()
+            return jsonify({'error': 'Requested range not satisfiable'}), 416, {
+                'Content-Range': f'bytes */{delivery.size}'
+            }
+        if delivery.scheduler.shaping:
+            # Throttled, smallest-first delivery of the part asked for
+            body = response.response
+            response.response = ClosingIterator(delivery.shape(body), body.close)
+        return skip_compression(response)
     except Exception as e:
+        delivery.close()
         return jsonify({'error': 'Failed to download file'}), 500
 
+@download_bp.route('/orders/<int:order_id>/download-all', methods=['GET'])
+def download_order_bundle(order_id):
+    """Download every file of an order as one ZIP, streamed as it is built"""
+    if not require_auth():
+        return jsonify({'error': 'Authentication required'}), 401
+    
+    user_id = session['user_id']
+    order = Order.query.filter_by(id=order_id, user_id=user_id, status='completed').first()
+    if not order:
+        return jsonify({'error': 'Order not found'}), 404
+    
+    rows = db.session.query(Download, Product).join(
+        Product, Download.product_id == Product.id
+    ).filter(Download.order_id == order.id, Download.user_id == user_id).all()
+    
+    # Resolve every file before anything is counted
+    storage = get_storage()
+    files = []
+    for download, product in rows:
+        resolved = resolve_product_file(product, storage)
+        if resolved is None or resolved[0] is None:
+            continue  # Missing, or in a remote store and only downloadable on its own
+        file_path, size = resolved[:2]
+        # Plain values, the commit in redeem_downloads expires the product
+        files.append((download.id, product.file_name or f"product_{product.id}", product.file_mime_type, file_path, size))
+    
+    if not files:
+        return jsonify({'error': 'No files available for this order'}), 404
+    
+    delivery = get_scheduler().start(
+        user_id, None, f'{order.order_number}.zip', sum(entry[-1] for entry in files),
+        mime_type='application/zip'
+    )
+    if delivery is None:
+        return jsonify({'error': 'Too many concurrent downloads'}), 429
+    
+    # One atomic UPDATE counts a redemption for every download still valid
+    try:
+        redeemed = redeem_downloads([entry[0] for entry in files])
+    except Exception:
+        delivery.close()
+        raise
+    
+    files = [entry for entry in files if entry[0] in redeemed]
+    if not files:
+        delivery.close()
+        return jsonify({'error': 'Download links have expired or exceeded limit'}), 403
+    
+    arcnames = unique_arcnames([name for _, name, _, _, _ in files])
+    entries = [
+        BundleEntry(arcname, file_path, size, mime_type)
+        for arcname, (_, _, mime_type, file_path, size) in zip(arcnames, files)
+    ]
+    
+    body = ClosingIterator(delivery.shape(stream_zip(entries)), delivery.close)
+    response = Response(body, mimetype='application/zip', direct_passthrough=True)
+    response.headers.set('Content-Disposition', 'attachment', filename=delivery.download_name)
+    return skip_compression(response)
+
 @download_bp.route('/downloads/<download_token>/info', methods=['GET'])
 def get_download_info(download_token):
     """Get download information without downloading"""
-    download = Download.query.filter_by(download_token=download_token).first()
-    
-    if not download:
-        return jsonify({'error': 'Invalid download token'}), 404
+    download, error = find_download(download_token)
+    if error:
+        return error
     
     return jsonify(download.to_dict())
 
@@ -75,16 +339,78 @@ def get_user_license_keys():
         return jsonify({'error': 'Authentication required'}), 401
     
     user_id = session['user_id']
-    license_keys = LicenseKey.query.filter_by(user_id=user_id).order_by(
+    fieldset = Fieldset.from_request('license_key')
+    license_keys = with_products(LicenseKey.query, LicenseKey).filter_by(user_id=user_id).order_by(
         LicenseKey.created_at.desc()
     ).all()
+    certificates = license_certificates.certificates_for(license_keys)
     
-    return jsonify([key.to_dict() for key in license_keys])
+    return jsonify([fieldset.filter('license_key', license_key_to_dict(key, certificates)) for key in license_keys])
+
+@download_bp.route('/license-keys/public-keys', methods=['GET'])
+def get_license_public_keys():
+    """Ed25519 public keys that verify license certificates, by certificate version"""
+    if not license_certificates.available():
+        return jsonify({'error': 'License certificates are not available'}), 501
+    
+    response = jsonify({
+        'algorithm': 'Ed25519',
+        'current_version': license_certificates.current_version(),
+        'keys': license_certificates.public_keys()
+    })
+    response.cache_control.public = True
+    response.cache_control.max_age = 86400
+    return response
+
+@download_bp.route('/license-keys/revocations', methods=['GET'])
+def get_license_revocations():
+    """Revoked certificates after the ?since= cursor, as [key hash, issuance] pairs
+
+    Clients keep the returned cursor and ask for what came after it. A
+    full page only holds settled revocations and may be cached for a day,
+    the last page only briefly; both answer If-None-Match with 304.
+    """
+    since = max(request.args.get('since', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', 1000, type=int), 1), 1000)
+    
+    revoked = license_certificates.revocations(since, limit)
+    complete = len(revoked) == limit
+    response = jsonify({
+        'since': since,
+        'cursor': revoked[-1].id if revoked else since,
+        'more': complete,
+        'revocations': [revocation.to_list() for revocation in revoked]
+    })
+    response.cache_control.public = True
+    if complete:
+        response.cache_control.max_age = 86400
+    else:
+        response.cache_control.max_age = current_app.config.get('LICENSE_REVOCATIONS_MAX_AGE', 300)
+    response.add_etag()
+    return response.make_conditional(request)
+
+@download_bp.route('/license-keys/<license_key>/certificate', methods=['POST'])
+def refresh_license_certificate(license_key):
+    """A current signed certificate for a license key, for offline validation"""
+    if not license_certificates.available():
+        return jsonify({'error': 'License certificates are not available'}), 501
+    
+    key = LicenseKey.query.filter_by(license_key=license_key).first()
+    if not key:
+        return jsonify({'error': 'Invalid license key'}), 404
+    
+    if not key.is_active:
+        return jsonify({'error': 'License key is deactivated'}), 403
+    if key.expires_at and key.expires_at < datetime.utcnow():
+        return jsonify({'error': 'License key has expired'}), 403
+    
+    record = license_certificates.refresh_certificate(key)
+    return jsonify(record.to_dict())
 
 @download_bp.route('/license-keys/<license_key>/validate', methods=['POST'])
 def validate_license_key(license_key):
     """Validate a license key"""
-    key = LicenseKey.query.filter_by(license_key=license_key).first()
+    key = LicenseKey.query.options(joinedload(LicenseKey.product)).filter_by(license_key=license_key).first()
     
     if not key:
         return jsonify({
@@ -101,7 +427,7 @@ def validate_license_key(license_key):
         'product_name': key.product.name if key.product else None,
         'activation_count': key.activation_count,
         'max_activations': key.max_activations,
-        'expires_at': key.expires_at.isoformat() if key.expires_at else None
+        'expires_at': key.expires_at
     }
     
     if not is_valid:
@@ -148,29 +474,53 @@ def get_user_purchases():
     
     user_id = session['user_id']
     
+    # ?fields= / ?include= decide both the output and what gets loaded
+    fieldset = Fieldset.from_request('order')
+    
     # Get completed orders
     orders = Order.query.filter_by(
         user_id=user_id,
         status='completed'
-    ).order_by(Order.created_at.desc()).all()
+    ).options(*Order.load_options(fieldset)).order_by(Order.created_at.desc()).all()
+    
+    # Downloads and license keys of every order in one query each, not one per order
+    order_ids = [order.id for order in orders]
+    downloads_by_order = {}
+    if fieldset.includes('downloads') and order_ids:
+        for download in with_products(Download.query, Download).filter(
+            Download.user_id == user_id,
+            Download.order_id.in_(order_ids)
+        ).order_by(Download.id):
+            downloads_by_order.setdefault(download.order_id, []).append(download)
+    
+    license_keys_by_order = {}
+    if fieldset.includes('license_keys') and order_ids:
+        for key in with_products(LicenseKey.query, LicenseKey).filter(
+            LicenseKey.user_id == user_id,
+            LicenseKey.order_id.in_(order_ids)
+        ).order_by(LicenseKey.id):
+            license_keys_by_order.setdefault(key.order_id, []).append(key)
+    certificates = license_certificates.certificates_for(
+        [key for keys in license_keys_by_order.values() for key in keys]
+    )
     
     purchases = []
     for order in orders:
-        order_data = order.to_dict()
+        order_data = order.to_dict(fieldset)
         
         # Add downloads for this order
-        downloads = Download.query.filter_by(
-            user_id=user_id,
-            order_id=order.id
-        ).all()
-        order_data['downloads'] = [download.to_dict() for download in downloads]
+        if fieldset.includes('downloads'):
+            order_data['downloads'] = [
+                fieldset.filter('download', download_to_dict(download))
+                for download in downloads_by_order.get(order.id, [])
+            ]
         
         # Add license keys for this order
-        license_keys = LicenseKey.query.filter_by(
-            user_id=user_id,
-            order_id=order.id
-        ).all()
-        order_data['license_keys'] = [key.to_dict() for key in license_keys]
+        if fieldset.includes('license_keys'):
+            order_data['license_keys'] = [
+                fieldset.filter('license_key', license_key_to_dict(key, certificates))
+                for key in license_keys_by_order.get(order.id, [])
+            ]
         
         purchases.append(order_data)
     
@@ -189,14 +539,15 @@ def admin_get_downloads():
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 20, type=int)
     
-    downloads = Download.query.order_by(Download.created_at.desc()).paginate(
+    downloads = with_products(Download.query, Download).order_by(Download.created_at.desc()).paginate(
         page=page, 
         per_page=per_page, 
         error_out=False
     )
     
+    fieldset = Fieldset.from_request('download')
     return jsonify({
-        'downloads': [download.to_dict() for download in downloads.items],
+        'downloads': [fieldset.filter('download', download.to_dict()) for download in downloads.items],
         'total': downloads.total,
         'pages': downloads.pages,
         'current_page': page,
@@ -215,14 +566,15 @@ def admin_get_license_keys():
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 20, type=int)
     
-    license_keys = LicenseKey.query.order_by(LicenseKey.created_at.desc()).paginate(
+    license_keys = with_products(LicenseKey.query, LicenseKey).order_by(LicenseKey.created_at.desc()).paginate(
         page=page, 
         per_page=per_page, 
         error_out=False
     )
     
+    fieldset = Fieldset.from_request('license_key')
     return jsonify({
-        'license_keys': [key.to_dict() for key in license_keys.items],
+        'license_keys': [fieldset.filter('license_key', key.to_dict()) for key in license_keys.items],
         'total': license_keys.total,
         'pages': license_keys.pages,
         'current_page': page,
@@ -244,6 +596,7 @@ def admin_deactivate_license_key(key_id):
     
     license_key.is_active = False
     db.session.commit()
+    rows_changed.send(LicenseKey, ids=[license_key.id])
     
     return jsonify({
         'message': 'License key deactivated',
@@ -266,9 +619,85 @@ def admin_reset_download(download_id):
     download.download_count = 0
     download.last_downloaded_at = None
     db.session.commit()
+    rows_changed.send(Download, ids=[download.id])
     
     return jsonify({
         'message': 'Download count reset',
         'download': download.to_dict()
     })
 
+
+@download_bp.route('/admin/license-keys/deactivate', methods=['POST'])
+def admin_bulk_deactivate_license_keys():
+    """Deactivate every license key matching a filter (admin only)"""
+    if not require_auth():
+        return jsonify({'error': 'Authentication required'}), 401
+    
+    if not session.get('is_admin', False):
+        return jsonify({'error': 'Admin privileges required'}), 403
+    
+    conditions, error = bulk_filter(LicenseKey, request.json)
+    if error:
+        return jsonify({'error': error}), 400
+    
+    ids = bulk_update(LicenseKey, conditions + [LicenseKey.is_active == True], {'is_active': False})
+    
+    return jsonify({
+        'message': 'License keys deactivated',
+        'deactivated': len(ids)
+    })
+
+@download_bp.route('/admin/downloads/reset', methods=['POST'])
+def admin_bulk_reset_downloads():
+    """Reset download counts for every download matching a filter (admin only)"""
+    if not require_auth():
+        return jsonify({'error': 'Authentication required'}), 401
+    
+    if not session.get('is_admin', False):
+        return jsonify({'error': 'Admin privileges required'}), 403
+    
+    conditions, error = bulk_filter(Download, request.json)
+    if error:
+        return jsonify({'error': error}), 400
+    
+    conditions.append((Download.download_count != 0) | (Download.last_downloaded_at.isnot(None)))
+    ids = bulk_update(Download, conditions, {'download_count': 0, 'last_downloaded_at': None})
+    
+    return jsonify({
+        'message': 'Download counts reset',
+        'reset': len(ids)
+    })
+
+@download_bp.route('/admin/products/<int:product_id>/file', methods=['POST'])
+def admin_upload_product_file(product_id):
+    """Ingest a product's file into content-addressed storage (admin only)"""
+    if not require_auth():
+        return jsonify({'error': 'Authentication required'}), 401
+    
+    if not session.get('is_admin', False):
+        return jsonify({'error': 'Admin privileges required'}), 403
+    
+    product = Product.query.get(product_id)
+    if not product:
+        return jsonify({'error': 'Product not found'}), 404
+    
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        return jsonify({'error': 'No file provided'}), 400
+    
+    # Hash, deduplicate and sniff once, downloads reuse the recorded metadata
+    storage = get_storage()
+    stored = storage.ingest(upload.stream, upload.filename)
+    
+    product.file_path = storage.local_path(stored.key)
+    product.file_name = upload.filename
+    product.file_size = stored.size
+    product.file_sha256 = stored.sha256
+    product.file_mime_type = stored.mime_type
+    db.session.commit()
+    
+    return jsonify({
+        'message': 'Product file stored',
+        'deduplicated': not stored.created,
+        'product': product.to_dict()
+    })
@@ -0,0 +1,98 @@
+import base64
+import hashlib
+import hmac
+import struct
+import time
+from datetime import datetime, timedelta
+from flask import current_app
+
+# version (1 byte) | download id (8 bytes) | expiry, unix seconds (4 bytes)
+PAYLOAD_FORMAT = '>BQI'
+PAYLOAD_SIZE = struct.calcsize(PAYLOAD_FORMAT)
+SIGNATURE_SIZE = 16
+TOKEN_VERSION = 1
+DEFAULT_TTL = timedelta(days=7)
+
+
+class InvalidToken(Exception):
+    pass
+
+
+class ExpiredToken(InvalidToken):
+    pass
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(data):
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def _signing_key(version):
+    """Derive the HMAC key for a token version from the app secret"""
+    keys = current_app.config.get('DOWNLOAD_TOKEN_KEYS')
+    if keys:
+        secret = keys.get(version)
+        if secret is None:
+            raise InvalidToken('Unknown token version')
+    else:
+        secret = current_app.config['SECRET_KEY']
+    if isinstance(secret, str):
+        secret = secret.encode('utf-8')
+    return hashlib.sha256(b'download-token:' + secret).digest()
+
+
+def current_version():
+    keys = current_app.config.get('DOWNLOAD_TOKEN_KEYS')
+    return max(keys) if keys else TOKEN_VERSION
+
+
+def is_signed_token(token):
+    """Signed tokens are '<payload>.<signature>', legacy tokens have no dot"""
+    return '.' in token
+
+
+def sign_download_token(download_id, expires_at=None, version=None):
+    """Create a self-describing token for a Download row"""
+    version = current_version() if version is None else version
+    if expires_at is None:
+        expires_at = datetime.utcnow() + current_app.config.get('DOWNLOAD_TOKEN_TTL', DEFAULT_TTL)
+    expires = int((expires_at - datetime(1970, 1, 1)).total_seconds())
+    payload = struct.pack(PAYLOAD_FORMAT, version, download_id, expires)
+    signature = hmac.new(_signing_key(version), payload, hashlib.sha256).digest()[:SIGNATURE_SIZE]
+    return f'{_b64encode(payload)}.{_b64encode(signature)}'
+
+
+def verify_download_token(token, now=None):
+    """Check a signed token without touching the database
+
+    Returns the download id, raises InvalidToken for forged or malformed
+    tokens and ExpiredToken once the embedded expiry has passed.
+    """
+    try:
+        encoded_payload, encoded_signature = token.split('.', 1)
+        payload = _b64decode(encoded_payload)
+        signature = _b64decode(encoded_signature)
+    except (ValueError, TypeError):
+        raise InvalidToken('Malformed token')
+    if len(payload) != PAYLOAD_SIZE or len(signature) != SIGNATURE_SIZE:
+        raise InvalidToken('Malformed token')
+
+    version, download_id, expires = struct.unpack(PAYLOAD_FORMAT, payload)
+    expected = hmac.new(_signing_key(version), payload, hashlib.sha256).digest()[:SIGNATURE_SIZE]
+    if not hmac.compare_digest(signature, expected):
+        raise InvalidToken('Bad signature')
+    if expires < (time.time() if now is None else now):
+        raise ExpiredToken('Token expired')
+    return download_id
+
+
+def token_for(download):
+    """Signed token for a Download, expiring with the download itself"""
+    expires_at = download.expires_at
+    ttl_expiry = datetime.utcnow() + current_app.config.get('DOWNLOAD_TOKEN_TTL', DEFAULT_TTL)
+    if expires_at is None or expires_at > ttl_expiry:
+        expires_at = ttl_expiry
+    return sign_download_token(download.id, expires_at)
@@ -0,0 +1,97 @@
+from flask import request
+from sqlalchemy import inspect
+from sqlalchemy.orm import load_only
+
+
+def parse_list(value):
+    """Parse a comma separated query parameter into a set of names"""
+    return {name.strip() for name in (value or '').split(',') if name.strip()}
+
+
+class Fieldset:
+    """Sparse fieldset selected by the client
+
+    ?fields=id,name,price        columns of the top-level resource
+    ?fields[category]=id,name    columns of a nested resource type
+    ?include=category,order_items.product
+                                 relationships to embed (dotted for nesting)
+
+    With no parameters every column and the model's default relationships are
+    returned, matching the full to_dict() output. Once `fields` is given,
+    relationships must be asked for explicitly with `include`.
+    """
+
+    def __init__(self, fields=None, include=None):
+        self.fields = fields or {}  # resource type -> set of column names
+        self.include = include  # set of relationship paths, None for model defaults
+
+    @classmethod
+    def from_request(cls, resource, args=None):
+        args = request.args if args is None else args
+        fields = {}
+        if args.get('fields'):
+            fields[resource] = parse_list(args.get('fields'))
+        for key, value in args.items():
+            if key.startswith('fields[') and key.endswith(']'):
+                fields[key[7:-1]] = parse_list(value)
+
+        if 'include' in args:
+            include = parse_list(args.get('include'))
+        elif fields:
+            include = set()
+        else:
+            include = None
+        return cls(fields, include)
+
+    @property
+    def is_full(self):
+        return not self.fields and self.include is None
+
+    def wants(self, resource, name):
+        names = self.fields.get(resource)
+        return names is None or name in names
+
+    def includes(self, name, default=True):
+        """Whether relationship `name` should be embedded at this level"""
+        if self.include is None:
+            return default
+        return any(path == name or path.startswith(name + '.') for path in self.include)
+
+    def nested(self, name):
+        """Fieldset for objects reached through relationship `name`"""
+        if self.include is None:
+            return Fieldset(self.fields, None)
+        prefix = name + '.'
+        return Fieldset(self.fields, {path[len(prefix):] for path in self.include if path.startswith(prefix)})
+
+    def columns(self, obj, resource, names):
+        """Collect the requested subset of `names` from a model instance"""
+        selected = self.fields.get(resource)
+        if selected is None:
+            return {name: getattr(obj, name) for name in names}
+        return {name: getattr(obj, name) for name in names if name in selected}
+
+    def filter(self, resource, data):
+        """Drop unrequested keys from an already serialized dict"""
+        selected = self.fields.get(resource)
+        if selected is None:
+            return data
+        return {key: value for key, value in data.items() if key in selected}
+
+    def load_only(self, model, resource):
+        """load_only() option deferring every unrequested column
+
+        Primary and foreign keys are always loaded so relationships still resolve.
+        """
+        selected = self.fields.get(resource)
+        if selected is None:
+            return []
+        attrs = []
+        for prop in inspect(model).column_attrs:
+            column = prop.columns[0]
+            if prop.key in selected or column.primary_key or column.foreign_keys:
+                attrs.append(getattr(model, prop.key))
+        return [load_only(*attrs)]
+
+
+FULL_FIELDSET = Fieldset()
@@ -0,0 +1,228 @@
+"""
+Idempotency-Key support for endpoints with side effects
+
+The first request with a key inserts an in-flight record, does its work and
+stores its status and body. A retry with the same key and body is answered
+from that record without running anything; a retry while the first one is
+still running waits for it (woken directly within the process, polling the
+table across processes) instead of racing it. Reusing a key with a different
+body is an error. Only final outcomes are stored: 5xx responses and those
+the view marks retryable() (a Stripe outage, a payment still processing)
+release the key, so a retry runs the request again.
+
+Records expire after IDEMPOTENCY_TTL seconds (default 24h) and are purged by
+the maintenance sweeper. A record left in flight by a crashed worker is taken
+over after IDEMPOTENCY_LOCK_TIMEOUT seconds.
+"""
+import functools
+import hashlib
+import threading
+import time
+from datetime import datetime, timedelta
+from flask import Response, current_app, g, jsonify, make_response, request, session
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from src.models.user import db
+from src.models.idempotency_record import IdempotencyRecord
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+DEFAULT_TTL = 24 * 3600
+DEFAULT_LOCK_TIMEOUT = 60
+POLL_INTERVAL = 0.05
+
+_waiters = {}  # key_hash -> Event set when the in-flight request finishes here
+_waiters_lock = threading.Lock()
+
+
+class IdempotencyError(Exception):
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+class StoredResponse:
+    __slots__ = ('status_code', 'body')
+
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.body = body
+
+
+def key_hash(user_id, scope, key):
+    return hashlib.sha256(f'{user_id}\0{scope}\0{key}'.encode('utf-8')).digest()
+
+
+def fingerprint(scope, body):
+    return hashlib.sha256(scope.encode('utf-8') + b'\0' + (body or b'')).digest()
+
+
+def _event(claim):
+    with _waiters_lock:
+        return _waiters.setdefault(claim, threading.Event())
+
+
+def _release(claim):
+    with _waiters_lock:
+        event = _waiters.pop(claim, None)
+    if event is not None:
+        event.set()
+
+
+def _try_insert(claim, request_fingerprint, now, ttl):
+    try:
+        db.session.execute(insert(IdempotencyRecord).values(
+            key_hash=claim,
+            fingerprint=request_fingerprint,
+            locked_at=now,
+            expires_at=now + timedelta(seconds=ttl)
+        ))
+        db.session.commit()
+        return True
+    except IntegrityError:
+        db.session.rollback()
+        return False
+
+
+def begin(user_id, scope, key, body):
+    """Claim a key, or return the response stored for it
+
+    Returns (claim, None) when the caller should run the request and then call
+    complete() or abandon() with the claim, or (None, StoredResponse) for a
+    replay. Raises IdempotencyError for a bad key, a key reused with another
+    body, or a duplicate still running after the wait.
+    """
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise IdempotencyError(f'{HEADER} must be 1 to {MAX_KEY_LENGTH} characters', 400)
+
+    config = current_app.config
+    ttl = config.get('IDEMPOTENCY_TTL', DEFAULT_TTL)
+    lock_timeout = config.get('IDEMPOTENCY_LOCK_TIMEOUT', DEFAULT_LOCK_TIMEOUT)
+    claim = key_hash(user_id, scope, key)
+    request_fingerprint = fingerprint(scope, body)
+    deadline = time.monotonic() + lock_timeout
+
+    while True:
+        now = datetime.utcnow()
+        if _try_insert(claim, request_fingerprint, now, ttl):
+            return claim, None
+
+        # Plain rows, the identity map would keep serving the first read
+        record = db.session.execute(
+            select(
+                IdempotencyRecord.fingerprint, IdempotencyRecord.status_code, IdempotencyRecord.body,
+                IdempotencyRecord.locked_at, IdempotencyRecord.expires_at
+            ).where(IdempotencyRecord.key_hash == claim)
+        ).first()
+        if record is None:
+            continue  # Expired and purged in between
+        if record.expires_at <= now:
+            db.session.execute(delete(IdempotencyRecord).where(
+                IdempotencyRecord.key_hash == claim, IdempotencyRecord.expires_at <= now
+            ))
+            db.session.commit()
+            continue
+        if record.fingerprint != request_fingerprint:
+            raise IdempotencyError(f'{HEADER} was already used for a different request', 422)
+        if record.status_code is not None:
+            _release(claim)  # Wake anyone else waiting here
+            return None, StoredResponse(record.status_code, record.body)
+
+        # In flight elsewhere: take it over if its owner died, otherwise wait
+        stale_before = now - timedelta(seconds=lock_timeout)
+        if record.locked_at <= stale_before:
+            taken = db.session.execute(
+                update(IdempotencyRecord).where(
+                    IdempotencyRecord.key_hash == claim,
+                    IdempotencyRecord.status_code.is_(None),
+                    IdempotencyRecord.locked_at <= stale_before
+                ).values(locked_at=now),
+                execution_options={'synchronize_session': False}
+            ).rowcount
+            db.session.commit()
+            if taken:
+                return claim, None
+            continue
+
+        db.session.rollback()  # End the read transaction while waiting
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise IdempotencyError(f'A request with this {HEADER} is still in progress', 409)
+        _event(claim).wait(min(POLL_INTERVAL, remaining))
+
+
+def retryable():
+    """Mark the current view's response as not final, it releases its key instead of being stored"""
+    g.idempotency_retryable = True
+
+
+def complete(claim, status_code, body, final=True):
+    """Store the response for a claimed key, 5xx and non-final responses release the key instead"""
+    if status_code >= 500 or not final:
+        return abandon(claim)
+    db.session.rollback()  # Nothing of the request's own transaction may ride along
+    db.session.execute(
+        update(IdempotencyRecord).where(IdempotencyRecord.key_hash == claim).values(
+            status_code=status_code, body=body
+        ),
+        execution_options={'synchronize_session': False}
+    )
+    db.session.commit()
+    _release(claim)
+
+
+def abandon(claim):
+    """Forget a claimed key so a retry runs the request again"""
+    db.session.rollback()
+    db.session.execute(delete(IdempotencyRecord).where(IdempotencyRecord.key_hash == claim))
+    db.session.commit()
+    _release(claim)
+
+
+def purge_expired(batch_size=500):
+    """Delete expired records in small batches, returns the number deleted"""
+    deleted = 0
+    while True:
+        now = datetime.utcnow()
+        hashes = db.session.execute(
+            select(IdempotencyRecord.key_hash).where(IdempotencyRecord.expires_at <= now).limit(batch_size)
+        ).scalars().all()
+        if not hashes:
+            return deleted
+        db.session.execute(delete(IdempotencyRecord).where(IdempotencyRecord.key_hash.in_(hashes)))
+        db.session.commit()
+        deleted += len(hashes)
+
+
+def replay_response(stored):
+    response = Response(stored.body, status=stored.status_code, mimetype='application/json')
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(scope):
+    """Honour an Idempotency-Key header on a JSON view (authenticated users only)"""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            key = request.headers.get(HEADER)
+            if key is None or 'user_id' not in session:
+                return view(*args, **kwargs)
+            try:
+                claim, stored = begin(session['user_id'], scope, key, request.get_data())
+            except IdempotencyError as e:
+                return jsonify({'error': e.message}), e.status_code
+            if stored is not None:
+                return replay_response(stored)
+
+            try:
+                response = make_response(view(*args, **kwargs))
+            except BaseException:
+                abandon(claim)
+                raise
+            complete(claim, response.status_code, response.get_data(),
+                     final=not g.pop('idempotency_retryable', False))
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,13 @@
+from datetime import datetime
+from src.models.user import db
+
+class IdempotencyRecord(db.Model):
+    """Fingerprint and stored response of a request sent with an Idempotency-Key"""
+    __tablename__ = 'idempotency_record'
+
+    key_hash = db.Column(db.LargeBinary(32), primary_key=True)  # sha256(user, scope, key)
+    fingerprint = db.Column(db.LargeBinary(32), nullable=False)  # sha256(scope, body)
+    status_code = db.Column(db.SmallInteger)  # NULL while the first request is in flight
+    body = db.Column(db.LargeBinary)
+    locked_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
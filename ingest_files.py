@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Scan a directory of product assets and record their real size and type
+
+    python ingest_files.py ASSET_DIR [--workers N] [--processes] [--batch 200]
+                                     [--store] [--create-missing] [--dry-run]
+
+Files are matched to products by Product.file_name. Each file is hashed and
+sniffed by a pool of workers reading into one reused buffer (no per-chunk
+copies; hashlib releases the GIL, so threads scale). Products are updated in
+batches of executemany UPDATEs, one transaction per batch.
+
+By default files are recorded in place (file_path points at the scanned
+file, file_sha256 only provides the ETag). With --store they are copied into
+the content-addressed store instead. A plain run never touches products
+whose file is already in the store. Files whose size and mtime match what
+was recorded last time are skipped without being read.
+"""
+import argparse
+import hashlib
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+sys.path.insert(0, os.path.dirname(__file__))
+
+from sqlalchemy import insert, select, update
+from src.models.user import db
+from src.models.product import Product
+from src.storage import CHUNK_SIZE, get_storage, sniff_mime_type
+
+SNIFF_BYTES = 64
+
+
+def scan(root):
+    """(path, size, mtime) for every regular file under root"""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [name for name in dirnames if not name.startswith('.')]
+        for filename in filenames:
+            if filename.startswith('.'):
+                continue
+            path = os.path.abspath(os.path.join(dirpath, filename))
+            st = os.stat(path)
+            yield path, st.st_size, st.st_mtime
+
+
+def hash_file(path):
+    """(sha256 hex, size, MIME type) read with readinto into a single buffer"""
+    digest = hashlib.sha256()
+    buffer = bytearray(CHUNK_SIZE)
+    view = memoryview(buffer)
+    size = 0
+    head = b''
+    with open(path, 'rb', buffering=0) as f:
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            if size == 0:
+                head = bytes(view[:min(n, SNIFF_BYTES)])
+            digest.update(view[:n])
+            size += n
+    return digest.hexdigest(), size, sniff_mime_type(head, os.path.basename(path))
+
+
+def store_file(storage, path):
+    stored = storage.ingest(path)
+    return stored.sha256, stored.size, stored.mime_type
+
+
+def is_stored(storage, product):
+    return product.file_sha256 is not None and storage.is_stored(product.file_sha256, product.file_path)
+
+
+def is_unchanged(storage, product, path, size, mtime, store):
+    if product.file_size != size or product.file_mtime != mtime or product.file_sha256 is None:
+        return False
+    return is_stored(storage, product) if store else product.file_path == path
+
+
+def product_name(filename):
+    stem = os.path.splitext(filename)[0]
+    return stem.replace('_', ' ').replace('-', ' ').title()
+
+
+def ingest(root, workers=None, processes=False, batch_size=200, store=False,
+           create_missing=False, dry_run=False):
+    """Ingest every file under root, returns a stats dict"""
+    products_by_name = {}
+    for product in db.session.execute(select(
+        Product.id, Product.file_name, Product.file_path, Product.file_size,
+        Product.file_sha256, Product.file_mtime
+    )):
+        products_by_name.setdefault(product.file_name, []).append(product)
+
+    storage = get_storage()
+    if store and processes:
+        processes = False  # The store object is shared, stay in threads
+
+    # Decide from stat() alone what needs reading
+    todo, skipped, unmatched = [], 0, []
+    for path, size, mtime in scan(root):
+        filename = os.path.basename(path)
+        matches = products_by_name.get(filename)
+        if not matches and not create_missing:
+            unmatched.append(path)
+            continue
+        if matches and not store:
+            # Recording a file in place would drop the product's store copy
+            matches = [product for product in matches if not is_stored(storage, product)]
+            if not matches:
+                skipped += 1
+                continue
+        if matches and all(is_unchanged(storage, product, path, size, mtime, store) for product in matches):
+            skipped += 1
+            continue
+        todo.append((path, filename, mtime, matches or []))
+
+    stats = {'scanned': len(todo) + skipped + len(unmatched), 'skipped': skipped, 'unmatched': unmatched,
+             'ingested': 0, 'created': 0, 'bytes': 0}
+    pool_class = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    started = time.perf_counter()
+    pending_rows, new_rows = [], []
+
+    def flush():
+        if not dry_run:
+            if pending_rows:
+                db.session.execute(update(Product), pending_rows)
+            if new_rows:
+                db.session.execute(insert(Product), new_rows)
+            db.session.commit()
+        pending_rows.clear()
+        new_rows.clear()
+
+    with pool_class(max_workers=workers or os.cpu_count()) as pool:
+        if store:
+            results = pool.map(store_file, [storage] * len(todo), [path for path, _, _, _ in todo])
+        else:
+            results = pool.map(hash_file, [path for path, _, _, _ in todo])
+
+        for (path, filename, mtime, matches), (sha256, size, mime_type) in zip(todo, results):
+            values = {
+                'file_path': storage.local_path(sha256) if store else path,
+                'file_name': filename,
+                'file_size': size,
+                'file_sha256': sha256,
+                'file_mime_type': mime_type,
+                'file_mtime': mtime,
+            }
+            if not matches:
+                new_rows.append(dict(values, name=product_name(filename), price=0, is_active=False))
+                stats['created'] += 1
+            for product in matches:
+                pending_rows.append(dict(values, id=product.id))
+            stats['ingested'] += 1
+            stats['bytes'] += size
+            if len(pending_rows) + len(new_rows) >= batch_size:
+                flush()
+    flush()
+
+    stats['elapsed_seconds'] = time.perf_counter() - started
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Record real size, type and hash of product files')
+    parser.add_argument('root', help='directory tree of product assets')
+    parser.add_argument('--workers', type=int, default=None, help='pool size (default: CPU count)')
+    parser.add_argument('--processes', action='store_true', help='use a process pool instead of threads')
+    parser.add_argument('--batch', type=int, default=200, help='products written per transaction')
+    parser.add_argument('--store', action='store_true', help='copy files into the content-addressed store')
+    parser.add_argument('--create-missing', action='store_true',
+                        help='create inactive, unpriced products for unmatched files')
+    parser.add_argument('--dry-run', action='store_true', help='hash and report without writing')
+    args = parser.parse_args()
+
+    from src.main import app
+    with app.app_context():
+        stats = ingest(args.root, args.workers, args.processes, args.batch, args.store,
+                       args.create_missing, args.dry_run)
+
+    elapsed = stats['elapsed_seconds']
+    megabytes = stats['bytes'] / (1024 * 1024)
+    print(f"Scanned {stats['scanned']} files: {stats['ingested']} ingested, "
+          f"{stats['skipped']} unchanged, {len(stats['unmatched'])} unmatched, {stats['created']} products created")
+    print(f"Read {megabytes:.1f} MB in {elapsed:.2f}s ({megabytes / elapsed if elapsed else 0:.1f} MB/s)")
+    for path in stats['unmatched']:
+        print(f"  no product for {path}")
+
+
+if __name__ == '__main__':
+    main()
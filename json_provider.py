@@ -0,0 +1,92 @@
+import dataclasses
+import decimal
+import json
+import uuid
+from datetime import date, datetime, time
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # Fall back to the stdlib encoder
+    orjson = None
+
+
+def encode_decimal(value, as_string=False, raw=False):
+    """Encode a Decimal exactly
+
+    As a string the digits are preserved verbatim. As a number, values that fit
+    in a double's 15 significant digits (every Numeric(10, 2) column) round-trip
+    exactly through float; with raw=True and orjson >= 3.9 the digits are
+    written as-is.
+    """
+    if as_string:
+        return str(value)
+    if raw and orjson is not None and hasattr(orjson, 'Fragment'):
+        return orjson.Fragment(str(value))
+    return float(value)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """JSON provider with native Decimal, datetime and UUID encoding
+
+    Uses orjson when installed and the stdlib encoder otherwise, so models can
+    return raw column values from to_dict(). Set JSON_DECIMAL_AS_STRING to send
+    Decimals as strings instead of numbers.
+    """
+
+    decimal_as_string = False
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.decimal_as_string = app.config.get('JSON_DECIMAL_AS_STRING', False)
+
+    def default(self, o):
+        if isinstance(o, decimal.Decimal):
+            return encode_decimal(o, self.decimal_as_string)
+        if isinstance(o, (datetime, date, time)):
+            return o.isoformat()
+        if isinstance(o, uuid.UUID):
+            return str(o)
+        if dataclasses.is_dataclass(o) and not isinstance(o, type):
+            return dataclasses.asdict(o)
+        if hasattr(o, '__html__'):
+            return str(o.__html__())
+        raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+    def _orjson_default(self, o):
+        if isinstance(o, decimal.Decimal):
+            return encode_decimal(o, self.decimal_as_string, raw=True)
+        return self.default(o)
+
+    def _orjson_option(self):
+        option = orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if self.compact is False or (self.compact is None and self._app.debug):
+            option |= orjson.OPT_INDENT_2
+        return option
+
+    def dumps_bytes(self, obj):
+        """Serialize straight to UTF-8 bytes"""
+        if orjson is not None:
+            return orjson.dumps(obj, default=self._orjson_default, option=self._orjson_option())
+        return self.dumps(obj).encode('utf-8')
+
+    def dumps(self, obj, **kwargs):
+        if orjson is not None and not kwargs:
+            return self.dumps_bytes(obj).decode('utf-8')
+        kwargs.setdefault('default', self.default)
+        kwargs.setdefault('ensure_ascii', self.ensure_ascii)
+        kwargs.setdefault('sort_keys', self.sort_keys)
+        return json.dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if orjson is not None and not kwargs:
+            return orjson.loads(s)
+        return json.loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        if orjson is None:
+            return super().response(obj)
+        return self._app.response_class(self.dumps_bytes(obj), mimetype=self.mimetype)
@@ -0,0 +1,34 @@
+from datetime import datetime
+from src.models.user import db
+
+class LicenseCertificate(db.Model):
+    """The latest signed certificate issued for a license key"""
+    __tablename__ = 'license_certificate'
+
+    license_key = db.Column(db.String(100), primary_key=True)
+    key_hash = db.Column(db.String(32), nullable=False, index=True)  # Hex, as embedded in the certificate
+    issuance = db.Column(db.Integer, nullable=False, default=1)  # Bumped when a revoked key is issued again
+    certificate = db.Column(db.String(255), nullable=False)
+    issued_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+    def to_dict(self):
+        return {
+            'certificate': self.certificate,
+            'issuance': self.issuance,
+            'issued_at': self.issued_at,
+            'expires_at': self.expires_at
+        }
+
+class LicenseRevocation(db.Model):
+    """A revoked certificate issuance, the id orders the revocation feed"""
+    __tablename__ = 'license_revocation'
+    __table_args__ = (db.UniqueConstraint('key_hash', 'issuance'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    key_hash = db.Column(db.String(32), nullable=False)
+    issuance = db.Column(db.Integer, nullable=False)  # Revokes this and every earlier issuance
+    revoked_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def to_list(self):
+        return [self.key_hash, self.issuance]
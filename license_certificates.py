@@ -0,0 +1,337 @@
+"""
+Ed25519-signed license certificates for offline verification
+
+Every license key is issued with a certificate that client software can
+check locally against the published public key, instead of calling the
+validate endpoint on each launch. It only needs to phone home to refresh the
+certificate before it expires and to poll the revocation feed.
+
+A certificate is '<payload>.<signature>', both base64url without padding:
+
+    version (1) | product id (4) | issued, expires: unix seconds (4 + 4)
+    | max activations (2) | issuance (2) | SHA-256 of the license key, first 16 bytes
+
+The version selects the signing key, so keys can be rotated. The issuance
+is bumped when a revoked license key is certified again, and a revocation
+covers its issuance and all earlier ones.
+
+Signing keys are 32 byte Ed25519 seeds that must be configured explicitly:
+LICENSE_SIGNING_KEYS ({version: hex seed}) or a single version 1 seed in
+LICENSE_SIGNING_KEY (hex) or LICENSE_SIGNING_KEY_FILE (raw or hex). Without
+one no certificates are issued, as without cryptography.
+"""
+import base64
+import hashlib
+import struct
+import time
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import and_, delete, select
+
+try:
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey, Ed25519PublicKey
+    from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
+except ImportError:  # License keys still work online, just without certificates
+    Ed25519PrivateKey = Ed25519PublicKey = None
+
+from src.models.user import db
+from src.models.download import LicenseKey
+from src.models.license_certificate import LicenseCertificate, LicenseRevocation
+from src.signals import rows_changed
+
+PAYLOAD_FORMAT = '>BIIIHH16s'
+PAYLOAD_SIZE = struct.calcsize(PAYLOAD_FORMAT)
+SIGNATURE_SIZE = 64
+CERTIFICATE_VERSION = 1
+DEFAULT_TTL = timedelta(days=30)
+REVOKE_BATCH = 500
+DEFAULT_REVOCATION_DELAY = 60
+
+_private_keys = {}
+_key_files = {}
+
+
+class InvalidCertificate(Exception):
+    pass
+
+
+class ExpiredCertificate(InvalidCertificate):
+    pass
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(data):
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def _timestamp(value):
+    return int((value - datetime(1970, 1, 1)).total_seconds())
+
+
+def _read_key_file(path):
+    seed = _key_files.get(path)
+    if seed is None:
+        with open(path, 'rb') as f:
+            data = f.read()
+        seed = _key_files[path] = data if len(data) == 32 else bytes.fromhex(data.decode('ascii').strip())
+    return seed
+
+
+def signing_keys():
+    """{version: seed} of the configured signing keys, empty when there are none"""
+    keys = current_app.config.get('LICENSE_SIGNING_KEYS')
+    if keys:
+        return keys
+    seed = current_app.config.get('LICENSE_SIGNING_KEY')
+    if not seed:
+        path = current_app.config.get('LICENSE_SIGNING_KEY_FILE')
+        seed = _read_key_file(path) if path else None
+    return {CERTIFICATE_VERSION: seed} if seed else {}
+
+
+def available():
+    return Ed25519PrivateKey is not None and bool(signing_keys())
+
+
+def _private_key(version):
+    """The Ed25519 key for a certificate version, from its 32 byte seed"""
+    seed = signing_keys().get(version)
+    if seed is None:
+        raise InvalidCertificate('Unknown certificate version')
+    if isinstance(seed, str):
+        seed = bytes.fromhex(seed)
+
+    key = _private_keys.get(seed)
+    if key is None:
+        key = _private_keys[seed] = Ed25519PrivateKey.from_private_bytes(seed)
+    return key
+
+
+def current_version():
+    return max(signing_keys())
+
+
+def public_keys():
+    """{version: raw 32 byte public key, base64url} of every signing key"""
+    return {
+        version: _b64encode(_private_key(version).public_key().public_bytes(Encoding.Raw, PublicFormat.Raw))
+        for version in sorted(signing_keys())
+    }
+
+
+def key_hash(license_key):
+    """What certificates and the revocation feed identify a license key by"""
+    return hashlib.sha256(license_key.encode('utf-8')).digest()[:16]
+
+
+def certificate_expiry(expires_at=None):
+    """A certificate is valid for the TTL, and never beyond the license itself"""
+    ttl_expiry = datetime.utcnow() + current_app.config.get('LICENSE_CERTIFICATE_TTL', DEFAULT_TTL)
+    if expires_at is None or expires_at > ttl_expiry:
+        return ttl_expiry
+    return expires_at
+
+
+def sign_certificate(license_key, product_id, max_activations, expires_at, issuance=1, version=None):
+    """Create a certificate for a license key"""
+    version = current_version() if version is None else version
+    payload = struct.pack(
+        PAYLOAD_FORMAT, version, product_id, int(time.time()), _timestamp(expires_at),
+        max_activations, issuance, key_hash(license_key)
+    )
+    signature = _private_key(version).sign(payload)
+    return f'{_b64encode(payload)}.{_b64encode(signature)}'
+
+
+def read_certificate(certificate):
+    """The fields of a certificate, without checking its signature"""
+    try:
+        encoded_payload, encoded_signature = certificate.split('.', 1)
+        payload = _b64decode(encoded_payload)
+        signature = _b64decode(encoded_signature)
+    except (ValueError, TypeError):
+        raise InvalidCertificate('Malformed certificate')
+    if len(payload) != PAYLOAD_SIZE or len(signature) != SIGNATURE_SIZE:
+        raise InvalidCertificate('Malformed certificate')
+
+    version, product_id, issued, expires, max_activations, issuance, digest = struct.unpack(PAYLOAD_FORMAT, payload)
+    return {
+        'version': version,
+        'product_id': product_id,
+        'issued': issued,
+        'expires': expires,
+        'max_activations': max_activations,
+        'issuance': issuance,
+        'key_hash': digest.hex()
+    }, payload, signature
+
+
+def verify_certificate(certificate, public_key, license_key=None, now=None):
+    """Check a certificate the way client software does, with nothing but the public key
+
+    public_key is the raw 32 bytes published for the certificate's version.
+    Returns its fields, raises InvalidCertificate for forged or malformed
+    certificates and ones issued for another license key, ExpiredCertificate
+    once the embedded expiry has passed.
+    """
+    fields, payload, signature = read_certificate(certificate)
+    try:
+        Ed25519PublicKey.from_public_bytes(public_key).verify(signature, payload)
+    except (InvalidSignature, ValueError):
+        raise InvalidCertificate('Bad signature')
+    if license_key is not None and fields['key_hash'] != key_hash(license_key).hex():
+        raise InvalidCertificate('Certificate is for another license key')
+    if fields['expires'] < (time.time() if now is None else now):
+        raise ExpiredCertificate('Certificate expired')
+    return fields
+
+
+def issue_certificates(license_keys):
+    """Certificate rows for newly created LicenseKey objects, empty without cryptography or a key
+
+    Only needs the values set before the insert, so fulfillment can bulk
+    insert the keys and their certificates without reading ids back.
+    """
+    if not available():
+        return []
+    default_max_activations = LicenseKey.__table__.c.max_activations.default
+    now = datetime.utcnow()
+    rows = []
+    for key in license_keys:
+        max_activations = key.max_activations
+        if max_activations is None and default_max_activations is not None:
+            max_activations = default_max_activations.arg
+        expires_at = certificate_expiry(key.expires_at)
+        rows.append({
+            'license_key': key.license_key,
+            'key_hash': key_hash(key.license_key).hex(),
+            'issuance': 1,
+            'certificate': sign_certificate(key.license_key, key.product_id, max_activations or 0, expires_at),
+            'issued_at': now,
+            'expires_at': expires_at
+        })
+    return rows
+
+
+def refresh_certificate(key):
+    """The current certificate of a valid LicenseKey, re-signed once half its lifetime has passed
+
+    A key certified again after a revocation gets the next issuance, so the
+    revocation keeps covering the old certificates only.
+    """
+    record = LicenseCertificate.query.get(key.license_key)
+    now = datetime.utcnow()
+    if record is not None:
+        fields = read_certificate(record.certificate)[0]
+        half_life = record.issued_at + (record.expires_at - record.issued_at) / 2
+        revoked = LicenseRevocation.query.filter_by(key_hash=record.key_hash, issuance=record.issuance).first()
+        if revoked is None and now < half_life and fields['product_id'] == key.product_id \
+                and fields['max_activations'] == key.max_activations:
+            return record
+        if revoked is not None:
+            record.issuance += 1
+    else:
+        record = LicenseCertificate(
+            license_key=key.license_key,
+            key_hash=key_hash(key.license_key).hex(),
+            issuance=1
+        )
+        db.session.add(record)
+
+    record.expires_at = certificate_expiry(key.expires_at)
+    record.issued_at = now
+    record.certificate = sign_certificate(
+        key.license_key, key.product_id, key.max_activations, record.expires_at, issuance=record.issuance
+    )
+    db.session.commit()
+    return record
+
+
+def certificates_for(license_keys):
+    """{license key: LicenseCertificate} for a list of LicenseKey, one query"""
+    values = [key.license_key for key in license_keys]
+    if not values:
+        return {}
+    return {
+        record.license_key: record
+        for record in LicenseCertificate.query.filter(LicenseCertificate.license_key.in_(values))
+    }
+
+
+def revoke_deactivated(sender, ids=(), **kwargs):
+    """Publish the certificates of deactivated license keys (rows_changed receiver)
+
+    Keys that were deleted instead are left out, their certificates never
+    outlive the license itself.
+    """
+    ids = list(ids)
+    # A transaction of its own, committing the session would expire the caller's objects
+    with db.engine.begin() as connection:
+        revoked = []
+        for start in range(0, len(ids), REVOKE_BATCH):
+            revoked.extend(connection.execute(
+                select(LicenseCertificate.key_hash, LicenseCertificate.issuance)
+                .join(LicenseKey, LicenseKey.license_key == LicenseCertificate.license_key)
+                .outerjoin(LicenseRevocation, and_(
+                    LicenseRevocation.key_hash == LicenseCertificate.key_hash,
+                    LicenseRevocation.issuance == LicenseCertificate.issuance
+                ))
+                .where(
+                    LicenseKey.id.in_(ids[start:start + REVOKE_BATCH]),
+                    LicenseKey.is_active == False,
+                    LicenseRevocation.id.is_(None)
+                )
+            ).all())
+        if revoked:
+            now = datetime.utcnow()
+            connection.execute(LicenseRevocation.__table__.insert(), [
+                {'key_hash': digest, 'issuance': issuance, 'revoked_at': now} for digest, issuance in revoked
+            ])
+
+
+def revocations(since=0, limit=1000):
+    """Revocations after the cursor since, oldest first
+
+    Ids are taken at insert but show up at commit, so a lower id can still
+    be committing while a higher one is visible. The feed stops before the
+    first revocation younger than LICENSE_REVOCATION_DELAY seconds, so the
+    cursor never moves past an id that may still appear.
+    """
+    rows = LicenseRevocation.query.filter(LicenseRevocation.id > since).order_by(
+        LicenseRevocation.id
+    ).limit(limit).all()
+    settled = datetime.utcnow() - timedelta(
+        seconds=current_app.config.get('LICENSE_REVOCATION_DELAY', DEFAULT_REVOCATION_DELAY)
+    )
+    for index, row in enumerate(rows):
+        if row.revoked_at > settled:
+            return rows[:index]
+    return rows
+
+
+def purge_orphaned(batch_size=REVOKE_BATCH):
+    """Delete the certificates of archived or deleted license keys, returns the number deleted
+
+    Archived keys have expired, and their certificates with them, so there
+    is nothing to revoke; revocations already published stay in the feed.
+    """
+    deleted = 0
+    while True:
+        orphans = db.session.execute(
+            select(LicenseCertificate.license_key)
+            .outerjoin(LicenseKey, LicenseKey.license_key == LicenseCertificate.license_key)
+            .where(LicenseKey.id.is_(None))
+            .limit(batch_size)
+        ).scalars().all()
+        if not orphans:
+            return deleted
+        db.session.execute(delete(LicenseCertificate).where(LicenseCertificate.license_key.in_(orphans)))
+        db.session.commit()
+        deleted += len(orphans)
+
+
+rows_changed.connect(revoke_deactivated, sender=LicenseKey)
@@ -3,15 +3,25 @@ import sys
 # DON'T CHANGE THIS !!!
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
-from flask import Flask, send_from_directory
+from flask import Flask
 from flask_cors import CORS
 from src.models.user import db
+from src.compression import Compress
+from src.static_assets import StaticManifest
+from src.json_provider import FastJSONProvider
+from src.maintenance import Sweeper
+from src.profiler import Profiler
 
 # Import all models to ensure they're registered
 from src.models.user import User
 from src.models.product import Product, Category
 from src.models.order import Order, OrderItem
 from src.models.download import Download, LicenseKey
+from src.models.archive import download_archive, license_key_archive
+from src.models.stats import ProductDailyStats, CategoryDailyStats
+from src.models.idempotency_record import IdempotencyRecord
+from src.models.recommendation import RelatedProduct, RecommendationBuild
+from src.models.license_certificate import LicenseCertificate, LicenseRevocation
 
 # Import all blueprints
 from src.routes.user import user_bp
@@ -20,13 +30,26 @@ from src.routes.product import product_bp
 from src.routes.order import order_bp
 from src.routes.download import download_bp
 from src.routes.payment import payment_bp
+from src.routes.reports import reports_bp
+from src.routes.catalog import catalog_bp
+from src.routes.related import related_bp
+from src.routes.profiling import profiling_bp
 
 app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
 app.config['SECRET_KEY'] = 'asdf#FGSgvasgf$5$WGT'
 
+# Encode Decimal/datetime/UUID natively so models can return raw column values
+app.json = FastJSONProvider(app)
+
 # Enable CORS for all routes
 CORS(app, supports_credentials=True)
 
+# Negotiated gzip/brotli compression for API responses
+Compress(app)
+
+# Admin-started sampling profiler, off (and out of the request path) by default
+Profiler(app)
+
 # Register all blueprints
 app.register_blueprint(user_bp, url_prefix='/api')
 app.register_blueprint(auth_bp, url_prefix='/api/auth')
@@ -34,10 +57,21 @@ app.register_blueprint(product_bp, url_prefix='/api')
 app.register_blueprint(order_bp, url_prefix='/api')
 app.register_blueprint(download_bp, url_prefix='/api')
 app.register_blueprint(payment_bp, url_prefix='/api/payment')
+app.register_blueprint(reports_bp, url_prefix='/api')
+app.register_blueprint(catalog_bp, url_prefix='/api')
+app.register_blueprint(related_bp, url_prefix='/api')
+app.register_blueprint(profiling_bp, url_prefix='/api')
 
 # Database configuration
-app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(os.path.dirname(__file__), 'database', 'app.db')}"
+app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv(
+    'DATABASE_URL',
+    f"sqlite:///{os.path.join(os.path.dirname(__file__), 'database', 'app.db')}"
+)
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+# Ed25519 seed that signs license certificates, none are issued without one
+app.config['LICENSE_SIGNING_KEY'] = os.getenv('LICENSE_SIGNING_KEY')
+app.config['LICENSE_SIGNING_KEY_FILE'] = os.getenv('LICENSE_SIGNING_KEY_FILE')
 db.init_app(app)
 
 # Create database tables
@@ -75,21 +109,28 @@ with app.app_context():
         db.session.commit()
         print("Default admin user and categories created!")
 
+# Archive expired downloads and license keys in the background when configured
+sweeper_interval = int(os.getenv('SWEEPER_INTERVAL', '0'))
+if sweeper_interval > 0:
+    Sweeper(app).start(sweeper_interval)
+
+# Static asset manifest, built once so the catch-all never probes the filesystem
+static_manifest = StaticManifest(app.static_folder)
+
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
 def serve(path):
-    static_folder_path = app.static_folder
-    if static_folder_path is None:
+    if app.static_folder is None:
             return "Static folder not configured", 404
 
-    if path != "" and os.path.exists(os.path.join(static_folder_path, path)):
-        return send_from_directory(static_folder_path, path)
+    asset = static_manifest.get(path) if path != "" else None
+    if asset is not None:
+        return static_manifest.make_response(asset)
+
+    if static_manifest.index is not None:
+        return static_manifest.make_response(static_manifest.index)
     else:
-        index_path = os.path.join(static_folder_path, 'index.html')
-        if os.path.exists(index_path):
-            return send_from_directory(static_folder_path, 'index.html')
-        else:
-            return "index.html not found", 404
+        return "index.html not found", 404
 
 # API health check
 @app.route('/api/health', methods=['GET'])
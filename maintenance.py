@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Background sweeper that archives expired/exhausted downloads and license keys
+
+Rows are moved into the archive tables in small batches, each in its own short
+transaction, with a pause between batches so the sweeper never holds the write
+lock for long. Expired idempotency records and the certificates of archived
+license keys are purged the same way. Each run finishes with an incremental VACUUM and ANALYZE. On SQLite the first run
+switches the database to auto_vacuum=INCREMENTAL, which takes one full VACUUM
+of an existing file.
+
+Run once (e.g. from cron) with `python maintenance.py`, or set
+SWEEPER_INTERVAL (seconds) to run it in a background thread.
+"""
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import delete, literal, select
+from src.models.user import db
+from src.models.download import Download, LicenseKey
+from src.models.archive import download_archive, license_key_archive
+from src.signals import rows_changed
+from src.idempotency import purge_expired as purge_idempotency_records
+from src.license_certificates import purge_orphaned as purge_license_certificates
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_GRACE = timedelta(days=30)
+
+
+def download_condition(cutoff):
+    """Downloads that expired, or used up their limit, before the cutoff"""
+    return (
+        (Download.expires_at < cutoff) |
+        ((Download.download_count >= Download.max_downloads) &
+         (Download.last_downloaded_at < cutoff))
+    )
+
+
+def license_key_condition(cutoff):
+    """License keys that expired before the cutoff
+
+    Keys that merely reached max_activations stay put, installed copies keep
+    validating against them.
+    """
+    return LicenseKey.expires_at < cutoff
+
+
+class Sweeper:
+    def __init__(self, app, batch_size=DEFAULT_BATCH_SIZE, pause=0.05, grace=DEFAULT_GRACE,
+                 max_batches=None, vacuum_pages=1000):
+        self.app = app
+        self.batch_size = batch_size
+        self.pause = pause
+        self.grace = grace
+        self.max_batches = max_batches
+        self.vacuum_pages = vacuum_pages
+        self.last_stats = None
+        self._incremental_vacuum = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def archive_batch(self, model, archive, condition):
+        """Move one batch of matching rows into the archive table"""
+        ids = db.session.execute(
+            select(model.id).where(condition).order_by(model.id).limit(self.batch_size)
+        ).scalars().all()
+        if not ids:
+            return []
+
+        table = model.__table__
+        names = [column.name for column in table.columns]
+        db.session.execute(archive.insert().from_select(
+            names + ['archived_at'],
+            select(*[table.c[name] for name in names], literal(datetime.utcnow()))
+            .where(table.c.id.in_(ids))
+        ))
+        db.session.execute(
+            delete(model).where(model.id.in_(ids)),
+            execution_options={'synchronize_session': False}
+        )
+        db.session.commit()
+        return ids
+
+    def sweep(self, model, archive, condition):
+        """Archive matching rows batch by batch, pausing between batches"""
+        archived, batches = 0, 0
+        while not self._stop.is_set():
+            if self.max_batches is not None and batches >= self.max_batches:
+                break
+            started = time.perf_counter()
+            ids = self.archive_batch(model, archive, condition)
+            if not ids:
+                break
+            archived += len(ids)
+            batches += 1
+            rows_changed.send(model, ids=ids)
+
+            # Stay idle at least as long as we held the lock
+            time.sleep(max(self.pause, time.perf_counter() - started))
+        return archived, batches
+
+    def enable_incremental_vacuum(self, conn):
+        """Put a SQLite database in auto_vacuum=INCREMENTAL mode, once per sweeper
+
+        Without it incremental_vacuum does nothing. The mode only takes effect
+        on an existing file after a full VACUUM, which rewrites it once.
+        """
+        if self._incremental_vacuum:
+            return
+        if conn.exec_driver_sql('PRAGMA auto_vacuum').scalar() != 2:  # 2 = INCREMENTAL
+            conn.exec_driver_sql('PRAGMA auto_vacuum = INCREMENTAL')
+            conn.exec_driver_sql('VACUUM')
+        self._incremental_vacuum = True
+
+    def vacuum_analyze(self, tables):
+        """Reclaim free pages and refresh planner statistics"""
+        engine = db.engine
+        stats = {}
+        if engine.dialect.name == 'sqlite':
+            with engine.connect() as conn:
+                self.enable_incremental_vacuum(conn)
+                before = conn.exec_driver_sql('PRAGMA freelist_count').scalar()
+                # The pragma frees one page per step and returns no rows, so a plain
+                # execute would stop after the first; executescript runs it to the end
+                conn.connection.driver_connection.executescript(
+                    f'PRAGMA incremental_vacuum({int(self.vacuum_pages)})')
+                for table in tables:
+                    conn.exec_driver_sql(f'ANALYZE "{table}"')
+                stats['free_pages_reclaimed'] = before - conn.exec_driver_sql('PRAGMA freelist_count').scalar()
+                conn.commit()
+        elif engine.dialect.name == 'postgresql':
+            with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+                for table in tables:
+                    conn.exec_driver_sql(f'VACUUM (ANALYZE) "{table}"')
+        else:
+            with engine.connect() as conn:
+                for table in tables:
+                    conn.exec_driver_sql(f'ANALYZE TABLE {table}')
+        return stats
+
+    def run_once(self):
+        """Run a full sweep and return its statistics"""
+        started, started_at = time.perf_counter(), datetime.utcnow()
+        cutoff = started_at - self.grace
+        with self.app.app_context():
+            downloads, download_batches = self.sweep(Download, download_archive, download_condition(cutoff))
+            license_keys, key_batches = self.sweep(LicenseKey, license_key_archive, license_key_condition(cutoff))
+            idempotency_records = purge_idempotency_records(self.batch_size)
+            license_certificates = purge_license_certificates(self.batch_size)
+            vacuum = self.vacuum_analyze([
+                Download.__tablename__, LicenseKey.__tablename__,
+                download_archive.name, license_key_archive.name
+            ])
+
+        stats = {
+            'started_at': started_at.isoformat(),
+            'downloads_archived': downloads,
+            'license_keys_archived': license_keys,
+            'idempotency_records_purged': idempotency_records,
+            'license_certificates_purged': license_certificates,
+            'batches': download_batches + key_batches,
+            'elapsed_seconds': round(time.perf_counter() - started, 3),
+        }
+        stats.update(vacuum)
+        self.last_stats = stats
+        self.app.logger.info('Maintenance sweep: %s', stats)
+        return stats
+
+    def start(self, interval):
+        """Run the sweeper every `interval` seconds in a daemon thread"""
+        def loop():
+            while not self._stop.wait(interval):
+                try:
+                    self.run_once()
+                except Exception:
+                    self.app.logger.exception('Maintenance sweep failed')
+
+        self._thread = threading.Thread(target=loop, name='maintenance-sweeper', daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+if __name__ == '__main__':
+    from src.main import app
+    stats = Sweeper(app).run_once()
+    for key, value in stats.items():
+        print(f"{key}: {value}")
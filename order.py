@@ -1,6 +1,9 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
 from src.models.user import db
+from src.models.product import Product
+from src.fieldsets import FULL_FIELDSET
+from sqlalchemy.orm import selectinload
 import uuid
 
 class Order(db.Model):
@@ -28,19 +31,28 @@ class Order(db.Model):
         """Generate a unique order number"""
         return f"ORD-{datetime.utcnow().strftime('%Y%m%d')}-{str(uuid.uuid4())[:8].upper()}"
     
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'order_number': self.order_number,
-            'user_id': self.user_id,
-            'total_amount': float(self.total_amount) if self.total_amount else 0,
-            'status': self.status,
-            'payment_intent_id': self.payment_intent_id,
-            'payment_status': self.payment_status,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
-            'order_items': [item.to_dict() for item in self.order_items]
-        }
+    COLUMNS = (
+        'id', 'order_number', 'user_id', 'total_amount', 'status', 'payment_intent_id',
+        'payment_status', 'created_at', 'updated_at'
+    )
+
+    def to_dict(self, fieldset=None):
+        fieldset = fieldset or FULL_FIELDSET
+        data = fieldset.columns(self, 'order', self.COLUMNS)
+        if fieldset.includes('order_items'):
+            item_fieldset = fieldset.nested('order_items')
+            data['order_items'] = [item.to_dict(item_fieldset) for item in self.order_items]
+        return data
+
+    @classmethod
+    def load_options(cls, fieldset):
+        """Query options loading only what to_dict(fieldset) will touch"""
+        options = fieldset.load_only(cls, 'order')
+        if fieldset.includes('order_items'):
+            options.append(selectinload(cls.order_items).options(
+                *OrderItem.load_options(fieldset.nested('order_items'))
+            ))
+        return options
 
 class OrderItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -50,14 +62,19 @@ class OrderItem(db.Model):
     price = db.Column(db.Numeric(10, 2), nullable=False)  # Price at time of purchase
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'order_id': self.order_id,
-            'product_id': self.product_id,
-            'product': self.product.to_dict_public() if self.product else None,
-            'quantity': self.quantity,
-            'price': float(self.price) if self.price else 0,
-            'created_at': self.created_at.isoformat() if self.created_at else None
-        }
+    COLUMNS = ('id', 'order_id', 'product_id', 'quantity', 'price', 'created_at')
+
+    def to_dict(self, fieldset=None):
+        fieldset = fieldset or FULL_FIELDSET
+        data = fieldset.columns(self, 'order_item', self.COLUMNS)
+        if fieldset.includes('product'):
+            data['product'] = self.product.to_dict_public(fieldset.nested('product')) if self.product else None
+        return data
 
+    @classmethod
+    def load_options(cls, fieldset):
+        """Query options loading only what to_dict(fieldset) will touch"""
+        options = fieldset.load_only(cls, 'order_item')
+        if fieldset.includes('product'):
+            options.append(selectinload(cls.product).options(*Product.load_options(fieldset.nested('product'))))
+        return options
@@ -5,6 +5,13 @@ from src.models.user import db
 from src.models.order import Order, OrderItem
 from src.models.product import Product
 from src.models.download import Download, LicenseKey
+from src.models.license_certificate import LicenseCertificate
+from src.rollups import record_sale
+from src.idempotency import HEADER as IDEMPOTENCY_HEADER, idempotent, retryable
+from src.fieldsets import FULL_FIELDSET
+from src.license_certificates import issue_certificates
+from sqlalchemy.orm import selectinload
+from sqlalchemy.orm.attributes import set_committed_value
 
 payment_bp = Blueprint('payment', __name__)
 
@@ -18,6 +25,139 @@ def require_auth():
         return False
     return True
 
+def fulfill_order(order):
+    """Complete a paid order and issue its download links and license keys"""
+    if order.status == 'completed':
+        return 0  # Already fulfilled, don't issue or count it twice
+    
+    # Items and their products in two queries instead of one per item
+    items = OrderItem.query.filter_by(order_id=order.id).options(selectinload(OrderItem.product)).all()
+    set_committed_value(order, 'order_items', items)
+    
+    order.status = 'completed'
+    order.payment_status = 'succeeded'
+    
+    # Create download links and license keys for each product
+    downloads = []
+    license_keys = []
+    for item in items:
+        product = item.product
+        
+        # Create download link
+        downloads.append(Download(
+            user_id=order.user_id,
+            product_id=product.id,
+            order_id=order.id,
+            max_downloads=product.download_limit
+        ))
+        
+        # Create license key
+        license_keys.append(LicenseKey(
+            user_id=order.user_id,
+            product_id=product.id,
+            order_id=order.id
+        ))
+    
+    # One executemany per table, nothing here needs the new ids
+    db.session.bulk_save_objects(downloads)
+    db.session.bulk_save_objects(license_keys)
+    
+    # Signed certificates so clients can check their key offline
+    certificates = issue_certificates(license_keys)
+    if certificates:
+        db.session.bulk_insert_mappings(LicenseCertificate, certificates)
+    
+    # Revenue and units rollups, committed with the order
+    record_sale(order)
+    
+    return len(items)
+
+def load_order(order_id):
+    """An order with its items, products and categories, ready for to_dict()
+
+    Used after a commit, when every loaded object has been expired and
+    to_dict() would otherwise reload them one at a time.
+    """
+    return Order.query.options(*Order.load_options(FULL_FIELDSET)).filter_by(id=order_id).first()
+
+def prepare_payment_intent(user_id):
+    """Find the user's cart and the Stripe parameters for paying it
+
+    Returns (params, None) or (None, (error, status)).
+    """
+    # Get the user's pending order (cart)
+    pending_order = Order.query.filter_by(
+        user_id=user_id, 
+        status='pending'
+    ).first()
+    
+    if not pending_order or not pending_order.order_items:
+        return None, ({'error': 'No items in cart'}, 400)
+    
+    # Calculate total amount in cents
+    total_amount_cents = int(float(pending_order.total_amount) * 100)
+    
+    return {
+        'amount': total_amount_cents,
+        'currency': 'usd',
+        'metadata': {
+            'order_id': pending_order.id,
+            'user_id': user_id
+        }
+    }, None
+
+def attach_payment_intent(order_id, intent):
+    """Store a created payment intent on its order and build the response"""
+    order = Order.query.get(order_id)
+    
+    # Store payment intent ID in order
+    order.payment_intent_id = intent.id
+    db.session.commit()
+    
+    return {
+        'client_secret': intent.client_secret,
+        'payment_intent_id': intent.id,
+        'amount': intent.amount,
+        'order': load_order(order_id).to_dict()
+    }
+
+def is_final(intent):
+    """Whether confirming an intent gives an answer worth keeping for an Idempotency-Key
+
+    A payment still processing (or awaiting action) may succeed later, the
+    client's retry with the same key has to look again.
+    """
+    return intent.status in ('succeeded', 'canceled')
+
+def complete_payment(intent, user_id):
+    """Complete the order paid by a retrieved payment intent
+
+    Returns (response, status).
+    """
+    if intent.status != 'succeeded':
+        return {'error': 'Payment not completed'}, 400
+    
+    # Find the order
+    order = Order.query.filter_by(payment_intent_id=intent.id).first()
+    if not order:
+        return {'error': 'Order not found'}, 404
+    
+    # Verify ownership
+    if order.user_id != user_id:
+        return {'error': 'Access denied'}, 403
+    
+    # Complete the order
+    order_id = order.id
+    created = fulfill_order(order)
+    db.session.commit()
+    
+    return {
+        'message': 'Payment confirmed and order completed',
+        'order': load_order(order_id).to_dict(),
+        'downloads_created': created,
+        'license_keys_created': created
+    }, 200
+
 @payment_bp.route('/config', methods=['GET'])
 def get_stripe_config():
     """Get Stripe publishable key for frontend"""
@@ -25,54 +165,38 @@ def get_stripe_config():
         'publishable_key': STRIPE_PUBLISHABLE_KEY
     })
 
+def stripe_idempotency_key(scope):
+    """Forward the client's Idempotency-Key so Stripe dedupes the call too"""
+    key = request.headers.get(IDEMPOTENCY_HEADER)
+    return f"{session['user_id']}:{scope}:{key}" if key else None
+
 @payment_bp.route('/create-payment-intent', methods=['POST'])
+@idempotent('create-payment-intent')
 def create_payment_intent():
     """Create a Stripe payment intent for the current cart"""
     if not require_auth():
         return jsonify({'error': 'Authentication required'}), 401
     
     try:
-        user_id = session['user_id']
-        
-        # Get the user's pending order (cart)
-        pending_order = Order.query.filter_by(
-            user_id=user_id, 
-            status='pending'
-        ).first()
-        
-        if not pending_order or not pending_order.order_items:
-            return jsonify({'error': 'No items in cart'}), 400
-        
-        # Calculate total amount in cents
-        total_amount_cents = int(float(pending_order.total_amount) * 100)
+        params, error = prepare_payment_intent(session['user_id'])
+        if error:
+            return jsonify(error[0]), error[1]
         
         # Create payment intent
         intent = stripe.PaymentIntent.create(
-            amount=total_amount_cents,
-            currency='usd',
-            metadata={
-                'order_id': pending_order.id,
-                'user_id': user_id
-            }
+            **params, idempotency_key=stripe_idempotency_key('create-payment-intent')
         )
         
-        # Store payment intent ID in order
-        pending_order.payment_intent_id = intent.id
-        db.session.commit()
-        
-        return jsonify({
-            'client_secret': intent.client_secret,
-            'payment_intent_id': intent.id,
-            'amount': total_amount_cents,
-            'order': pending_order.to_dict()
-        })
+        return jsonify(attach_payment_intent(params['metadata']['order_id'], intent))
         
     except stripe.error.StripeError as e:
+        retryable()  # Stripe dedupes the create itself, a retry may get through
         return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': 'Payment intent creation failed'}), 500
 
 @payment_bp.route('/confirm-payment', methods=['POST'])
+@idempotent('confirm-payment')
 def confirm_payment():
     """Confirm payment and complete the order"""
     if not require_auth():
@@ -83,58 +207,16 @@ def confirm_payment():
         return jsonify({'error': 'Payment intent ID required'}), 400
     
     try:
-        payment_intent_id = data['payment_intent_id']
-        
         # Retrieve payment intent from Stripe
-        intent = stripe.PaymentIntent.retrieve(payment_intent_id)
-        
-        if intent.status != 'succeeded':
-            return jsonify({'error': 'Payment not completed'}), 400
-        
-        # Find the order
-        order = Order.query.filter_by(payment_intent_id=payment_intent_id).first()
-        if not order:
-            return jsonify({'error': 'Order not found'}), 404
-        
-        # Verify ownership
-        if order.user_id != session['user_id']:
-            return jsonify({'error': 'Access denied'}), 403
+        intent = stripe.PaymentIntent.retrieve(data['payment_intent_id'])
         
-        # Complete the order
-        order.status = 'completed'
-        order.payment_status = 'succeeded'
-        
-        # Create download links and license keys for each product
-        for item in order.order_items:
-            product = item.product
-            
-            # Create download link
-            download = Download(
-                user_id=order.user_id,
-                product_id=product.id,
-                order_id=order.id,
-                max_downloads=product.download_limit
-            )
-            db.session.add(download)
-            
-            # Create license key
-            license_key = LicenseKey(
-                user_id=order.user_id,
-                product_id=product.id,
-                order_id=order.id
-            )
-            db.session.add(license_key)
-        
-        db.session.commit()
-        
-        return jsonify({
-            'message': 'Payment confirmed and order completed',
-            'order': order.to_dict(),
-            'downloads_created': len(order.order_items),
-            'license_keys_created': len(order.order_items)
-        })
+        response, status = complete_payment(intent, session['user_id'])
+        if not is_final(intent):
+            retryable()
+        return jsonify(response), status
         
     except stripe.error.StripeError as e:
+        retryable()
         return jsonify({'error': f'Stripe error: {str(e)}'}), 400
     except Exception as e:
         return jsonify({'error': 'Payment confirmation failed'}), 500
@@ -165,32 +247,13 @@ def stripe_webhook():
         ).first()
         
         if order and order.status == 'pending':
-            # Complete the order
-            order.status = 'completed'
-            order.payment_status = 'succeeded'
-            
             # Create download links and license keys if not already created
             existing_downloads = Download.query.filter_by(order_id=order.id).count()
             if existing_downloads == 0:
-                for item in order.order_items:
-                    product = item.product
-                    
-                    # Create download link
-                    download = Download(
-                        user_id=order.user_id,
-                        product_id=product.id,
-                        order_id=order.id,
-                        max_downloads=product.download_limit
-                    )
-                    db.session.add(download)
-                    
-                    # Create license key
-                    license_key = LicenseKey(
-                        user_id=order.user_id,
-                        product_id=product.id,
-                        order_id=order.id
-                    )
-                    db.session.add(license_key)
+                fulfill_order(order)
+            else:
+                order.status = 'completed'
+                order.payment_status = 'succeeded'
             
             db.session.commit()
     
@@ -277,37 +340,17 @@ def simulate_payment_success():
         return jsonify({'error': 'No pending order found'}), 404
     
     # Simulate payment success
-    pending_order.status = 'completed'
-    pending_order.payment_status = 'succeeded'
     pending_order.payment_intent_id = f'pi_demo_{pending_order.id}'
     
     # Create download links and license keys
-    for item in pending_order.order_items:
-        product = item.product
-        
-        # Create download link
-        download = Download(
-            user_id=pending_order.user_id,
-            product_id=product.id,
-            order_id=pending_order.id,
-            max_downloads=product.download_limit
-        )
-        db.session.add(download)
-        
-        # Create license key
-        license_key = LicenseKey(
-            user_id=pending_order.user_id,
-            product_id=product.id,
-            order_id=pending_order.id
-        )
-        db.session.add(license_key)
-    
+    order_id = pending_order.id
+    created = fulfill_order(pending_order)
     db.session.commit()
     
     return jsonify({
         'message': 'Payment simulated successfully',
-        'order': pending_order.to_dict(),
-        'downloads_created': len(pending_order.order_items),
-        'license_keys_created': len(pending_order.order_items)
+        'order': load_order(order_id).to_dict(),
+        'downloads_created': created,
+        'license_keys_created': created
     })
 
@@ -1,6 +1,8 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
 from src.models.user import db
+from src.fieldsets import FULL_FIELDSET
+from sqlalchemy.orm import selectinload
 
 class Category(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -11,15 +13,27 @@ class Category(db.Model):
     # Relationship
     products = db.relationship('Product', backref='category', lazy=True)
     
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'name': self.name,
-            'description': self.description,
-            'created_at': self.created_at.isoformat() if self.created_at else None
-        }
+    COLUMNS = ('id', 'name', 'description', 'created_at')
+
+    def to_dict(self, fieldset=None):
+        fieldset = fieldset or FULL_FIELDSET
+        return fieldset.columns(self, 'category', self.COLUMNS)
+
+    @classmethod
+    def load_options(cls, fieldset):
+        """Query options loading only what to_dict(fieldset) will touch"""
+        return fieldset.load_only(cls, 'category')
 
 class Product(db.Model):
+    __table_args__ = (
+        # One per catalog sort (catalog_query.py), in sort order up to id, then
+        # the filtered columns so filters are checked without reading the row
+        db.Index('ix_product_active_created', 'is_active', 'created_at', 'id', 'category_id', 'price'),
+        db.Index('ix_product_active_price', 'is_active', 'price', 'id', 'category_id'),
+        db.Index('ix_product_active_category_created', 'is_active', 'category_id', 'created_at', 'id', 'price'),
+        db.Index('ix_product_active_category_price', 'is_active', 'category_id', 'price', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text)
@@ -28,6 +42,9 @@ class Product(db.Model):
     file_path = db.Column(db.String(500))  # Path to the digital file
     file_name = db.Column(db.String(200))  # Original filename
     file_size = db.Column(db.Integer)  # File size in bytes
+    file_sha256 = db.Column(db.String(64), index=True)  # Content hash, the storage key when file_path is in the store
+    file_mime_type = db.Column(db.String(100))  # Sniffed at ingest time
+    file_mtime = db.Column(db.Float)  # Source file mtime at ingest, lets re-runs skip unchanged files
     download_limit = db.Column(db.Integer, default=5)  # Max downloads per purchase
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -39,33 +56,31 @@ class Product(db.Model):
     order_items = db.relationship('OrderItem', backref='product', lazy=True)
     downloads = db.relationship('Download', backref='product', lazy=True)
     
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'name': self.name,
-            'description': self.description,
-            'price': float(self.price) if self.price else 0,
-            'is_active': self.is_active,
-            'file_name': self.file_name,
-            'file_size': self.file_size,
-            'download_limit': self.download_limit,
-            'category_id': self.category_id,
-            'category': self.category.to_dict() if self.category else None,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'updated_at': self.updated_at.isoformat() if self.updated_at else None
-        }
-    
-    def to_dict_public(self):
+    COLUMNS = (
+        'id', 'name', 'description', 'price', 'is_active', 'file_name', 'file_size',
+        'file_sha256', 'file_mime_type', 'download_limit', 'category_id', 'created_at', 'updated_at'
+    )
+    PUBLIC_COLUMNS = ('id', 'name', 'description', 'price', 'file_name', 'file_size', 'category_id', 'created_at')
+
+    def to_dict(self, fieldset=None):
+        fieldset = fieldset or FULL_FIELDSET
+        data = fieldset.columns(self, 'product', self.COLUMNS)
+        if fieldset.includes('category'):
+            data['category'] = self.category.to_dict(fieldset.nested('category')) if self.category else None
+        return data
+
+    def to_dict_public(self, fieldset=None):
         """Public version without sensitive file information"""
-        return {
-            'id': self.id,
-            'name': self.name,
-            'description': self.description,
-            'price': float(self.price) if self.price else 0,
-            'file_name': self.file_name,
-            'file_size': self.file_size,
-            'category_id': self.category_id,
-            'category': self.category.to_dict() if self.category else None,
-            'created_at': self.created_at.isoformat() if self.created_at else None
-        }
+        fieldset = fieldset or FULL_FIELDSET
+        data = fieldset.columns(self, 'product', self.PUBLIC_COLUMNS)
+        if fieldset.includes('category'):
+            data['category'] = self.category.to_dict(fieldset.nested('category')) if self.category else None
+        return data
 
+    @classmethod
+    def load_options(cls, fieldset):
+        """Query options loading only what to_dict(fieldset) will touch"""
+        options = fieldset.load_only(cls, 'product')
+        if fieldset.includes('category'):
+            options.append(selectinload(cls.category).options(*Category.load_options(fieldset.nested('category'))))
+        return options
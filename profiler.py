@@ -0,0 +1,330 @@
+"""
+On-demand sampling profiler for live requests
+
+An admin starts a profiling session for one endpoint, for a percentage of
+all requests, and/or for single requests carrying the session's token in the
+X-Profile-Token header. While a session is active the app's wsgi_app is
+wrapped; a sampler thread then reads the stacks of the threads serving
+selected requests every few milliseconds and counts them. Without
+a session the wrapper is removed again, so a disabled profiler costs
+nothing per request.
+
+Sessions are shared between worker processes through a small control file
+in PROFILER_DIR that every worker checks each PROFILER_POLL_INTERVAL
+seconds from a background thread. Each worker writes its counts next to it,
+and collapsed_stacks() merges them into the collapsed format read by
+flamegraph.pl, speedscope and similar tools. Only the view runs under the
+profiler, not the streaming of a response body.
+
+Only requests that reach wsgi_app can be sampled. In SERVER_MODE=asgi the
+download and Stripe payment routes are served by native async handlers in
+asgi.py, which registers them with exclude(); sessions for those endpoints
+are refused, and percent or token sessions never select their requests.
+"""
+import json
+import os
+import random
+import secrets
+import sys
+import threading
+import time
+from collections import Counter
+from flask import current_app
+
+HEADER = 'X-Profile-Token'
+CONTROL_FILE = 'control.json'
+DEFAULT_INTERVAL = 0.005
+DEFAULT_DURATION = 60
+MAX_DURATION = 600
+MAX_STACK_DEPTH = 200
+
+
+class ProfileSession:
+    """What to profile and until when, as stored in the control file"""
+
+    def __init__(self, id, endpoint=None, rate=0, token=None, interval=DEFAULT_INTERVAL,
+                 started_at=None, expires_at=None):
+        self.id = id
+        self.endpoint = endpoint
+        self.rate = rate  # Fraction of requests (to endpoint, if set), 0 to 1
+        self.token = token
+        self.interval = interval
+        self.started_at = started_at or time.time()
+        self.expires_at = expires_at or self.started_at + DEFAULT_DURATION
+
+    @property
+    def expired(self):
+        return time.time() >= self.expires_at
+
+    def selects(self, environ, endpoint):
+        """Whether a request is profiled"""
+        if self.token is not None and environ.get('HTTP_X_PROFILE_TOKEN') == self.token:
+            return True
+        if self.endpoint is not None and endpoint != self.endpoint:
+            return False
+        return self.rate >= 1 or (self.rate > 0 and random.random() < self.rate)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'endpoint': self.endpoint,
+            'rate': self.rate,
+            'token': self.token,
+            'interval': self.interval,
+            'started_at': self.started_at,
+            'expires_at': self.expires_at
+        }
+
+
+class Profiler:
+    """Admin-controlled sampling profiler
+
+    Configuration (all optional):
+        PROFILER_DIR            - control file and per-worker stack counts
+                                  (default database/profiles next to the app)
+        PROFILER_POLL_INTERVAL  - seconds between control file checks (default 1)
+    """
+
+    def __init__(self, app=None):
+        self.session = None
+        self._inner = None
+        self._active = {}  # thread id -> root frame label of a profiled request
+        self._counts = Counter()
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._control_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._control_mtime = None
+        self._pid = None
+        self._watcher = None
+        self._sampler = None
+        self._labels = {}
+        self.excluded = {}  # endpoint -> why its requests can't be sampled
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PROFILER_DIR', os.path.join(app.root_path, 'database', 'profiles'))
+        app.config.setdefault('PROFILER_POLL_INTERVAL', 1.0)
+        app.extensions['profiler'] = self
+        self.app = app
+        self.start()
+
+    @property
+    def directory(self):
+        return self.app.config['PROFILER_DIR']
+
+    def exclude(self, endpoints, reason):
+        """Endpoints whose requests never reach wsgi_app in this server mode"""
+        self.excluded.update(dict.fromkeys(endpoints, reason))
+
+    # Control
+
+    def begin(self, endpoint=None, rate=0, header=False, duration=DEFAULT_DURATION, interval=DEFAULT_INTERVAL):
+        """Start a session for every worker, replacing any running one"""
+        now = time.time()
+        session = ProfileSession(
+            id=secrets.token_hex(8),
+            endpoint=endpoint,
+            rate=rate,
+            token=secrets.token_urlsafe(16) if header else None,
+            interval=interval,
+            started_at=now,
+            expires_at=now + min(duration, MAX_DURATION)
+        )
+        self._write_control(session.to_dict())
+        self.reload()
+        return session
+
+    def end(self):
+        """Stop the running session in every worker, its stacks stay readable"""
+        self._write_control(None)
+        self.reload()
+
+    def _write_control(self, data):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, CONTROL_FILE)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def _read_control(self):
+        try:
+            with open(os.path.join(self.directory, CONTROL_FILE)) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return ProfileSession(**data) if data else None
+
+    def reload(self):
+        """Pick up the control file and arm or disarm this process"""
+        with self._control_lock:
+            self._reload()
+        self.flush()
+
+    def _reload(self):
+        try:
+            mtime = os.stat(os.path.join(self.directory, CONTROL_FILE)).st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime != self._control_mtime:
+            self._control_mtime = mtime
+            session = self._read_control()
+            if self.session is not None and (session is None or session.id != self.session.id):
+                self._disarm()
+            if session is not None and not session.expired and self.session is None:
+                self._arm(session)
+        elif self.session is not None and self.session.expired:
+            self._disarm()
+
+    def _arm(self, session):
+        with self._lock:
+            self._counts = Counter()
+            self._dirty = False
+        self.session = session
+        self._sampler = threading.Thread(target=self._sample_loop, args=(session,), name='profiler-sampler', daemon=True)
+        self._sampler.start()
+        self._inner = self.app.wsgi_app
+        self.app.wsgi_app = self._profiled
+
+    def _disarm(self):
+        if self._inner is not None:
+            self.app.wsgi_app = self._inner
+            self._inner = None
+        self.flush()
+        self.session = None
+        self._wake.set()  # Let the sampler see the session is gone
+
+    # Worker threads
+
+    def start(self):
+        """Start the control file watcher, again after a fork"""
+        if self._watcher is not None and self._pid == os.getpid():
+            return
+        if self._pid is not None and self._pid != os.getpid():
+            # A forked worker inherits the parent's session state but not its threads
+            if self._inner is not None:
+                self.app.wsgi_app = self._inner
+                self._inner = None
+            self.session = None
+            self._active = {}
+            self._control_mtime = None
+            self._lock = threading.Lock()  # May have been held by a parent thread
+            self._control_lock = threading.Lock()
+        self._pid = os.getpid()
+        self._stop.clear()
+        self._watcher = threading.Thread(target=self._watch_loop, name='profiler-watcher', daemon=True)
+        self._watcher.start()
+
+    def _watch_loop(self):
+        while not self._stop.wait(self.app.config['PROFILER_POLL_INTERVAL']):
+            try:
+                self.reload()
+            except Exception:
+                self.app.logger.exception('Profiler control check failed')
+
+    def _sample_loop(self, session):
+        frame_label = self._frame_label
+        entry = self._profiled.__code__
+        while self.session is session:
+            if not self._active:
+                self._wake.wait(0.5)
+                self._wake.clear()
+                continue
+            frames = sys._current_frames()
+            samples = []
+            for thread_id, root in list(self._active.items()):
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None and frame.f_code is not entry and len(stack) < MAX_STACK_DEPTH:
+                    stack.append(frame_label(frame.f_code))
+                    frame = frame.f_back
+                stack.append(root)
+                samples.append(';'.join(reversed(stack)))
+            del frames
+            with self._lock:
+                self._counts.update(samples)
+                self._dirty = True
+            time.sleep(session.interval)
+
+    def _frame_label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = f'{code.co_name} ({short_path(code.co_filename)}:{code.co_firstlineno})'
+            self._labels[code] = label
+        return label
+
+    # Request path, only installed while a session is active
+
+    def _profiled(self, environ, start_response):
+        session, inner = self.session, self._inner
+        if session is None or inner is None:
+            return self.app.wsgi_app(environ, start_response)
+        try:
+            endpoint = self.app.url_map.bind_to_environ(environ).match()[0]
+        except Exception:
+            endpoint = None
+        if not session.selects(environ, endpoint):
+            return inner(environ, start_response)
+
+        thread_id = threading.get_ident()
+        self._active[thread_id] = f"{environ.get('REQUEST_METHOD')} {endpoint or environ.get('PATH_INFO')}"
+        self._wake.set()
+        try:
+            return inner(environ, start_response)
+        finally:
+            self._active.pop(thread_id, None)
+
+    # Results
+
+    def flush(self):
+        """Write this worker's counts for the current session"""
+        session = self.session
+        with self._lock:
+            if session is None or not self._dirty:
+                return
+            lines = [f'{stack} {count}\n' for stack, count in self._counts.items()]
+            self._dirty = False
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f'{session.id}.{os.getpid()}.folded')
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.writelines(lines)
+        os.replace(tmp_path, path)
+
+    def collapsed_stacks(self, session_id):
+        """Merged stack counts of every worker, or None for an unknown session"""
+        self.flush()
+        prefix = f'{session_id}.'
+        names = [name for name in os.listdir(self.directory) if name.startswith(prefix) and name.endswith('.folded')] \
+            if os.path.isdir(self.directory) else []
+        if not names:
+            return None
+        counts = Counter()
+        for name in names:
+            with open(os.path.join(self.directory, name)) as f:
+                for line in f:
+                    stack, _, count = line.rstrip('\n').rpartition(' ')
+                    if stack:
+                        counts[stack] += int(count)
+        return counts
+
+    def close(self):
+        self._stop.set()
+        self.flush()
+
+
+def short_path(filename):
+    """A source path relative to the sys.path entry it was imported from"""
+    best = ''
+    for entry in sys.path:
+        if entry and filename.startswith(entry) and len(entry) > len(best):
+            best = entry
+    return filename[len(best):].lstrip(os.sep) if best else filename
+
+
+def get_profiler(app=None):
+    app = app or current_app
+    return app.extensions['profiler']
@@ -0,0 +1,101 @@
+from flask import Blueprint, Response, current_app, jsonify, request, session
+from src.profiler import DEFAULT_DURATION, DEFAULT_INTERVAL, HEADER, MAX_DURATION, get_profiler
+
+profiling_bp = Blueprint('profiling', __name__)
+
+def session_to_dict(profile):
+    data = profile.to_dict()
+    data['percent'] = data.pop('rate') * 100
+    data['header'] = HEADER if profile.token else None
+    return data
+
+@profiling_bp.route('/admin/profiler', methods=['POST'])
+def start_profiling():
+    """Start sampling an endpoint, a percentage of requests and/or requests sending a token (admin only)
+
+    JSON body: endpoint, percent (default 100 with an endpoint), header
+    (true to get a token for the X-Profile-Token header), duration in
+    seconds, interval_ms between samples.
+    """
+    if 'user_id' not in session:
+        return jsonify({'error': 'Authentication required'}), 401
+
+    if not session.get('is_admin', False):
+        return jsonify({'error': 'Admin privileges required'}), 403
+
+    data = request.get_json(silent=True) or {}
+    endpoint = data.get('endpoint')
+    if endpoint is not None and endpoint not in current_app.view_functions:
+        return jsonify({'error': f'Unknown endpoint {endpoint!r}'}), 400
+    if endpoint in get_profiler().excluded:
+        return jsonify({'error': f'{endpoint!r} cannot be profiled: {get_profiler().excluded[endpoint]}'}), 400
+
+    try:
+        percent = float(data.get('percent', 100 if endpoint else 0))
+        duration = float(data.get('duration', DEFAULT_DURATION))
+        interval = float(data.get('interval_ms', DEFAULT_INTERVAL * 1000)) / 1000
+    except (TypeError, ValueError):
+        return jsonify({'error': 'percent, duration and interval_ms must be numbers'}), 400
+
+    if not 0 <= percent <= 100:
+        return jsonify({'error': 'percent must be between 0 and 100'}), 400
+    if not 0 < duration <= MAX_DURATION:
+        return jsonify({'error': f'duration must be between 0 and {MAX_DURATION} seconds'}), 400
+    if not 0.001 <= interval <= 1:
+        return jsonify({'error': 'interval_ms must be between 1 and 1000'}), 400
+    if percent == 0 and not data.get('header'):
+        return jsonify({'error': 'Nothing to profile, give an endpoint, a percent or header: true'}), 400
+
+    profile = get_profiler().begin(
+        endpoint=endpoint,
+        rate=percent / 100,
+        header=bool(data.get('header')),
+        duration=duration,
+        interval=interval
+    )
+    return jsonify({'message': 'Profiling started', 'session': session_to_dict(profile)}), 201
+
+@profiling_bp.route('/admin/profiler', methods=['GET'])
+def get_profiling_status():
+    """The running profiling session, if any (admin only)"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Authentication required'}), 401
+
+    if not session.get('is_admin', False):
+        return jsonify({'error': 'Admin privileges required'}), 403
+
+    profile = get_profiler().session
+    if profile is None or profile.expired:
+        return jsonify({'active': False, 'session': None})
+    return jsonify({'active': True, 'session': session_to_dict(profile)})
+
+@profiling_bp.route('/admin/profiler', methods=['DELETE'])
+def stop_profiling():
+    """Stop the running session in every worker (admin only)"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Authentication required'}), 401
+
+    if not session.get('is_admin', False):
+        return jsonify({'error': 'Admin privileges required'}), 403
+
+    get_profiler().end()
+    return jsonify({'message': 'Profiling stopped'})
+
+@profiling_bp.route('/admin/profiler/<session_id>/stacks', methods=['GET'])
+def get_profile_stacks(session_id):
+    """Sampled stacks in collapsed format, for flamegraph.pl or speedscope (admin only)"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Authentication required'}), 401
+
+    if not session.get('is_admin', False):
+        return jsonify({'error': 'Admin privileges required'}), 403
+
+    if not session_id.isalnum():
+        return jsonify({'error': 'Invalid session id'}), 400
+
+    counts = get_profiler().collapsed_stacks(session_id)
+    if counts is None:
+        return jsonify({'error': 'No samples for this session'}), 404
+
+    body = ''.join(f'{stack} {count}\n' for stack, count in counts.most_common())
+    return Response(body, mimetype='text/plain')
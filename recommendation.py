@@ -0,0 +1,42 @@
+from datetime import datetime
+from src.models.user import db
+
+class RelatedProduct(db.Model):
+    """One of the top-K products most often bought together with product_id"""
+    __tablename__ = 'related_product'
+
+    product_id = db.Column(db.Integer, primary_key=True)
+    rank = db.Column(db.SmallInteger, primary_key=True)  # 0 is the strongest neighbour
+    related_product_id = db.Column(db.Integer, nullable=False)
+    score = db.Column(db.Integer, nullable=False)  # Completed orders containing both
+
+    def to_dict(self):
+        return {
+            'product_id': self.product_id,
+            'rank': self.rank,
+            'related_product_id': self.related_product_id,
+            'score': self.score
+        }
+
+class RecommendationBuild(db.Model):
+    """Timing and size of one recommendation rebuild"""
+    __tablename__ = 'recommendation_build'
+
+    id = db.Column(db.Integer, primary_key=True)
+    mode = db.Column(db.String(20), nullable=False)  # full, incremental
+    started_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    seconds = db.Column(db.Float, nullable=False)
+    orders = db.Column(db.Integer, nullable=False, default=0)  # Orders read by this build
+    products = db.Column(db.Integer, nullable=False, default=0)  # Products whose neighbours were rewritten
+    pairs = db.Column(db.Integer, nullable=False, default=0)  # Non-zero co-purchase cells afterwards
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'mode': self.mode,
+            'started_at': self.started_at,
+            'seconds': self.seconds,
+            'orders': self.orders,
+            'products': self.products,
+            'pairs': self.pairs
+        }
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+"Customers also bought" recommendations from completed orders
+
+A rebuild reads the (order, product) pairs of completed orders into a sparse
+order x product incidence matrix B and computes the co-purchase matrix
+C = B.T @ B with SciPy. The top K neighbours of every product are then cut
+out with one vectorized sort and written to the related_product table, so
+serving them is a K-row index range scan.
+
+C itself is saved next to the database (RECOMMENDATIONS_PATH, an .npz file)
+together with the ids of the orders already counted. An incremental refresh
+only reads orders completed since shortly before the last build, adds the
+co-purchases of those not counted yet to C, and rewrites the neighbours of
+the products they touched. Orders that stop being completed (refunds) are
+only removed by a full rebuild.
+
+    python recommender.py [--full] [--top-k 10]
+
+NumPy and SciPy are only needed to build, not to serve.
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from itertools import chain
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:  # Serving reads the table, only rebuilds need them
+    np = None
+    sparse = None
+
+from flask import current_app
+from sqlalchemy import delete, select
+from src.models.user import db
+from src.models.order import Order, OrderItem
+from src.models.recommendation import RecommendationBuild, RelatedProduct
+
+DEFAULT_TOP_K = 10
+INSERT_BATCH = 10000
+# An order stamped just before a build but committed after its read would be
+# missed by the next refresh; it re-reads this much and skips counted orders
+SINCE_MARGIN = timedelta(minutes=5)
+
+
+def matrix_path(app=None):
+    app = app or current_app
+    return app.config.get('RECOMMENDATIONS_PATH') or os.path.join(app.root_path, 'database', 'copurchases.npz')
+
+
+def require_numpy():
+    if np is None:
+        raise RuntimeError('Building recommendations requires numpy and scipy')
+
+
+def read_pairs(since=None):
+    """(order ids, product ids) of completed orders, as two int64 arrays"""
+    query = select(OrderItem.order_id, OrderItem.product_id).join(
+        Order, Order.id == OrderItem.order_id
+    ).where(Order.status == 'completed')
+    if since is not None:
+        query = query.where(Order.updated_at >= since)
+    # Flat ints straight into the array, no per-row conversion
+    result = db.session.execute(query)
+    pairs = np.fromiter(chain.from_iterable(result), dtype=np.int64).reshape(-1, 2)
+    return pairs[:, 0], pairs[:, 1]
+
+
+def co_purchases(order_ids, product_index):
+    """Sparse product x product matrix of orders containing both, zero diagonal
+
+    product_index holds each pair's column in the product id space.
+    """
+    orders, rows = np.unique(order_ids, return_inverse=True)
+    incidence = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.int32), (rows, product_index)),
+        shape=(len(orders), product_index.max() + 1 if len(product_index) else 0)
+    )
+    incidence.data[:] = 1  # A product listed twice in one order still counts once
+    counts = (incidence.T @ incidence).tocsr()
+    counts.setdiag(0)
+    counts.eliminate_zeros()
+    return counts
+
+
+def top_k(counts, rows, k):
+    """(row, rank, column, score) arrays of the k strongest cells of each of rows"""
+    sub = counts[rows].tocoo()
+    # Strongest first, ties broken by the lower column, all rows in one sort
+    order = np.lexsort((sub.col, -sub.data, sub.row))
+    row, col, data = sub.row[order], sub.col[order], sub.data[order]
+    starts = np.searchsorted(row, row, side='left')
+    rank = np.arange(len(row)) - starts
+    keep = rank < k
+    return rows[row[keep]], rank[keep], col[keep], data[keep]
+
+
+def write_neighbours(ids, counts, rows, k, replace_all):
+    """Replace the related_product rows of the given product rows"""
+    product_rows, ranks, columns, scores = top_k(counts, rows, k)
+    if replace_all:
+        db.session.execute(delete(RelatedProduct))
+    else:
+        affected = ids[rows].tolist()
+        for start in range(0, len(affected), INSERT_BATCH):
+            db.session.execute(delete(RelatedProduct).where(
+                RelatedProduct.product_id.in_(affected[start:start + INSERT_BATCH])
+            ))
+
+    records = [
+        {'product_id': product_id, 'rank': rank, 'related_product_id': related_id, 'score': score}
+        for product_id, rank, related_id, score in zip(
+            ids[product_rows].tolist(), ranks.tolist(), ids[columns].tolist(), scores.tolist()
+        )
+    ]
+    table = RelatedProduct.__table__
+    for start in range(0, len(records), INSERT_BATCH):
+        db.session.connection().execute(table.insert(), records[start:start + INSERT_BATCH])
+    return len(rows)
+
+
+def load_state(path):
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as state:
+        counts = sparse.csr_matrix(
+            (state['data'], state['indices'], state['indptr']), shape=tuple(state['shape'])
+        )
+        return state['ids'], counts, state['orders'], datetime.fromisoformat(str(state['since']))
+
+
+def save_state(path, ids, counts, orders, since):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp.npz'
+    np.savez(
+        tmp_path, ids=ids, data=counts.data, indices=counts.indices, indptr=counts.indptr,
+        shape=np.array(counts.shape), orders=orders, since=np.array(since.isoformat())
+    )
+    os.replace(tmp_path, path)  # Readers never see a half-written file
+
+
+def widen(counts, old_ids, new_ids):
+    """counts re-indexed from old_ids into the larger sorted new_ids space"""
+    position = np.searchsorted(new_ids, old_ids)
+    coo = counts.tocoo()
+    return sparse.csr_matrix(
+        (coo.data, (position[coo.row], position[coo.col])), shape=(len(new_ids), len(new_ids))
+    )
+
+
+def rebuild(full=False, k=None):
+    """Rebuild (or incrementally refresh) the related products, returns the RecommendationBuild"""
+    require_numpy()
+    k = k or current_app.config.get('RECOMMENDATIONS_TOP_K', DEFAULT_TOP_K)
+    path = matrix_path()
+    started_at = datetime.utcnow()
+    started = time.perf_counter()
+
+    state = None if full else load_state(path)
+    if state is None:
+        order_ids, product_ids = read_pairs()
+        ids, product_index = np.unique(product_ids, return_inverse=True)
+        counts = co_purchases(order_ids, product_index)
+        counts.resize((len(ids), len(ids)))
+        orders = np.unique(order_ids)
+        rows = np.arange(len(ids))
+        mode = 'full'
+    else:
+        ids, counts, orders, since = state
+        order_ids, product_ids = read_pairs(since)
+        new = ~np.isin(order_ids, orders)  # Orders updated again after being counted
+        order_ids, product_ids = order_ids[new], product_ids[new]
+
+        all_ids = np.union1d(ids, product_ids)
+        if len(all_ids) != len(ids):
+            counts = widen(counts, ids, all_ids)
+            ids = all_ids
+        delta = co_purchases(order_ids, np.searchsorted(ids, product_ids))
+        delta.resize(counts.shape)
+        counts = (counts + delta).tocsr()
+        orders = np.union1d(orders, order_ids)
+        rows = np.unique(np.searchsorted(ids, product_ids))
+        mode = 'incremental'
+
+    updated = write_neighbours(ids, counts, rows, k, replace_all=mode == 'full')
+    build = RecommendationBuild(
+        mode=mode,
+        started_at=started_at,
+        seconds=time.perf_counter() - started,
+        orders=len(np.unique(order_ids)),
+        products=updated,
+        pairs=counts.nnz
+    )
+    db.session.add(build)
+    db.session.commit()
+
+    # Only after the table is committed, so a failed build is redone from the old state
+    save_state(path, ids, counts, orders, started_at - SINCE_MARGIN)
+    return build
+
+
+def latest_build():
+    return RecommendationBuild.query.order_by(RecommendationBuild.id.desc()).first()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rebuild "customers also bought" recommendations')
+    parser.add_argument('--full', action='store_true', help='recompute from every completed order')
+    parser.add_argument('--top-k', type=int, default=None, help=f'neighbours kept per product (default {DEFAULT_TOP_K})')
+    args = parser.parse_args()
+
+    from src.main import app
+    with app.app_context():
+        build = rebuild(full=args.full, k=args.top_k)
+        print(f"{build.mode.capitalize()} rebuild: {build.orders} orders, {build.products} products updated, "
+              f"{build.pairs} co-purchase pairs in {build.seconds:.2f}s")
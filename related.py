@@ -0,0 +1,62 @@
+from flask import Blueprint, jsonify, request, session
+from src.models.user import db
+from src.models.product import Product
+from src.models.recommendation import RecommendationBuild, RelatedProduct
+from src.recommender import DEFAULT_TOP_K, latest_build, rebuild
+from sqlalchemy import select
+
+related_bp = Blueprint('related', __name__)
+
+@related_bp.route('/products/<int:product_id>/related', methods=['GET'])
+def get_related_products(product_id):
+    """Products most often bought together with this one, strongest first"""
+    limit = min(request.args.get('limit', DEFAULT_TOP_K, type=int), DEFAULT_TOP_K)
+
+    # Precomputed neighbours: an index range scan of at most K rows
+    rows = db.session.execute(
+        select(RelatedProduct.score, Product.id, Product.name, Product.price)
+        .join(Product, Product.id == RelatedProduct.related_product_id)
+        .where(RelatedProduct.product_id == product_id, Product.is_active == True)
+        .order_by(RelatedProduct.rank)
+        .limit(limit)
+    ).all()
+
+    build = latest_build()
+    return jsonify({
+        'product_id': product_id,
+        'related': [
+            {'id': row.id, 'name': row.name, 'price': row.price, 'bought_together': row.score}
+            for row in rows
+        ],
+        'built_at': build.started_at if build else None,
+        'build_seconds': build.seconds if build else None
+    })
+
+@related_bp.route('/admin/recommendations/rebuild', methods=['POST'])
+def rebuild_recommendations():
+    """Refresh the recommendations, incrementally unless ?full=1 (admin only)"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Authentication required'}), 401
+
+    if not session.get('is_admin', False):
+        return jsonify({'error': 'Admin privileges required'}), 403
+
+    try:
+        build = rebuild(full=request.args.get('full', '').lower() in ('1', 'true'))
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 501
+
+    return jsonify({'message': f'{build.mode.capitalize()} rebuild finished', 'build': build.to_dict()})
+
+@related_bp.route('/admin/recommendations/builds', methods=['GET'])
+def get_recommendation_builds():
+    """Recent rebuilds and how long each took (admin only)"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Authentication required'}), 401
+
+    if not session.get('is_admin', False):
+        return jsonify({'error': 'Admin privileges required'}), 403
+
+    limit = min(request.args.get('limit', 20, type=int), 100)
+    builds = RecommendationBuild.query.order_by(RecommendationBuild.id.desc()).limit(limit).all()
+    return jsonify([build.to_dict() for build in builds])
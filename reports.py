@@ -0,0 +1,132 @@
+from flask import Blueprint, jsonify, request, session
+from src.models.user import db
+from src.models.product import Product, Category
+from src.models.stats import CategoryDailyStats, ProductDailyStats
+from sqlalchemy import func, select
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+reports_bp = Blueprint('reports', __name__)
+
+DEFAULT_DAYS = 30
+MAX_DAYS = 366  # Keeps every report bounded by the range, not the history
+
+def parse_range():
+    """(start, end, error) from ?start=YYYY-MM-DD&end=YYYY-MM-DD, both inclusive"""
+    try:
+        end = date.fromisoformat(request.args['end']) if 'end' in request.args else datetime.utcnow().date()
+        start = date.fromisoformat(request.args['start']) if 'start' in request.args else end - timedelta(days=DEFAULT_DAYS - 1)
+    except ValueError:
+        return None, None, 'Dates must be YYYY-MM-DD'
+    if start > end:
+        return None, None, 'start must not be after end'
+    if (end - start).days >= MAX_DAYS:
+        return None, None, f'Date range is limited to {MAX_DAYS} days'
+    return start, end, None
+
+def totals_columns(model):
+    return (
+        func.sum(model.revenue_cents).label('revenue_cents'),
+        func.sum(model.units).label('units'),
+        func.sum(model.downloads).label('downloads')
+    )
+
+def totals_to_dict(row):
+    return {
+        'revenue': Decimal(row.revenue_cents or 0) / 100,
+        'units': row.units or 0,
+        'downloads': row.downloads or 0
+    }
+
+@reports_bp.route('/admin/reports/sales', methods=['GET'])
+def sales_report():
+    """Revenue, units and downloads over a date range, by day, product or category (admin only)"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Authentication required'}), 401
+    
+    if not session.get('is_admin', False):
+        return jsonify({'error': 'Admin privileges required'}), 403
+
+    start, end, message = parse_range()
+    if message:
+        return jsonify({'error': message}), 400
+
+    group = request.args.get('group', 'day')
+    limit = min(request.args.get('limit', 50, type=int), 500)
+
+    if group == 'day':
+        query = select(CategoryDailyStats.day, *totals_columns(CategoryDailyStats)).where(
+            CategoryDailyStats.day.between(start, end)
+        ).group_by(CategoryDailyStats.day).order_by(CategoryDailyStats.day)
+        rows = [dict(totals_to_dict(row), day=row.day) for row in db.session.execute(query)]
+    elif group == 'category':
+        query = select(CategoryDailyStats.category_id, Category.name, *totals_columns(CategoryDailyStats)).join(
+            Category, Category.id == CategoryDailyStats.category_id, isouter=True
+        ).where(
+            CategoryDailyStats.day.between(start, end)
+        ).group_by(CategoryDailyStats.category_id, Category.name).order_by(func.sum(CategoryDailyStats.revenue_cents).desc())
+        rows = [
+            dict(totals_to_dict(row), category_id=row.category_id or None, category_name=row.name)
+            for row in db.session.execute(query)
+        ]
+    elif group == 'product':
+        query = select(ProductDailyStats.product_id, *totals_columns(ProductDailyStats)).where(
+            ProductDailyStats.day.between(start, end)
+        )
+        if 'category_id' in request.args:
+            query = query.where(ProductDailyStats.category_id == request.args.get('category_id', type=int))
+        query = query.group_by(ProductDailyStats.product_id).order_by(
+            func.sum(ProductDailyStats.revenue_cents).desc()
+        ).limit(limit)
+        stats = db.session.execute(query).all()
+        names = dict(db.session.execute(
+            select(Product.id, Product.name).where(Product.id.in_([row.product_id for row in stats]))
+        ).all())
+        rows = [
+            dict(totals_to_dict(row), product_id=row.product_id, product_name=names.get(row.product_id))
+            for row in stats
+        ]
+    else:
+        return jsonify({'error': 'group must be day, product or category'}), 400
+
+    totals = db.session.execute(
+        select(*totals_columns(CategoryDailyStats)).where(CategoryDailyStats.day.between(start, end))
+    ).one()
+
+    return jsonify({
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'group': group,
+        'rows': rows,
+        'totals': totals_to_dict(totals)
+    })
+
+@reports_bp.route('/admin/reports/products/<int:product_id>', methods=['GET'])
+def product_report(product_id):
+    """Daily revenue, units and downloads of one product (admin only)"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Authentication required'}), 401
+    
+    if not session.get('is_admin', False):
+        return jsonify({'error': 'Admin privileges required'}), 403
+
+    start, end, message = parse_range()
+    if message:
+        return jsonify({'error': message}), 400
+
+    stats = ProductDailyStats.query.filter(
+        ProductDailyStats.product_id == product_id,
+        ProductDailyStats.day.between(start, end)
+    ).order_by(ProductDailyStats.day).all()
+
+    return jsonify({
+        'product_id': product_id,
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'days': [day.to_dict() for day in stats],
+        'totals': {
+            'revenue': sum((Decimal(day.revenue_cents) for day in stats), Decimal(0)) / 100,
+            'units': sum(day.units for day in stats),
+            'downloads': sum(day.downloads for day in stats)
+        }
+    })
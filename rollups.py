@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Incrementally maintained sales and download rollups
+
+Fulfilling an order adds its revenue and units, and redeeming a download adds
+one download, to per-day rows for the product and its category. Both happen
+in the same transaction as the event itself with an upsert (src.upserts), so
+reports read a handful of rows per day instead of scanning orders and
+downloads. They run in a savepoint: a failing rollup is logged and skipped,
+never failing the sale or download it counts, and `python rollups.py`
+repairs the totals.
+
+Sales are attributed to the order's creation day. Rebuild them (and backfill
+history) from the source tables with `python rollups.py`; downloads have no
+per-event log, so rebuilt download counts land on each link's last download
+day.
+"""
+import functools
+import logging
+import os
+import sys
+import time
+from collections import defaultdict
+from datetime import date, datetime
+from decimal import ROUND_HALF_UP, Decimal
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import delete, func, select, union_all
+from src.models.user import db
+from src.models.product import Product
+from src.models.order import Order, OrderItem
+from src.models.download import Download
+from src.models.archive import download_archive
+from src.models.stats import UNCATEGORIZED, CategoryDailyStats, ProductDailyStats
+from src.upserts import upsert
+
+logger = logging.getLogger(__name__)
+
+COUNTERS = ('revenue_cents', 'units', 'downloads')
+
+
+def to_cents(amount):
+    return int((Decimal(amount) * 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+
+
+def increment(model, keys, rows):
+    """Add each row's counters to the matching rollup row, creating it if needed"""
+    if not rows:
+        return
+    counters = [name for name in COUNTERS if name in rows[0]]
+    upsert(model, keys, rows, add=counters, values={'updated_at': datetime.utcnow()})
+
+
+def never_fails(record):
+    """Run a rollup update in a savepoint, logging and dropping it on error"""
+    @functools.wraps(record)
+    def wrapper(*args, **kwargs):
+        try:
+            with db.session.begin_nested():
+                record(*args, **kwargs)
+        except Exception:
+            logger.exception("Rollup update failed, rebuild with `python rollups.py`")
+    return wrapper
+
+
+def apply(totals):
+    """Write {(day, product_id, category_id): {counter: n}} into both rollup tables"""
+    categories = defaultdict(lambda: defaultdict(int))
+    product_rows = []
+    for (day, product_id, category_id), counters in totals.items():
+        product_rows.append(dict(counters, day=day, product_id=product_id, category_id=category_id))
+        for name, value in counters.items():
+            categories[(day, category_id)][name] += value
+    category_rows = [
+        dict(counters, day=day, category_id=category_id)
+        for (day, category_id), counters in categories.items()
+    ]
+    increment(ProductDailyStats, ['day', 'product_id'], product_rows)
+    increment(CategoryDailyStats, ['day', 'category_id'], category_rows)
+
+
+@never_fails
+def record_sale(order):
+    """Add a fulfilled order to the rollups (caller commits)"""
+    day = (order.created_at or datetime.utcnow()).date()
+    totals = defaultdict(lambda: {'revenue_cents': 0, 'units': 0})
+    for item in order.order_items:
+        quantity = item.quantity or 1
+        category_id = (item.product.category_id if item.product else None) or UNCATEGORIZED
+        counters = totals[(day, item.product_id, category_id)]
+        counters['revenue_cents'] += to_cents(item.price) * quantity
+        counters['units'] += quantity
+    apply(totals)
+
+
+@never_fails
+def record_downloads(product_ids, day=None):
+    """Add one download per entry of product_ids to the rollups (caller commits)"""
+    if not product_ids:
+        return
+    day = day or datetime.utcnow().date()
+    categories = dict(db.session.execute(
+        select(Product.id, Product.category_id).where(Product.id.in_(set(product_ids)))
+    ).all())
+    totals = defaultdict(lambda: {'downloads': 0})
+    for product_id in product_ids:
+        totals[(day, product_id, categories.get(product_id) or UNCATEGORIZED)]['downloads'] += 1
+    apply(totals)
+
+
+def as_date(value):
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+def rebuild():
+    """Recompute both rollup tables from orders and downloads in one transaction"""
+    totals = defaultdict(lambda: {'revenue_cents': 0, 'units': 0, 'downloads': 0})
+
+    sales = db.session.execute(
+        select(
+            func.date(Order.created_at),
+            OrderItem.product_id,
+            Product.category_id,
+            OrderItem.price,
+            func.sum(func.coalesce(OrderItem.quantity, 1))
+        )
+        .join(OrderItem, OrderItem.order_id == Order.id)
+        .join(Product, Product.id == OrderItem.product_id, isouter=True)
+        .where(Order.status == 'completed')
+        .group_by(func.date(Order.created_at), OrderItem.product_id, Product.category_id, OrderItem.price)
+    )
+    for day, product_id, category_id, price, quantity in sales:
+        counters = totals[(as_date(day), product_id, category_id or UNCATEGORIZED)]
+        counters['revenue_cents'] += to_cents(price) * quantity
+        counters['units'] += quantity
+
+    # Archived links still count
+    live = select(Download.product_id, Download.download_count,
+                  func.coalesce(Download.last_downloaded_at, Download.created_at).label('at'))
+    archived = select(download_archive.c.product_id, download_archive.c.download_count,
+                      func.coalesce(download_archive.c.last_downloaded_at, download_archive.c.created_at))
+    links = union_all(live, archived).subquery()
+    downloads = db.session.execute(
+        select(func.date(links.c.at), links.c.product_id, Product.category_id, func.sum(links.c.download_count))
+        .join(Product, Product.id == links.c.product_id, isouter=True)
+        .where(links.c.download_count > 0)
+        .group_by(func.date(links.c.at), links.c.product_id, Product.category_id)
+    )
+    for day, product_id, category_id, count in downloads:
+        totals[(as_date(day), product_id, category_id or UNCATEGORIZED)]['downloads'] += count
+
+    db.session.execute(delete(ProductDailyStats))
+    db.session.execute(delete(CategoryDailyStats))
+    apply(totals)
+    db.session.commit()
+    return len(totals)
+
+
+if __name__ == '__main__':
+    from src.main import app
+    with app.app_context():
+        started = time.perf_counter()
+        rows = rebuild()
+        print(f"Rebuilt {rows} product/day rollup rows in {time.perf_counter() - started:.2f}s")
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Production entry point: pre-forked gunicorn workers
+
+    python serve.py
+
+The app is imported once in the master (preload) so workers share its memory
+copy-on-write; each worker drops the inherited database connections right
+after fork and opens its own. Workers are recycled after MAX_REQUESTS requests
+(with jitter so they don't all restart at once) and the master logs every
+worker's RSS each RSS_REPORT_INTERVAL seconds.
+
+Reloading:
+    kill -HUP <master>    gracefully replace workers (same preloaded code)
+    kill -USR2 <master>   start a new master with new code alongside the old
+                          one, then kill -QUIT the old master: zero-downtime
+                          deploy
+
+Environment:
+    PORT, WEB_CONCURRENCY (default 2 x CPUs + 1), MAX_REQUESTS (1000),
+    MAX_REQUESTS_JITTER (100), GRACEFUL_TIMEOUT (30), RSS_REPORT_INTERVAL (60),
+    SERVER_MODE (wsgi or asgi, asgi needs uvicorn)
+"""
+import os
+import sys
+import threading
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gunicorn.app.base import BaseApplication
+
+
+def default_workers():
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    return cpus * 2 + 1
+
+
+def worker_rss(pid):
+    """Resident set size of a process in bytes (Linux /proc, psutil elsewhere)"""
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import psutil
+        return psutil.Process(pid).memory_info().rss
+    except Exception:
+        return None
+
+
+def report_rss(server):
+    """Log the RSS of every live worker"""
+    workers = sorted(list(server.WORKERS.items()), key=lambda item: item[1].age)
+    report = []
+    for pid, worker in workers:
+        rss = worker_rss(pid)
+        size = f"{rss / (1024 * 1024):.1f} MB" if rss is not None else "unknown"
+        report.append(f"pid {pid} (age {worker.age}): {size}")
+    server.log.info("Worker RSS: %s", '; '.join(report) or 'no workers')
+
+
+def when_ready(server):
+    interval = int(os.getenv('RSS_REPORT_INTERVAL', '60'))
+    if interval <= 0:
+        return
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            report_rss(server)
+
+    threading.Thread(target=loop, name='rss-report', daemon=True).start()
+
+
+def post_fork(server, worker):
+    """Give each worker its own database connections and profiler watcher"""
+    from src.main import app
+    from src.models.user import db
+    with app.app_context():
+        # close=False leaves the parent's sockets alone, just forgets them here
+        db.engine.dispose(close=False)
+    app.extensions['profiler'].start()
+
+
+def worker_exit(server, worker):
+    """Write out buffered last-login and download timestamps, and profiler samples"""
+    from src.main import app
+    write_behind = app.extensions.get('write_behind')
+    if write_behind is not None:
+        write_behind.close()
+    app.extensions['profiler'].close()  # Keep this worker's samples
+
+
+def child_exit(server, worker):
+    server.log.info("Worker %s (age %s) exited", worker.pid, worker.age)
+
+
+class StoreApplication(BaseApplication):
+    def __init__(self, options=None):
+        self.options = options or {}
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            if key in self.cfg.settings and value is not None:
+                self.cfg.set(key.lower(), value)
+
+    def load(self):
+        if os.getenv('SERVER_MODE', 'wsgi') == 'asgi':
+            from src.asgi import application
+            return application
+        from src.main import app
+        return app
+
+
+def options_from_env():
+    asgi = os.getenv('SERVER_MODE', 'wsgi') == 'asgi'
+    return {
+        'bind': f"0.0.0.0:{os.getenv('PORT', '5000')}",
+        'workers': int(os.getenv('WEB_CONCURRENCY', default_workers())),
+        'worker_class': 'uvicorn.workers.UvicornWorker' if asgi else 'sync',
+        'preload_app': True,
+        'max_requests': int(os.getenv('MAX_REQUESTS', '1000')),
+        'max_requests_jitter': int(os.getenv('MAX_REQUESTS_JITTER', '100')),
+        'graceful_timeout': int(os.getenv('GRACEFUL_TIMEOUT', '30')),
+        'when_ready': when_ready,
+        'post_fork': post_fork,
+        'worker_exit': worker_exit,
+        'child_exit': child_exit,
+    }
+
+
+if __name__ == '__main__':
+    StoreApplication(options_from_env()).run()
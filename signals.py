@@ -0,0 +1,7 @@
+from blinker import Namespace
+
+_signals = Namespace()
+
+# Sent after a set-based UPDATE/DELETE bypassed the ORM, so anything caching
+# those rows can drop them. Receivers get sender=<model class> and ids=[...].
+rows_changed = _signals.signal('rows-changed')
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Static asset manifest for the SPA catch-all route
+
+The manifest is built once (at startup, or ahead of time with
+`python static_assets.py <static_folder>`) and maps every file under the
+static folder to its content hash, size and precompressed variants, so
+serving an asset is a dict lookup instead of filesystem probing.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Response, request
+from werkzeug.wsgi import wrap_file
+from src.compression import choose_encoding
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Vite/webpack style fingerprints: name-<hash>.ext or name.<hash>.ext (or .chunk.ext).
+# The hash is 8+ hex characters with letters and digits, or 8+ base64
+# characters with upper and lower case and digits, so names like
+# hero-banner2x.jpg or logo-2024_final.png are not taken for one
+HEX_HASH = r'(?=[0-9a-f]*[0-9])(?=[0-9a-f]*[a-f])[0-9a-f]{8,}'
+BASE64_HASH = r'(?=[A-Za-z0-9]*[0-9])(?=[A-Za-z0-9]*[a-z])(?=[A-Za-z0-9]*[A-Z])[A-Za-z0-9]{8,}'
+FINGERPRINT_RE = re.compile(rf'[.-](?:{HEX_HASH}|{BASE64_HASH})(?:\.chunk)?\.[A-Za-z0-9]+$')
+PRECOMPRESS_SUFFIXES = {'.gz': 'gzip', '.br': 'br'}
+COMPRESSIBLE_EXTENSIONS = {'.html', '.js', '.mjs', '.css', '.json', '.svg', '.txt', '.map', '.xml'}
+
+# Vite's build manifest (build.manifest), lists every hashed output file
+BUILD_MANIFESTS = ('.vite/manifest.json', 'manifest.json')
+
+IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE = 'no-cache'
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    """SHA-256 of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hashed_outputs(static_folder):
+    """Output files listed in a Vite build manifest, None without one"""
+    for name in BUILD_MANIFESTS:
+        try:
+            with open(os.path.join(static_folder, name)) as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            continue
+        # manifest.json may just as well be a web app manifest
+        if not isinstance(entries, dict) or not all(isinstance(entry, dict) and 'file' in entry
+                                                    for entry in entries.values()):
+            continue
+        files = set()
+        for entry in entries.values():
+            files.add(entry['file'])
+            files.update(entry.get('css', ()))
+            files.update(entry.get('assets', ()))
+        return files
+    return None
+
+
+class StaticAsset:
+    __slots__ = ('path', 'abs_path', 'size', 'etag', 'mimetype', 'fingerprinted', 'variants', 'body')
+
+    def __init__(self, path, abs_path, size, etag, mimetype, fingerprinted):
+        self.path = path
+        self.abs_path = abs_path
+        self.size = size
+        self.etag = etag
+        self.mimetype = mimetype
+        self.fingerprinted = fingerprinted
+        self.variants = {}  # encoding -> (abs_path, size)
+        self.body = None  # In-memory body for index.html
+
+    def to_dict(self):
+        return {
+            'path': self.path,
+            'size': self.size,
+            'etag': self.etag,
+            'mimetype': self.mimetype,
+            'fingerprinted': self.fingerprinted,
+            'variants': {encoding: size for encoding, (_, size) in self.variants.items()}
+        }
+
+
+class StaticManifest:
+    """Map of relative static path -> StaticAsset, built once"""
+
+    def __init__(self, static_folder):
+        self.static_folder = static_folder
+        self.assets = {}
+        self.index = None
+        if static_folder and os.path.isdir(static_folder):
+            self.build()
+
+    def build(self):
+        assets = {}
+        # The build's own list of hashed files beats guessing from names
+        hashed = hashed_outputs(self.static_folder)
+        for root, _, files in os.walk(self.static_folder):
+            for name in files:
+                abs_path = os.path.join(root, name)
+                rel_path = os.path.relpath(abs_path, self.static_folder).replace(os.sep, '/')
+                base, suffix = os.path.splitext(rel_path)
+                if suffix in PRECOMPRESS_SUFFIXES and os.path.exists(os.path.join(self.static_folder, base)):
+                    continue  # Attached to the original below
+
+                mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+                asset = StaticAsset(
+                    path=rel_path,
+                    abs_path=abs_path,
+                    size=os.path.getsize(abs_path),
+                    etag=file_digest(abs_path)[:32],
+                    mimetype=mimetype,
+                    fingerprinted=rel_path in hashed if hashed is not None else bool(FINGERPRINT_RE.search(name))
+                )
+                for variant_suffix, encoding in PRECOMPRESS_SUFFIXES.items():
+                    variant_path = abs_path + variant_suffix
+                    if os.path.exists(variant_path):
+                        asset.variants[encoding] = (variant_path, os.path.getsize(variant_path))
+                assets[rel_path] = asset
+
+        self.assets = assets
+        self.index = assets.get('index.html')
+        if self.index is not None:
+            # index.html is served for every client-side route, keep it (and variants) in memory
+            with open(self.index.abs_path, 'rb') as f:
+                self.index.body = {None: f.read()}
+            for encoding, (variant_path, _) in self.index.variants.items():
+                with open(variant_path, 'rb') as f:
+                    self.index.body[encoding] = f.read()
+        return self
+
+    def get(self, path):
+        return self.assets.get(path)
+
+    def select_variant(self, asset, accept_encoding):
+        """Pick the precompressed variant the client accepts, if any"""
+        if not asset.variants:
+            return None
+        encoding = choose_encoding(accept_encoding, allow_br='br' in asset.variants)
+        if encoding in asset.variants:
+            return encoding
+        return None
+
+    def make_response(self, asset):
+        """Build a response for an asset without touching the filesystem metadata"""
+        encoding = self.select_variant(asset, request.headers.get('Accept-Encoding'))
+        etag = f'{asset.etag}-{encoding}' if encoding else asset.etag
+
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        elif asset.body is not None:
+            response = Response(asset.body[encoding], mimetype=asset.mimetype)
+        else:
+            if encoding:
+                file_path, size = asset.variants[encoding]
+            else:
+                file_path, size = asset.abs_path, asset.size
+            response = Response(
+                wrap_file(request.environ, open(file_path, 'rb')),
+                mimetype=asset.mimetype,
+                direct_passthrough=True
+            )
+            response.content_length = size
+
+        response.set_etag(etag)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        if asset.variants:
+            response.vary.add('Accept-Encoding')
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE if asset.fingerprinted else REVALIDATE_CACHE
+        return response
+
+
+def precompress(static_folder, min_size=1024):
+    """Write .gz (and .br when available) variants next to compressible assets"""
+    written = 0
+    for root, _, files in os.walk(static_folder):
+        for name in files:
+            base, ext = os.path.splitext(name)
+            if ext not in COMPRESSIBLE_EXTENSIONS:
+                continue
+            abs_path = os.path.join(root, name)
+            with open(abs_path, 'rb') as f:
+                data = f.read()
+            if len(data) < min_size:
+                continue
+            variants = [('.gz', gzip.compress(data, compresslevel=9, mtime=0))]
+            if brotli is not None:
+                variants.append(('.br', brotli.compress(data, quality=11)))
+            for suffix, compressed in variants:
+                if len(compressed) < len(data):
+                    with open(abs_path + suffix, 'wb') as f:
+                        f.write(compressed)
+                    written += 1
+    return written
+
+
+if __name__ == '__main__':
+    folder = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(__file__), 'static')
+    count = precompress(folder)
+    manifest = StaticManifest(folder)
+    print(f"Wrote {count} precompressed variants")
+    print(f"Manifest: {len(manifest.assets)} assets, "
+          f"{sum(1 for a in manifest.assets.values() if a.fingerprinted)} fingerprinted")
@@ -0,0 +1,49 @@
+from datetime import datetime
+from decimal import Decimal
+from src.models.user import db
+
+# Rollup rows for products without a category
+UNCATEGORIZED = 0
+
+class ProductDailyStats(db.Model):
+    """Sales and downloads of one product on one (UTC) day"""
+    __tablename__ = 'product_daily_stats'
+    __table_args__ = (db.Index('ix_product_daily_stats_product_day', 'product_id', 'day'),)
+
+    day = db.Column(db.Date, primary_key=True)
+    product_id = db.Column(db.Integer, primary_key=True)
+    category_id = db.Column(db.Integer, nullable=False, default=UNCATEGORIZED)
+    revenue_cents = db.Column(db.BigInteger, nullable=False, default=0)  # Exact under repeated increments
+    units = db.Column(db.Integer, nullable=False, default=0)
+    downloads = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'day': self.day,
+            'product_id': self.product_id,
+            'category_id': self.category_id or None,
+            'revenue': Decimal(self.revenue_cents) / 100,
+            'units': self.units,
+            'downloads': self.downloads
+        }
+
+class CategoryDailyStats(db.Model):
+    """Sales and downloads of one category on one (UTC) day"""
+    __tablename__ = 'category_daily_stats'
+
+    day = db.Column(db.Date, primary_key=True)
+    category_id = db.Column(db.Integer, primary_key=True)
+    revenue_cents = db.Column(db.BigInteger, nullable=False, default=0)
+    units = db.Column(db.Integer, nullable=False, default=0)
+    downloads = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'day': self.day,
+            'category_id': self.category_id or None,
+            'revenue': Decimal(self.revenue_cents) / 100,
+            'units': self.units,
+            'downloads': self.downloads
+        }
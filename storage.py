@@ -0,0 +1,186 @@
+"""
+Product file storage
+
+Files are ingested once: hashed with SHA-256 while being copied, deduplicated
+by that hash, and their size and MIME type are recorded on the Product. The
+download path then needs no stat() or hashing per request, ETag and Digest
+come straight from the row.
+
+LocalContentStore keeps files under <root>/<ab>/<cd>/<sha256>. A remote
+object store can be added by subclassing StorageBackend and registering it in
+BACKENDS; remote backends return None from local_path() and a URL from url().
+"""
+import base64
+import hashlib
+import mimetypes
+import os
+import tempfile
+from abc import ABC, abstractmethod
+from flask import current_app
+
+CHUNK_SIZE = 1024 * 1024
+
+# (offset, magic bytes, MIME type)
+MAGIC_NUMBERS = [
+    (0, b'%PDF-', 'application/pdf'),
+    (0, b'PK\x03\x04', 'application/zip'),
+    (0, b'PK\x05\x06', 'application/zip'),
+    (0, b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (0, b'\xff\xd8\xff', 'image/jpeg'),
+    (0, b'GIF8', 'image/gif'),
+    (0, b'ID3', 'audio/mpeg'),
+    (0, b'fLaC', 'audio/flac'),
+    (0, b'OggS', 'audio/ogg'),
+    (0, b'\x1f\x8b', 'application/gzip'),
+    (0, b'7z\xbc\xaf\x27\x1c', 'application/x-7z-compressed'),
+    (0, b'Rar!', 'application/vnd.rar'),
+    (4, b'ftyp', 'video/mp4'),
+]
+
+# Containers that mimetypes knows better than the magic bytes (epub, docx, ...)
+GENERIC_TYPES = {'application/zip', 'application/octet-stream'}
+
+
+def sniff_mime_type(head, filename=None):
+    """MIME type from a file's first bytes, falling back to its extension"""
+    guessed = mimetypes.guess_type(filename)[0] if filename else None
+    for offset, magic, mime_type in MAGIC_NUMBERS:
+        if head[offset:offset + len(magic)] == magic:
+            if mime_type in GENERIC_TYPES and guessed:
+                return guessed
+            return mime_type
+    return guessed or 'application/octet-stream'
+
+
+def digest_header(sha256_hex):
+    """Digest / Repr-Digest header values for a SHA-256 hex digest"""
+    encoded = base64.b64encode(bytes.fromhex(sha256_hex)).decode('ascii')
+    return f'sha-256={encoded}', f'sha-256=:{encoded}:'
+
+
+class StoredFile:
+    __slots__ = ('key', 'size', 'sha256', 'mime_type', 'created')
+
+    def __init__(self, key, size, sha256, mime_type, created):
+        self.key = key
+        self.size = size
+        self.sha256 = sha256
+        self.mime_type = mime_type
+        self.created = created  # False when an identical file was already stored
+
+
+class StorageBackend(ABC):
+    @abstractmethod
+    def ingest(self, source, filename=None):
+        """Store a file (path or binary file object) and return a StoredFile"""
+
+    @abstractmethod
+    def open(self, key):
+        pass
+
+    @abstractmethod
+    def exists(self, key):
+        pass
+
+    @abstractmethod
+    def delete(self, key):
+        pass
+
+    def local_path(self, key):
+        """Filesystem path for serving, or None for remote stores"""
+        return None
+
+    def is_stored(self, key, file_path):
+        """Whether a product's file is this store's copy of key, rather than
+        a file recorded in place that merely has that hash"""
+        return file_path == self.local_path(key)
+
+    @abstractmethod
+    def url(self, key, filename=None, expires_in=3600):
+        """Time-limited URL clients can fetch from directly, None when the app serves the file"""
+
+
+class LocalContentStore(StorageBackend):
+    """Content-addressed store on the local filesystem"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def local_path(self, key):
+        # Pure string work, no syscalls
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def exists(self, key):
+        return os.path.exists(self.local_path(key))
+
+    def url(self, key, filename=None, expires_in=3600):
+        return None  # Served from local_path()
+
+    def open(self, key):
+        return open(self.local_path(key), 'rb')
+
+    def delete(self, key):
+        try:
+            os.remove(self.local_path(key))
+        except FileNotFoundError:
+            pass
+
+    def ingest(self, source, filename=None):
+        if isinstance(source, (str, os.PathLike)):
+            filename = filename or os.path.basename(source)
+            with open(source, 'rb') as f:
+                return self._ingest_stream(f, filename)
+        return self._ingest_stream(source, filename)
+
+    def _ingest_stream(self, stream, filename):
+        os.makedirs(self.root, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        head = b''
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix='.ingest-')
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    if len(head) < 64:
+                        head += chunk[:64 - len(head)]
+                    digest.update(chunk)
+                    size += len(chunk)
+                    tmp.write(chunk)
+
+            key = digest.hexdigest()
+            path = self.local_path(key)
+            created = not os.path.exists(path)
+            if created:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+            else:
+                os.remove(tmp_path)  # Already stored, deduplicated
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        return StoredFile(key, size, key, sniff_mime_type(head, filename), created)
+
+
+BACKENDS = {
+    'local': LocalContentStore,
+}
+
+
+def get_storage(app=None):
+    """The app's storage backend, created from config on first use
+
+    STORAGE_BACKEND  name in BACKENDS (default 'local')
+    STORAGE_ROOT     root directory of the local store
+    """
+    app = app or current_app._get_current_object()
+    storage = app.extensions.get('storage')
+    if storage is None:
+        backend = BACKENDS[app.config.get('STORAGE_BACKEND', 'local')]
+        root = app.config.get('STORAGE_ROOT') or os.path.join(app.root_path, 'storage')
+        storage = app.extensions['storage'] = backend(root)
+    return storage
@@ -0,0 +1,64 @@
+"""
+INSERT ... or UPDATE the existing row, on every database
+
+PostgreSQL and SQLite get INSERT ... ON CONFLICT DO UPDATE, MySQL/MariaDB
+INSERT ... ON DUPLICATE KEY UPDATE, both as one executemany. Any other
+database falls back to an UPDATE per row and an INSERT where it matched
+nothing.
+"""
+from sqlalchemy import and_, update
+from sqlalchemy.exc import IntegrityError
+from src.models.user import db
+
+
+def upsert(model, keys, rows, replace=(), add=(), values=None):
+    """Insert rows, or update the row with the same keys
+
+    On conflict the columns in replace take the new row's value, the ones
+    in add are added to the stored value, and values (column -> constant)
+    are set as given.
+    """
+    if not rows:
+        return
+    values = values or {}
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        stmt = insert(model)
+        stmt = stmt.on_conflict_do_update(index_elements=keys, set_={
+            **{name: getattr(stmt.excluded, name) for name in replace},
+            **{name: getattr(model, name) + getattr(stmt.excluded, name) for name in add},
+            **values
+        })
+        db.session.execute(stmt, rows)
+    elif dialect in ('mysql', 'mariadb'):
+        from sqlalchemy.dialects.mysql import insert
+        stmt = insert(model)
+        stmt = stmt.on_duplicate_key_update({
+            **{name: stmt.inserted[name] for name in replace},
+            **{name: getattr(model, name) + stmt.inserted[name] for name in add},
+            **values
+        })
+        db.session.execute(stmt, rows)
+    else:
+        for row in rows:
+            _update_or_insert(model, keys, row, replace, add, values)
+
+
+def _update_or_insert(model, keys, row, replace, add, values):
+    table = model.__table__
+    stmt = update(table).where(and_(*[table.c[key] == row[key] for key in keys])).values({
+        **{name: row[name] for name in replace},
+        **{name: table.c[name] + row[name] for name in add},
+        **values
+    })
+    if db.session.execute(stmt).rowcount:
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.execute(table.insert(), [row])
+    except IntegrityError:
+        db.session.execute(stmt)  # Inserted concurrently, update that row instead
@@ -0,0 +1,174 @@
+"""
+Write-behind buffer for non-critical column updates
+
+Last-login timestamps and download analytics don't need their own commit.
+They are queued here, coalesced per row (the latest value wins) and written
+in one batched transaction every WRITE_BEHIND_INTERVAL seconds, as soon as
+WRITE_BEHIND_MAX_PENDING rows are waiting, and on shutdown.
+
+Only use it for values nothing is enforced against: limit counters such as
+download_count stay in the request's own transaction. Buffered values are
+dropped for rows that an admin bulk-updates meanwhile (rows_changed), so a
+late flush never undoes a reset. Rows that were deleted meanwhile are
+skipped, and a row whose write fails WRITE_BEHIND_MAX_ATTEMPTS flushes in a
+row is dropped rather than retried forever.
+"""
+import atexit
+import logging
+import os
+import threading
+from sqlalchemy import bindparam, update
+from flask import current_app
+from src.models.user import db
+from src.signals import rows_changed
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 5.0
+DEFAULT_MAX_PENDING = 1000
+DEFAULT_MAX_ATTEMPTS = 3
+
+
+class WriteBehind:
+    def __init__(self, app, interval=DEFAULT_INTERVAL, max_pending=DEFAULT_MAX_PENDING,
+                 max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.app = app
+        self.interval = interval
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = {}  # (model, id) -> {column: value}
+        self._failures = {}  # (model, id) -> failed flushes in a row
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        rows_changed.connect(self.discard)
+        atexit.register(self.close)
+
+    def set(self, model, row_id, **values):
+        """Queue column values for one row"""
+        if not self.interval:
+            # Write-through, e.g. for tests and one-off scripts
+            self._write({(model, row_id): values})
+            return
+        with self._lock:
+            self._ensure_thread()
+            self._pending.setdefault((model, row_id), {}).update(values)
+            full = len(self._pending) >= self.max_pending
+        if full:
+            self._wake.set()
+
+    def pending(self, model, row_id):
+        """Values queued for a row but not written yet"""
+        with self._lock:
+            return dict(self._pending.get((model, row_id), {}))
+
+    def discard(self, sender, ids=(), **kwargs):
+        """Drop queued values for rows updated elsewhere (rows_changed receiver)"""
+        with self._lock:
+            for row_id in ids:
+                self._pending.pop((sender, row_id), None)
+
+    def flush(self):
+        """Write everything queued so far in one transaction; returns the row count"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return 0
+            try:
+                self._write(batch)
+            except Exception:
+                # Put the batch back unless newer values arrived meanwhile,
+                # giving up on rows that failed too often
+                dropped = 0
+                with self._lock:
+                    for key, values in batch.items():
+                        attempts = self._failures.get(key, 0) + 1
+                        if attempts >= self.max_attempts:
+                            self._failures.pop(key, None)
+                            dropped += 1
+                            continue
+                        self._failures[key] = attempts
+                        merged = dict(values)
+                        merged.update(self._pending.get(key, {}))
+                        self._pending[key] = merged
+                if dropped:
+                    logger.warning("Write-behind dropped %d rows after %d failed flushes", dropped, self.max_attempts)
+                raise
+            if self._failures:
+                with self._lock:
+                    for key in batch:
+                        self._failures.pop(key, None)
+            return len(batch)
+
+    def _write(self, batch):
+        # Group rows by model and column set so each group is one executemany.
+        # A Core UPDATE, unlike the ORM bulk update, doesn't raise for rows
+        # that no longer exist, they just match nothing
+        groups = {}
+        for (model, row_id), values in batch.items():
+            groups.setdefault((model, tuple(sorted(values))), []).append(dict(values, _id=row_id))
+        with self.app.app_context():
+            try:
+                for (model, _), rows in groups.items():
+                    table = model.__table__
+                    db.session.execute(update(table).where(table.c.id == bindparam('_id')), rows)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+
+    def _ensure_thread(self):
+        # A forked worker inherits the object but not the thread (lock held)
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        if self._pid != os.getpid():
+            self._pending = {}
+            self._failures = {}
+        self._pid = os.getpid()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Write-behind flush failed, will retry")
+
+    def close(self):
+        """Stop the flusher and write what is left"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=self.interval + 5)
+        self._thread = None
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Final write-behind flush failed")
+
+
+def get_write_behind(app=None):
+    """The app's write-behind buffer, created from config on first use
+
+    WRITE_BEHIND_INTERVAL     seconds between flushes (0 = write through)
+    WRITE_BEHIND_MAX_PENDING  queued rows that trigger an early flush
+    WRITE_BEHIND_MAX_ATTEMPTS failed flushes after which a row is dropped
+    """
+    app = app or current_app._get_current_object()
+    buffer = app.extensions.get('write_behind')
+    if buffer is None:
+        buffer = app.extensions['write_behind'] = WriteBehind(
+            app,
+            interval=app.config.get('WRITE_BEHIND_INTERVAL', DEFAULT_INTERVAL),
+            max_pending=app.config.get('WRITE_BEHIND_MAX_PENDING', DEFAULT_MAX_PENDING),
+            max_attempts=app.config.get('WRITE_BEHIND_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS)
+        )
+    return buffer